@@ -38,9 +38,11 @@
     },
     python_requires=">=%d.%d" % (python_major, python_minor),
     install_requires=packages,
-    extra_requires={
+    extras_require={
         'dev': dev_packages[1:],
-        'test': ['pytest']
+        'test': ['pytest'],
+        'async': ['httpx>=0.24.1'],
+        'zstd': ['zstandard>=0.21.0']
     },
     package_dir={'': 'src'},
     packages=find_packages(where='src'),
@@ -4,26 +4,99 @@
 
 import json
 import sys
-from argparse import ArgumentParser
-from collections import namedtuple
+import threading
+from contextlib import nullcontext
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Iterator, List, Optional, Tuple, Union
 
 from .anonfile import *
 from .anonfile import __version__, package_name
-
+from .metrics import JSONLinesSink, PrometheusSink, RequestMetrics
+from .progress import Progress, ProgressEvent, ProgressGroup, TqdmRenderer
+
+if TYPE_CHECKING:
+    from argparse import ArgumentParser
+
+
+def __getattr__(name: str):
+    # defer importing the optional asyncio client (and httpx) until it's needed
+    if name == 'AsyncAnonFile':
+        from .aio import AsyncAnonFile
+        return AsyncAnonFile
+    # likewise for the transfer log, which depends on logging.handlers
+    if name in ('TransferLog', 'TransferLogHandler'):
+        from . import log
+        return getattr(log, name)
+    # and for the retry policy, which builds on requests and urllib3
+    if name in ('RetryPolicy', 'RetryBudget', 'CircuitBreaker', 'CircuitOpenError'):
+        from . import retry
+        return getattr(retry, name)
+    # the remaining classes are only needed by some transfers, so their modules are loaded on first use
+    if name == 'EndpointPool':
+        from .endpoints import EndpointPool
+        return EndpointPool
+    if name == 'UploadCache':
+        from .dedup import UploadCache
+        return UploadCache
+    if name == 'TransferState':
+        from .transfer import TransferState
+        return TransferState
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def str2bool(val: str) -> bool:
     return val.lower() in ('yes', 'y', 'true', 't', '1', 'on', '')
 
+def parse_rate(val: str) -> int:
+    """
+    Convert a human-readable transfer rate such as `500K` or `2.5M` to bytes per second.
+    """
+    units = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    number, unit = (val[:-1], val[-1].upper()) if val and val[-1].upper() in units else (val, '')
+    return int(float(number) * units[unit])
+
 def __from_file(path: Path) -> List[str]:
     with open(path, mode='r', encoding='utf-8') as file_handler:
         return [line.rstrip() for line in file_handler.readlines() if line[0] != '#']
 
+def __unique_path(path: Path, reserved: set) -> Path:
+    candidate, counter = path, 1
+    while candidate.exists() or candidate in reserved:
+        candidate = path.with_name(f"{path.stem} ({counter}){path.suffix}")
+        counter += 1
+    reserved.add(candidate)
+    return candidate
+
+def __run_jobs(task: Callable[[Any], Any], items: List[Any], jobs: int, ordered: bool=True, progressbar: bool=False) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+    """
+    Run `task` for each item on a pool of `jobs` worker threads and yield `(item, result, error)`
+    tuples, either in input order or as soon as they complete. A failing item doesn't affect the
+    remaining ones; its exception is returned in place of the result instead.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    from tqdm import tqdm
+
+    def safe_task(item: Any) -> Tuple[Any, Any, Optional[Exception]]:
+        try:
+            return item, task(item), None
+        except Exception as error:
+            return item, None, error
+
+    options = AnonFile._progressbar_options(None, "Total", unit='it', total=len(items), disable=progressbar and jobs > 1)
+    with ThreadPoolExecutor(max_workers=jobs) as executor, tqdm(**options) as tqdm_handler:
+        futures = [executor.submit(safe_task, item) for item in items]
+        for future in (futures if ordered else as_completed(futures)):
+            yield future.result()
+            tqdm_handler.update()
+
 def format_proxies(proxies: str) -> dict:
     return {prot: f"{prot}://{ip}" for (prot, ip) in [proxy.split('://') for proxy in proxies.split()]}
 
 def build_parser(package_name: str, version: str) -> ArgumentParser:
+    # only the command line needs these, so they don't count towards `import anonfile`
+    from argparse import ArgumentParser
+    from datetime import datetime
+
     parser = ArgumentParser(prog=package_name)
     parser._positionals.title = 'Commands'
     parser._optionals.title = 'Arguments'
@@ -33,17 +106,36 @@ def build_parser(package_name: str, version: str) -> ArgumentParser:
     parser.add_argument('--no-verbose', dest='verbose', action='store_false', help="run commands silently")
     parser.add_argument('-l', '--logging', default=True, action='store_true', help="enable URL logging (default)")
     parser.add_argument('--no-logging', dest='logging', action='store_false', help="disable all logging activities")
-    parser.add_argument('-a', '--api', type=str, default=None, help="configure API endpoint (optional)")
+    parser.add_argument('-a', '--api', type=str, action='append', default=None, help="configure an API endpoint, repeat to fail over between several (optional)")
     parser.add_argument('-t', '--token', type=str, default='secret', help="configure an API token (optional)")
-    parser.add_argument('-a', '--user-agent', type=str, default=None, help="configure custom User-Agent (optional)")
+    parser.add_argument('--user-agent', type=str, default=None, help="configure custom User-Agent (optional)")
     parser.add_argument('-p', '--proxies', type=str, default=None, help="configure HTTP and/or HTTPS proxies (optional)")
+    parser.add_argument('--limit-rate', type=parse_rate, default=None, help="cap the download bandwidth, e.g. 500K or 2M (optional)")
+    parser.add_argument('--limit-upload-rate', type=parse_rate, default=None, help="cap the upload bandwidth, e.g. 500K or 2M (optional)")
+    parser.add_argument('--cache', default=False, action='store_true', help="persist preview meta data in the config directory")
+    parser.add_argument('--metrics', type=Path, default=None, help="record per-request timings in this file (optional)")
+    parser.add_argument('--metrics-format', choices=['jsonl', 'prometheus'], default='jsonl', help="file format of the recorded timings (jsonl by default)")
+    parser.add_argument('--cache-ttl', type=float, default=MetadataCache._ttl, help="number of seconds before cached meta data expires (%(default)s by default)")
 
     subparser = parser.add_subparsers(dest='command')
     upload_parser = subparser.add_parser('upload', help="upload a file to https://anonfiles.com")
-    upload_parser.add_argument('-f', '--file', nargs='+', type=Path, help="one or more files to upload.", required=True)
+    upload_parser.add_argument('-f', '--file', nargs='+', type=Path, help="one or more files or directories to upload, or '-' to read from stdin", required=True)
+    upload_parser.add_argument('-n', '--name', type=str, default=None, help="file name to use when reading from stdin")
+    upload_parser.add_argument('-d', '--digest', choices=['md5', 'sha256', 'blake2b'], default=None, help="compute a checksum while uploading")
+    upload_parser.add_argument('--include', nargs='+', type=str, default=None, metavar='PATTERN', help="only archive files in directories that match these glob patterns")
+    upload_parser.add_argument('--exclude', nargs='+', type=str, default=None, metavar='PATTERN', help="skip files and directories that match these glob patterns")
+    upload_parser.add_argument('--compress', choices=list(compression_suffixes), default=None, help="compress files and directory archives on the fly (zstd requires the zstandard package)")
+    upload_parser.add_argument('--dedup', default=False, action='store_true', help="skip files whose contents were uploaded before and are still online")
+    upload_parser.add_argument('--force', default=False, action='store_true', help="upload even if a file was uploaded before (with --dedup)")
+    upload_parser.add_argument('--timeout', type=float, default=AnonFile._upload_timeout, help="number of seconds to wait for the server to process an upload (%(default)s by default)")
+    upload_parser.add_argument('-j', '--jobs', type=int, default=1, help="number of files to upload concurrently (1 by default)")
+    upload_parser.add_argument('--unordered', dest='ordered', action='store_false', help="print results as soon as they complete")
 
     preview_parser = subparser.add_parser('preview', help="read meta data from a file on https://anonfiles.com")
     preview_parser.add_argument('-u', '--url', nargs='+', type=str, help="one or more URLs to preview", required=True)
+    preview_parser.add_argument('--no-ddl', dest='ddl', action='store_false', help="skip the landing pages and leave the direct download links out, e.g. to check for dead links")
+    preview_parser.add_argument('-j', '--jobs', type=int, default=AnonFile._pool_maxsize, help="number of URLs to preview concurrently (%(default)s by default)")
+    preview_parser.add_argument('--unordered', dest='ordered', action='store_false', help="print results as soon as they complete")
 
     download_parser = subparser.add_parser('download', help="download a file from https://anonfiles.com")
     download_urls_group = download_parser.add_mutually_exclusive_group(required=True)
@@ -52,24 +144,85 @@ def build_parser(package_name: str, version: str) -> ArgumentParser:
     download_parser.add_argument('-p', '--path', type=Path, default=Path.cwd(), help="download directory (CWD by default)")
     download_parser.add_argument('-c', '--check', default=True, action='store_true', help="check for duplicates (default)")
     download_parser.add_argument('--no-check', dest='check', action='store_false', help="disable checking for duplicates")
+    download_parser.add_argument('--on-conflict', choices=['ask', 'skip', 'overwrite', 'rename'], default='ask', help="how to handle duplicates (ask by default)")
+    download_parser.add_argument('-s', '--segments', type=int, default=1, help="number of concurrent connections per download (1 by default)")
+    download_parser.add_argument('-d', '--digest', choices=['md5', 'sha256', 'blake2b'], default=None, help="compute a checksum while downloading")
+    download_parser.add_argument('--expected-digest', type=str, default=None, help="fail if the checksum doesn't match, e.g. sha256:<hex>")
+    download_parser.add_argument('-x', '--extract', default=False, action='store_true', help="unpack tar archives into the download directory while downloading")
+    download_parser.add_argument('--decompress', default=False, action='store_true', help="decompress gzip and zstd files while downloading")
+    download_parser.add_argument('-o', '--output', type=Path, default=None, help="stream the files into this file or pipe instead of the download directory, or '-' for stdout")
+    download_parser.add_argument('--preallocate', default=False, action='store_true', help="reserve disk space for each file before downloading it")
+    download_parser.add_argument('-j', '--jobs', type=int, default=1, help="number of files to download concurrently (1 by default)")
+    download_parser.add_argument('--unordered', dest='ordered', action='store_false', help="print results as soon as they complete")
+
+    cache_parser = subparser.add_parser('cache', help="access the preview meta data and upload caches")
+    cache_parser.add_argument('--clear', action='store_true', help="remove all cache entries")
+    cache_parser.add_argument('--prune', action='store_true', help="remove uploads that are no longer online from the upload cache")
+    cache_parser.add_argument('--path', action='store_true', help="return the cache file paths")
+
+    serve_parser = subparser.add_parser('serve', help="process upload and download jobs from a spool directory")
+    serve_parser.add_argument('--spool', type=Path, default=None, help="directory to watch for job files (spool in the config directory by default)")
+    serve_parser.add_argument('--socket', type=Path, default=None, help="also accept jobs on this Unix socket (optional)")
+    serve_parser.add_argument('-p', '--path', type=Path, default=Path.cwd(), help="download directory (CWD by default)")
+    serve_parser.add_argument('-j', '--jobs', type=int, default=4, help="number of jobs to run concurrently (%(default)s by default)")
+    serve_parser.add_argument('-s', '--segments', type=int, default=1, help="number of concurrent connections per download (1 by default)")
+    serve_parser.add_argument('-d', '--digest', choices=['md5', 'sha256', 'blake2b'], default=None, help="compute a checksum while transferring")
+    serve_parser.add_argument('--compress', choices=list(compression_suffixes), default=None, help="compress uploads on the fly (zstd requires the zstandard package)")
+    serve_parser.add_argument('--decompress', default=False, action='store_true', help="decompress gzip and zstd files while downloading")
+    serve_parser.add_argument('--preallocate', default=False, action='store_true', help="reserve disk space for each file before downloading it")
+    serve_parser.add_argument('--dedup', default=False, action='store_true', help="skip files whose contents were uploaded before and are still online")
+    serve_parser.add_argument('--interval', type=float, default=1.0, help="number of seconds between scans of the spool directory (%(default)s by default)")
 
     log_parser = subparser.add_parser('log', help="access the anonfile logger")
     log_parser.add_argument('--reset', action='store_true', help="reset all log file entries")
     log_parser.add_argument('--path', action='store_true', help="return the log file path")
     log_parser.add_argument('--read', action='store_true', help='read the log file')
+    log_parser.add_argument('--tail', type=int, default=None, metavar='N', help="read the last N records only")
+    log_parser.add_argument('--since', type=datetime.fromisoformat, default=None, help="read records logged at or after this time, e.g. 2023-07-18 or 2023-07-18T12:00")
+    log_parser.add_argument('--grep', type=str, default=None, metavar='PATTERN', help="read records that match this regular expression only")
+    log_parser.add_argument('--find', type=str, default=None, metavar='URL_OR_ID', help="look up the latest record of a URL or file ID")
 
     return parser
 
 def main():
     parser = build_parser(package_name, __version__)
+    anon, sink, group = None, None, None
 
     try:
         args = parser.parse_args()
 
-        anon = AnonFile(url=args.api,
+        # deferred until after parsing so that --help and --version return quickly
+        from tqdm import tqdm
+
+        from .dedup import UploadCache
+
+        # files streamed into the same output are written one after another
+        jobs = max(getattr(args, 'jobs', 1), 1) if getattr(args, 'output', None) is None else 1
+        cache_path = get_config_dir().joinpath('cache.json')
+        # an in-memory cache is always in use so that duplicate checks don't cost an extra preview
+        cache = MetadataCache(ttl=args.cache_ttl, path=cache_path if args.cache else None)
+        retry_policy = None
+        if args.verbose and jobs > 1 and args.command in ('upload', 'download'):
+            # one bar for the bytes of all concurrent transfers, next to the one that counts them
+            group = ProgressGroup([TqdmRenderer()], name="Transferred")
+        if args.metrics is not None:
+            sink = JSONLinesSink(args.metrics) if args.metrics_format == 'jsonl' else PrometheusSink()
+        if isinstance(sink, PrometheusSink):
+            from .retry import RetryPolicy
+            retry_policy = RetryPolicy(observers=[sink.retry_observer])
+        anon = AnonFile(url=args.api[0] if args.api and len(args.api) == 1 else args.api,
                         token=args.token,
                         user_agent=args.user_agent,
-                        proxies=format_proxies(args.proxies) if args.proxies else None)
+                        proxies=format_proxies(args.proxies) if args.proxies else None,
+                        upload_timeout=getattr(args, 'timeout', AnonFile._upload_timeout),
+                        pool_maxsize=max(AnonFile._pool_maxsize, jobs * getattr(args, 'segments', 1)),
+                        cache=cache,
+                        download_limiter=RateLimiter(args.limit_rate) if args.limit_rate else None,
+                        upload_limiter=RateLimiter(args.limit_upload_rate) if args.limit_upload_rate else None,
+                        observers=[sink] if sink is not None else None,
+                        upload_cache=UploadCache() if getattr(args, 'dedup', False) or args.command == 'cache' else None,
+                        retry_policy=retry_policy,
+                        listeners=[group] if group is not None else None)
 
         if args.command is None:
             raise UserWarning("missing a command")
@@ -77,61 +230,193 @@ def main():
         if args.user_agent is not None:
             anon.user_agent = args.user_agent
 
+        failures = 0
+        progressbar = args.verbose and jobs == 1
+
         if args.command == 'upload':
-            for file in args.file:
-                upload = anon.upload(file, progressbar=args.verbose, enable_logging=args.logging)
-                print(f"URL: {upload.url.geturl()}")
+            if Path('-') in args.file and args.name is None:
+                raise UserWarning("reading from stdin requires a file name (--name)")
+
+            def upload(file: Path) -> ParseResponse:
+                source = sys.stdin.buffer if file == Path('-') else file
+                name = args.name if source is sys.stdin.buffer else None
+                return anon.upload(source,
+                                   progressbar=progressbar,
+                                   enable_logging=args.logging,
+                                   name=name,
+                                   digest=args.digest,
+                                   dedup=not args.force,
+                                   include=args.include,
+                                   exclude=args.exclude,
+                                   compress=args.compress).compact()
+
+            for (file, result, error) in __run_jobs(upload, args.file, jobs, args.ordered, args.verbose):
+                if error is not None:
+                    tqdm.write(f"error: {str(file)!r}: {error}", file=sys.stderr)
+                    failures += 1
+                    continue
+                tqdm.write(f"URL: {result.url.geturl()}" + (f" ({result.digest})" if result.digest else ''))
 
         if args.command == 'preview':
-            for url in args.url:
-                preview = anon.preview(url)
+            for preview in anon.preview_many(args.url, concurrency=jobs, resolve_ddl=args.ddl, ordered=args.ordered, return_exceptions=True):
+                if isinstance(preview, PreviewError):
+                    tqdm.write(f"error: {preview.url!r}: {preview.__cause__}", file=sys.stderr)
+                    failures += 1
+                    continue
                 response = {
                     'Status': 'online' if preview.status else 'offline',
-                    'File Path': preview.file_path.name,
+                    # without the landing page, only the slug of the file name is known
+                    'File Path': preview.file_path.name if preview.ddl is not None else '',
                     'URL': preview.url.geturl(),
-                    'DDL': preview.ddl.geturl(),
+                    'DDL': preview.ddl.geturl() if preview.ddl is not None else '',
                     'ID': preview.id,
                     'Size': preview.size_readable,
                 }
 
-                print(json.dumps(response, indent=4) if args.verbose else ','.join(response.values))
+                tqdm.write(json.dumps(response, indent=4) if args.verbose else ','.join(response.values()))
 
         if args.command == 'download':
-            for url in (args.url or __from_file(args.batch_file)):
-                download = lambda url: anon.download(url, args.path, progressbar=args.verbose, enable_logging=args.logging)
-
-                if args.check and anon.preview(url, args.path).file_path.exists():
+            if args.output is not None and args.extract:
+                raise UserWarning("--output can't be combined with --extract")
+
+            # names handed out to the URLs of this batch, and one lock per name so
+            # that two downloads never write to the same partial file at once
+            reserved, locks, lock = set(), {}, threading.Lock()
+
+            def resolve(url: str) -> Optional[str]:
+                """
+                Return the file name to download `url` to, or `None` to skip this URL.
+                A name that an earlier URL of this batch resolved to counts as a
+                duplicate, even if that download hasn't started yet.
+                """
+                file_path = anon.preview(url, args.path).file_path
+                if args.decompress and file_path.suffix in compression_suffixes.values():
+                    file_path = file_path.with_suffix('')
+                if args.extract or args.output is not None:
+                    return file_path.name
+                with lock:
+                    duplicate = args.check and (file_path.exists() or file_path in reserved)
+                    if not duplicate or args.on_conflict == 'overwrite':
+                        reserved.add(file_path)
+                        return file_path.name
+                    if args.on_conflict == 'rename':
+                        return __unique_path(file_path, reserved).name
+                if args.on_conflict == 'ask':
                     print(f"Warning: A file with the same name already exists in {str(args.path)!r}.")
-                    prompt = input("Proceed with download? [Y/n] ")
-                    if str2bool(prompt):
-                        print(f"File: {download(url).file_path}")
+                    if str2bool(input("Proceed with download? [Y/n] ")):
+                        return file_path.name
+                return None
+
+            def download(url: str, filename: Optional[str], output: Optional[BinaryIO]) -> Optional[ParseResponse]:
+                if filename is None:
+                    return None
+                with lock:
+                    name_lock = locks.setdefault(filename, threading.Lock())
+                with name_lock:
+                    return anon.download(url, args.path,
+                                         progressbar=progressbar,
+                                         enable_logging=args.logging,
+                                         segments=args.segments,
+                                         filename=filename,
+                                         digest=args.digest,
+                                         expected_digest=args.expected_digest,
+                                         extract=args.extract,
+                                         decompress=args.decompress,
+                                         preallocate=args.preallocate,
+                                         output=output).compact()
+
+            urls = args.url or __from_file(args.batch_file)
+            # keep stdout clean for the data when streaming there
+            to_stdout = args.output == Path('-')
+            with nullcontext(sys.stdout.buffer) if to_stdout else open(args.output, mode='wb') if args.output else nullcontext() as output:
+                settled = args.on_conflict == 'ask' and jobs > 1
+                if settled:
+                    # settle all prompts up front, the workers can't share the terminal;
+                    # a URL that can't be resolved fails in its worker like any other
+                    filenames = []
+                    for url in urls:
+                        try:
+                            filenames.append(resolve(url))
+                        except Exception as error:
+                            filenames.append(error)
+                    items = list(zip(urls, filenames))
                 else:
-                    print(f"File: {download(url).file_path}")
-
-        if args.command == 'log':
-            if args.reset:
-                open(get_logfile_path(), mode='w', encoding='utf-8').close()
+                    items = [(url, None) for url in urls]
+
+                def task(item: Tuple[str, Union[str, Exception, None]]) -> Optional[ParseResponse]:
+                    (url, filename) = item
+                    if isinstance(filename, Exception):
+                        raise filename
+                    return download(url, filename if settled else resolve(url), output)
+
+                for ((url, _), result, error) in __run_jobs(task, items, jobs, args.ordered, args.verbose):
+                    if error is not None:
+                        tqdm.write(f"error: {url!r}: {error}", file=sys.stderr)
+                        failures += 1
+                    elif result is not None:
+                        message = f"File: {args.output or result.file_path}" + (f" ({result.digest})" if result.digest else '')
+                        tqdm.write(message, file=sys.stderr if to_stdout else sys.stdout)
+
+        if args.command == 'cache':
+            if args.clear:
+                cache_path.unlink() if cache_path.exists() else None
+                anon.upload_cache.invalidate()
+            if args.prune:
+                removed = anon.upload_cache.prune(lambda entry: anon.is_available(entry['id']))
+                print(f"Removed {removed} upload(s) that are no longer online")
             if args.path:
-                print(get_logfile_path())
-            if args.read:
-                with open(get_logfile_path(), mode='r', encoding='utf-8') as file_handler:
-                    log = file_handler.readlines()
+                print(cache_path)
+                print(anon.upload_cache.path)
 
-                    if not log:
-                        msg = "Nothing to read because the log file is empty"
-                        print(f"\033[33m{'[ WARNING ]'.ljust(12, ' ')}\033[0m{msg}")
-                        return
+        if args.command == 'serve':
+            import signal
 
-                    parse = lambda line: line.strip('\n').split('::')
-                    Entry = namedtuple('Entry', 'timestamp method url')
+            from .serve import SpoolDaemon
 
-                    tabulate = "{:<19} {:<8} {:<30}".format
+            daemon = SpoolDaemon(anon, args.spool or get_config_dir().joinpath('spool'), args.path, jobs, args.interval, args.socket,
+                                 download_options={'segments': args.segments, 'digest': args.digest, 'decompress': args.decompress,
+                                                   'preallocate': args.preallocate, 'enable_logging': args.logging},
+                                 upload_options={'digest': args.digest, 'compress': args.compress, 'enable_logging': args.logging})
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_: daemon.stop())
+            if args.verbose:
+                print(f"Watching {str(daemon.spool)!r} with {daemon.jobs} worker(s)", file=sys.stderr)
+            daemon.serve()
 
-                    print(f"\033[32m{tabulate('Date', 'Method', 'URL')}\033[0m")
+        if args.command == 'log':
+            from .log import TransferLog
 
-                    for line in log:
-                        entry = Entry(parse(line)[0], parse(line)[1], parse(line)[2])
-                        print(tabulate(entry.timestamp, entry.method, entry.url))
+            log = TransferLog(get_logfile_path())
+            # compare in local time, like the timestamps in the log
+            since = TransferLog.localize(args.since) if args.since is not None else None
+            if args.reset:
+                log.reset()
+            if args.path:
+                print(log.path)
+            if args.find is not None:
+                records = [record for record in [log.find(args.find)] if record is not None]
+            elif args.tail is not None:
+                records = [record for record in log.tail(args.tail, args.grep) if since is None or (TransferLog.timestamp(record) or since) >= since]
+            elif args.read or since is not None or args.grep is not None:
+                records = log.records(since, args.grep)
+            else:
+                records = None
+
+            if records is not None:
+                tabulate = "{:<19} {:<8} {:>10} {:<30}".format
+                empty = True
+                for record in records:
+                    if empty:
+                        print(f"\033[32m{tabulate('Date', 'Method', 'Size', 'URL')}\033[0m")
+                        empty = False
+                    print(tabulate(record.get('timestamp', '').replace('T', ' '), record.get('method', ''), record.get('size') or '', record.get('url', '')))
+
+                if empty:
+                    msg = "Nothing to read because no log entries match"
+                    print(f"\033[33m{'[ WARNING ]'.ljust(12, ' ')}\033[0m{msg}")
+
+        if failures:
+            raise RuntimeError(f"{failures} item(s) failed")
 
     except UserWarning as bad_human:
         print(f"error: {bad_human}")
@@ -140,6 +425,15 @@ def main():
     except Exception as error:
         print(error, file=sys.stderr)
         sys.exit(1)
+    finally:
+        if anon is not None:
+            anon.close()
+        if group is not None:
+            group.close()
+        if isinstance(sink, JSONLinesSink):
+            sink.close()
+        elif isinstance(sink, PrometheusSink):
+            sink.write(args.metrics)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+"""
+Native asyncio client for the anonfiles API. This module requires the optional
+`httpx` dependency (`pip install anonfile[async]`).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+import uuid
+from pathlib import Path
+from contextlib import nullcontext
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple, Union
+from urllib.parse import ParseResult, urljoin, urlparse
+
+import httpx
+
+from .anonfile import MB, AnonFile, DDLNotFoundError, ParseResponse, _DDLScanner, _log_transfer, __version__, package_name
+from .progress import Progress, ProgressEvent, TqdmRenderer
+
+
+class AsyncAnonFile:
+    """
+    The asynchronous counterpart of `AnonFile`. All instances share one connection
+    pool per client, and at most `concurrency` requests are in flight at any given
+    time. Like `AnonFile`, transfers report their progress to each of the
+    `listeners`, at most `progress_rate` times per second and transfer.
+
+    Basic Usage
+    -----------
+
+    ```
+    import asyncio
+    from anonfile import AsyncAnonFile
+
+    async def main():
+        async with AsyncAnonFile() as anon:
+            previews = [anon.preview(url) for url in urls]
+            async for preview in anon.as_completed(previews):
+                print(preview)
+
+    asyncio.run(main())
+    ```
+    """
+    _concurrency = 10
+    _pool_maxsize = 100
+
+    __slots__ = ['endpoint', 'token', 'timeout', 'total', 'status_forcelist', 'backoff_factor', 'user_agent', 'proxies',
+                 'concurrency', 'pool_maxsize', 'listeners', 'progress_rate', '_client', '_semaphore']
+
+    def __init__(self,
+                 url: str = AnonFile._endpoint,
+                 token: str="undefined",
+                 timeout: Tuple[float,float]=AnonFile._timeout,
+                 total: int=AnonFile._total,
+                 status_forcelist: List[int]=AnonFile._status_forcelist,
+                 backoff_factor: int=AnonFile._backoff_factor,
+                 user_agent: str=AnonFile._user_agent,
+                 proxies: dict=AnonFile._proxies,
+                 concurrency: int=_concurrency,
+                 pool_maxsize: int=_pool_maxsize,
+                 listeners: List[Callable[[ProgressEvent], None]]=AnonFile._listeners,
+                 progress_rate: float=AnonFile._progress_rate) -> AsyncAnonFile:
+        self.endpoint = url or AnonFile._endpoint
+        self.token = token
+        self.timeout = timeout
+        self.total = total
+        self.status_forcelist = status_forcelist
+        self.backoff_factor = backoff_factor
+        self.user_agent = user_agent
+        self.proxies = proxies
+        self.concurrency = concurrency
+        self.pool_maxsize = pool_maxsize
+        self.listeners = list(listeners or [])
+        self.progress_rate = progress_rate
+        self._client = None
+        self._semaphore = None
+
+    async def __aenter__(self) -> AsyncAnonFile:
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Return the HTTP client owned by this instance. It is created lazily on first
+        access, so that it binds to the running event loop.
+        """
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.pool_maxsize, max_keepalive_connections=self.pool_maxsize)
+            mounts = {
+                f"{scheme}://": httpx.AsyncHTTPTransport(proxy=httpx.Proxy(proxy), limits=limits)
+                for (scheme, proxy) in (self.proxies or {}).items() if scheme in ('http', 'https')
+            }
+            self._client = httpx.AsyncClient(
+                headers={'User-Agent': self.user_agent or f"{package_name}/{__version__}"},
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=limits,
+                mounts=mounts,
+                follow_redirects=True
+            )
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """
+        Return the semaphore that bounds the number of concurrent transfers of this client.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def aclose(self) -> None:
+        """
+        Close the underlying HTTP client and release all pooled connections.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __send(self, request: httpx.Request, stream: bool=False) -> httpx.Response:
+        """
+        Send `request` and retry on connection errors or status codes listed in
+        `status_forcelist`, with an exponential backoff between attempts. Raise
+        an `httpx.HTTPStatusError` if the last attempt was unsuccessful.
+        """
+        for attempt in range(self.total + 1):
+            try:
+                response = await self.client.send(request, stream=stream)
+            except httpx.TransportError:
+                if attempt == self.total:
+                    raise
+            else:
+                if response.status_code not in self.status_forcelist or attempt == self.total:
+                    if response.is_error and stream:
+                        await response.aread()
+                    response.raise_for_status()
+                    return response
+                await response.aclose()
+            await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+
+    async def __get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.__send(self.client.build_request('GET', url, **kwargs))
+
+    def __progress(self, operation: str, name: str, total: Optional[int], progressbar: bool) -> Optional[Progress]:
+        """
+        Return a progress tracker that reports to the `listeners` of this instance
+        (and to a progressbar if `progressbar` is set), or `None` if nobody listens.
+        """
+        listeners = self.listeners + [TqdmRenderer()] if progressbar else self.listeners
+        return Progress(operation, name, total, listeners, self.progress_rate) if listeners else None
+
+    @staticmethod
+    async def __multipart(path: Path, boundary: str, progress: Optional[Progress]) -> AsyncIterator[bytes]:
+        """
+        Stream the multipart encoded body of `path` without loading the file into memory.
+        """
+        loop = asyncio.get_running_loop()
+        yield AnonFile._multipart_preamble(path.name, boundary)
+        with open(path, mode='rb') as file_handler:
+            while chunk := await loop.run_in_executor(None, file_handler.read, 1*MB):
+                if progress is not None:
+                    progress.update(len(chunk))
+                yield chunk
+        yield AnonFile._multipart_epilogue(boundary)
+
+    async def upload(self, path: Union[str, Path], progressbar: bool=False, enable_logging: bool=False) -> ParseResponse:
+        """
+        Upload a file located in `path` to http://anonfiles.com. The request body
+        is streamed from disk. See `AnonFile.upload` for more details.
+        """
+        start = time.perf_counter()
+        path = Path(path)
+        size = os.stat(path).st_size
+        boundary = uuid.uuid4().hex
+        length = len(AnonFile._multipart_preamble(path.name, boundary)) + size + len(AnonFile._multipart_epilogue(boundary))
+
+        async with self.semaphore:
+            with self.__progress('upload', path.name, size, progressbar) or nullcontext() as progress:
+                request = self.client.build_request(
+                    'POST',
+                    urljoin(self.endpoint, 'upload'),
+                    params={'token': self.token},
+                    headers={'Content-Type': f"multipart/form-data; boundary={boundary}", 'Content-Length': str(length)},
+                    content=AsyncAnonFile.__multipart(path, boundary, progress)
+                )
+                response = await self.client.send(request)
+                response.raise_for_status()
+
+        upload = ParseResponse(response, path, None)
+        _log_transfer('upload', upload.url.geturl(), upload, time.perf_counter() - start, enable_logging)
+        return upload
+
+    async def __extract_ddl(self, url: str) -> ParseResult:
+        """
+        Stream the landing page of `url` until the first direct download link shows up.
+        """
+        scanner = _DDLScanner()
+        page = await self.__send(self.client.build_request('GET', url), stream=True)
+        try:
+            async for chunk in page.aiter_text():
+                ddl = scanner.feed(chunk)
+                if ddl is not None:
+                    return ddl
+        finally:
+            await page.aclose()
+        raise DDLNotFoundError("no direct download link found on the landing page")
+
+    async def preview(self, url: str, path: Union[str, Path]=Path.cwd()) -> ParseResponse:
+        """
+        Obtain meta data associated with this `url` without commiting to a time-
+        consuming download. See `AnonFile.preview` for more details.
+        """
+        async with self.semaphore:
+            response = await self.__get(urljoin(self.endpoint, f"v2/file/{urlparse(url).path.split('/')[1]}/info"))
+            ddl = await self.__extract_ddl(url)
+        return ParseResponse(response, Path(path).joinpath(Path(ddl.path).name), ddl)
+
+    async def download(self, url: str, path: Union[str, Path]=Path.cwd(), progressbar: bool=False, enable_logging: bool=False) -> ParseResponse:
+        """
+        Download a file from https://anonfiles.com given a `url` into the directory
+        `path`. The response stream is written to disk on a worker thread so that
+        the event loop never blocks on file I/O. See `AnonFile.download` for more details.
+        """
+        start = time.perf_counter()
+        download = await self.preview(url, path)
+        loop = asyncio.get_running_loop()
+
+        async with self.semaphore:
+            with open(download.file_path, mode='wb') as file_handler, \
+                 self.__progress('download', download.id, download.size, progressbar) or nullcontext() as progress:
+                response = await self.__send(self.client.build_request('GET', download.ddl.geturl()), stream=True)
+                try:
+                    async for chunk in response.aiter_bytes(chunk_size=1*MB):
+                        await loop.run_in_executor(None, file_handler.write, chunk)
+                        if progress is not None:
+                            progress.update(len(chunk))
+                finally:
+                    await response.aclose()
+
+        _log_transfer('download', url, download, time.perf_counter() - start, enable_logging)
+        return download
+
+    @staticmethod
+    async def as_completed(aws: Iterable[Awaitable[ParseResponse]]) -> AsyncIterator[ParseResponse]:
+        """
+        Yield the results of `aws` in the order in which they complete.
+        """
+        for future in asyncio.as_completed(list(aws)):
+            yield await future
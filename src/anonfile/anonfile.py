@@ -27,30 +27,46 @@
 from __future__ import annotations
 
 import html
+import itertools
+import json
 import logging
 import os
-import platform
 import re
 import sys
-from dataclasses import dataclass
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager, nullcontext
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterable, Iterator, List, Optional, TextIO, Tuple, TypeVar, Union
 from urllib.parse import ParseResult, urljoin, urlparse
-from urllib.request import getproxies
 
-import requests
-from requests import Session
-from requests.adapters import HTTPAdapter
-from requests.models import Response
-from requests_toolbelt import MultipartEncoderMonitor, user_agent
-from tqdm import tqdm
-from urllib3 import Retry
+from .metrics import RequestMetrics
+from .progress import Progress, ProgressEvent, TqdmRenderer
 
-__version__ = "1.0.2"
+# requests, requests_toolbelt and tqdm account for most of the import time, so
+# they are only imported by the methods that need them
+if TYPE_CHECKING:
+    import tarfile
+
+    from requests import Session
+    from requests.models import Response
+    from requests_toolbelt import MultipartEncoderMonitor
 
-from urllib3.util import Url
+    from .dedup import UploadCache
+    from .endpoints import EndpointPool
+    from .retry import RetryPolicy
+    from .transfer import TransferState, _WriteBehind
+    from urllib3 import Retry
+    from urllib3.util import Url
+
+__version__ = "1.0.2"
 
 package_name = "anonfile"
+MB = 1_048_576
+compression_suffixes = {'gzip': '.gz', 'zstd': '.zst'}
+_T = TypeVar('_T')
 python_major = "3"
 python_minor = "8"
 
@@ -67,10 +83,10 @@ def get_config_dir() -> Path:
     """
     default_dir = Path.home().joinpath('.config')
     return {
-        'Windows': Path(os.path.expandvars('%LOCALAPPDATA%')),
-        'Darwin': Path.home().joinpath('Library').joinpath('Application Support'),
-        'Linux': default_dir
-    }.get(platform.system(), default_dir).joinpath(package_name)
+        'win32': Path(os.path.expandvars('%LOCALAPPDATA%')),
+        'darwin': Path.home().joinpath('Library').joinpath('Application Support'),
+        'linux': default_dir
+    }.get(sys.platform, default_dir).joinpath(package_name)
 
 def get_logfile_path() -> Path:
     """
@@ -82,31 +98,268 @@ def get_logfile_path() -> Path:
     log_file.touch(exist_ok=True)
     return log_file
 
+class _DeferredHandler(logging.Handler):
+    """
+    Handler that sets up the rotating transfer log when the first record is
+    emitted, so that importing this module neither touches the file system
+    nor imports `logging.handlers`.
+    """
+    def __init__(self) -> _DeferredHandler:
+        super().__init__()
+        self._handler = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self._handler is None:
+            from .log import TransferLogHandler
+            self._handler = TransferLogHandler(get_config_dir().joinpath("anonfile.log"))
+        self._handler.handle(record)
+
+    def close(self) -> None:
+        if self._handler is not None:
+            self._handler.close()
+        super().close()
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s::%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-file_handler = logging.FileHandler(get_logfile_path())
-file_handler.setFormatter(formatter)
+file_handler = _DeferredHandler()
 logger.addHandler(file_handler)
 
+def _log_transfer(method: str, url: str, result: ParseResponse, duration: float, enable_logging: bool) -> None:
+    """
+    Append a structured record of an upload or download to the transfer log.
+    """
+    if enable_logging:
+        transfer = {
+            'url': url,
+            'id': result.id,
+            'name': str(result.file_path.name),
+            'size': result.size,
+            'digest': result.digest,
+            'duration': round(duration, 3),
+        }
+        logger.info(method, extra={'transfer': transfer})
+
 #endregion
 
-@dataclass(frozen=True)
+class DDLNotFoundError(LookupError):
+    """
+    Raised when the landing page of a file doesn't contain a direct download link.
+    """
+
+class PreviewError(LookupError):
+    """
+    Raised (or yielded) by `AnonFile.preview_many` when the preview of `url` fails.
+    The original exception is chained as `__cause__`.
+    """
+    def __init__(self, url: str, error: Exception) -> PreviewError:
+        super().__init__(f"{url}: {error}")
+        self.url = url
+        self.__cause__ = error
+
+class _DDLScanner:
+    """
+    Incrementally search the HTML source of a landing page for the first direct
+    download link. Only a short tail of the text fed so far is retained, so that
+    links spanning two chunks are still found.
+    """
+    pattern = re.compile(r'''(?:href|value)\s*=\s*['"]([^'"<>]*?cdn-[^'"<>]*)['"]''', re.I)
+    overlap = 4096
+
+    __slots__ = ['_buffer']
+
+    def __init__(self) -> _DDLScanner:
+        self._buffer = ''
+
+    def feed(self, chunk: str) -> Optional[ParseResult]:
+        """
+        Scan the next `chunk` of text. Return the first link found so far, else `None`.
+        """
+        self._buffer += chunk
+        match = _DDLScanner.pattern.search(self._buffer)
+        if match is not None:
+            return urlparse(html.unescape(match.group(1)))
+        self._buffer = self._buffer[-_DDLScanner.overlap:]
+        return None
+
+def extract_ddl(page: Union[str, Iterable[str]]) -> ParseResult:
+    """
+    Return the direct download link embedded in the HTML source of a file's
+    landing `page`. The page may also be an iterable of text chunks, which is
+    only consumed up to the first link. Raise a `DDLNotFoundError` if the page
+    doesn't contain a link.
+    """
+    scanner = _DDLScanner()
+    for chunk in ([page] if isinstance(page, str) else page):
+        ddl = scanner.feed(chunk)
+        if ddl is not None:
+            return ddl
+    raise DDLNotFoundError("no direct download link found on the landing page")
+
+class ChecksumError(ValueError):
+    """
+    Raised when the digest of a downloaded file doesn't match the expected digest.
+    """
+
+class _Checksum:
+    """
+    Compute a digest incrementally while data is transferred. Chunks are hashed
+    in order: data arriving ahead of the current offset (e.g. from other segments)
+    is skipped and read back from disk by `catch_up` later on.
+    """
+    __slots__ = ['algorithm', 'offset', '_hash', '_lock']
+
+    def __init__(self, algorithm: str) -> _Checksum:
+        self.algorithm = algorithm
+        self.offset = 0
+        import hashlib
+        self._hash = hashlib.new(algorithm)
+        self._lock = threading.Lock()
+
+    def update(self, chunk: bytes, offset: Optional[int]=None) -> None:
+        with self._lock:
+            if offset is None or offset == self.offset:
+                self._hash.update(chunk)
+                self.offset += len(chunk)
+
+    def catch_up(self, file_path: Path, end: int) -> None:
+        """
+        Hash the bytes between the current offset and `end` by reading them from `file_path`.
+        """
+        with self._lock, open(file_path, mode='rb') as file_handler:
+            file_handler.seek(self.offset)
+            while self.offset < end and (chunk := file_handler.read(min(1*MB, end - self.offset))):
+                self._hash.update(chunk)
+                self.offset += len(chunk)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+class _MonitoredReader:
+    """
+    Wrap a binary file object, feed all data read from it into a checksum and
+    pace reads with a rate limiter. All other attributes are delegated to the
+    wrapped file object.
+    """
+    __slots__ = ['_file_handler', '_checksum', '_limiter']
+
+    def __init__(self, file_handler: BinaryIO, checksum: Optional[_Checksum], limiter: Optional[RateLimiter]) -> _MonitoredReader:
+        self._file_handler = file_handler
+        self._checksum = checksum
+        self._limiter = limiter
+
+    def __getattr__(self, name: str):
+        return getattr(self._file_handler, name)
+
+    def read(self, *args) -> bytes:
+        chunk = self._file_handler.read(*args)
+        if self._limiter is not None:
+            self._limiter.consume(len(chunk))
+        if self._checksum is not None:
+            self._checksum.update(chunk)
+        return chunk
+
+class _ChunkSizer:
+    """
+    Adapt the size of network reads to the observed throughput. The size doubles
+    while reads complete in less than half of `target` seconds and halves while
+    they take more than twice as long, which keeps progress updates and the
+    latency of each hand-off steady from dial-up speeds to fast local networks.
+    """
+    _minimum = 64*1024
+    _maximum = 4*MB
+    _target = 0.25
+
+    __slots__ = ['size', 'minimum', 'maximum', 'target']
+
+    def __init__(self, minimum: int=_minimum, maximum: int=_maximum, target: float=_target) -> _ChunkSizer:
+        self.maximum = max(maximum, 1)
+        self.minimum = min(minimum, self.maximum)
+        self.target = target
+        self.size = self.minimum
+
+    def update(self, length: int, elapsed: float) -> None:
+        """
+        Record that reading `length` bytes took `elapsed` seconds.
+        """
+        if length < self.size:
+            # short reads say nothing about the throughput (e.g. the end of the body)
+            return
+        if elapsed < self.target / 2:
+            self.size = min(self.size * 2, self.maximum)
+        elif elapsed > self.target * 2:
+            self.size = max(self.size // 2, self.minimum)
+
+@dataclass(frozen=True, init=False)
 class ParseResponse:
     """
     Data class that is primarily used as a structured return type for the upload,
-    preview and download methods.
+    preview and download methods. The JSON body of the HTTP response is decoded
+    once on construction; call `compact` to drop the response object itself when
+    keeping many results around. If a transfer was checksummed, `digest` holds
+    the digest in the `<algorithm>:<hex>` format.
     """
-    response: Response
+    __slots__ = ['response', 'file_path', 'ddl', 'data', 'digest']
+
+    response: Optional[Response]
     file_path: Path
-    ddl: ParseResult
+    ddl: Optional[ParseResult]
+    data: dict
+    digest: Optional[str]
+
+    def __init__(self,
+                 response: Optional[Response],
+                 file_path: Path,
+                 ddl: Optional[ParseResult],
+                 data: Optional[dict]=None,
+                 digest: Optional[str]=None) -> ParseResponse:
+        object.__setattr__(self, 'response', response)
+        object.__setattr__(self, 'file_path', file_path)
+        object.__setattr__(self, 'ddl', ddl)
+        object.__setattr__(self, 'data', response.json() if data is None else data)
+        object.__setattr__(self, 'digest', digest)
 
     @property
     def json(self) -> dict:
         """
         Return the entire HTTP response.
         """
-        return self.response.json()
+        return self.data
+
+    def compact(self) -> ParseResponse:
+        """
+        Return a copy of this record without a reference to the HTTP response.
+        """
+        return ParseResponse(None, self.file_path, self.ddl, self.data, self.digest)
+
+    def to_dict(self) -> dict:
+        """
+        Return the extracted fields of this record as a JSON serializable dictionary.
+        """
+        if not self.data['status']:
+            return {'status': False, 'file_path': str(self.file_path), 'error': self.data.get('error')}
+        return {
+            'status': True,
+            'file_path': str(self.file_path),
+            'url': self.url.geturl(),
+            'ddl': self.ddl.geturl() if self.ddl is not None else None,
+            'id': self.id,
+            'name': str(self.name),
+            'size': self.size,
+            'size_readable': self.size_readable,
+            'digest': self.digest,
+        }
+
+    @staticmethod
+    def dump(results: Iterable[ParseResponse], file_handler: TextIO) -> int:
+        """
+        Write `results` to `file_handler` in the JSON lines format, one record per
+        line. Return the number of records written.
+        """
+        count = 0
+        for count, result in enumerate(results, start=1):
+            file_handler.write(json.dumps(result.to_dict()))
+            file_handler.write('\n')
+        return count
 
     @property
     def status(self) -> bool:
@@ -169,6 +422,165 @@ def __repr__(self) -> str:
 
     #endregion
 
+class RateLimiter:
+    """
+    A thread-safe token bucket that caps throughput at `rate` bytes per second,
+    allowing bursts of up to `burst` bytes (one second worth of data by default).
+    Share one instance between transfers (or `AnonFile` objects) to limit their
+    aggregate bandwidth.
+
+    Example
+    -------
+
+    ```
+    from anonfile import AnonFile, RateLimiter
+
+    # cap all downloads at 2MB/s
+    anon = AnonFile(download_limiter=RateLimiter(2 * 1_048_576))
+    ```
+    """
+    __slots__ = ['rate', 'burst', '_tokens', '_timestamp', '_lock']
+
+    def __init__(self, rate: float, burst: Optional[float]=None) -> RateLimiter:
+        if rate <= 0:
+            raise ValueError("rate must be a positive number")
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._timestamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        """
+        Withdraw `amount` bytes from the bucket, and block until the transfer of
+        these bytes is within the rate limit. Concurrent callers are served in order,
+        since each one reserves its share before going to sleep.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._timestamp) * self.rate) - amount
+            self._timestamp = now
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+class MetadataCache:
+    """
+    A size-bounded LRU cache for the meta data returned by the preview method,
+    keyed by file ID. Each entry stores the JSON of the info endpoint together
+    with the resolved direct download link, and expires after `ttl` seconds.
+    Entries are persisted to `path` if set, else the cache lives in memory only.
+
+    Example
+    -------
+
+    ```
+    from anonfile import AnonFile, MetadataCache, get_config_dir
+
+    cache = MetadataCache(ttl=600, path=get_config_dir().joinpath('cache.json'))
+    anon = AnonFile(cache=cache)
+    ```
+    """
+    _ttl = 3600
+    _maxsize = 1024
+    _save_interval = 5
+
+    __slots__ = ['ttl', 'maxsize', 'path', '_entries', '_lock', '_last_save', '_dirty']
+
+    def __init__(self, ttl: float=_ttl, maxsize: int=_maxsize, path: Optional[Union[str, Path]]=None) -> MetadataCache:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.path = Path(path) if path is not None else None
+        self._entries = None
+        self._lock = threading.RLock()
+        self._last_save = time.monotonic()
+        self._dirty = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.entries)
+
+    @property
+    def entries(self) -> OrderedDict:
+        """
+        Return all entries in LRU order, loading them from disk on first access.
+        """
+        if self._entries is None:
+            self._entries = OrderedDict()
+            if self.path is not None and self.path.exists():
+                try:
+                    with open(self.path, mode='r', encoding='utf-8') as file_handler:
+                        self._entries.update(json.load(file_handler))
+                except (OSError, ValueError):
+                    pass
+        return self._entries
+
+    def get(self, file_id: str) -> Optional[dict]:
+        """
+        Return the entry for `file_id`, or `None` if it's missing or expired.
+        """
+        with self._lock:
+            entry = self.entries.get(file_id)
+            if entry is None:
+                return None
+            if time.time() - entry['time'] > self.ttl:
+                self.invalidate(file_id)
+                return None
+            self.entries.move_to_end(file_id)
+            return entry
+
+    def set(self, file_id: str, data: dict, ddl: str) -> None:
+        """
+        Store the info JSON `data` and the direct download link `ddl` of `file_id`,
+        and evict the least recently used entries beyond `maxsize`.
+        """
+        with self._lock:
+            self.entries[file_id] = {'time': time.time(), 'json': data, 'ddl': ddl}
+            self.entries.move_to_end(file_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            self.__changed()
+
+    def invalidate(self, file_id: Optional[str]=None) -> None:
+        """
+        Remove the entry for `file_id`, or all entries if `file_id` is `None`.
+        """
+        with self._lock:
+            if file_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(file_id, None)
+            self.__changed()
+
+    def __changed(self) -> None:
+        self._dirty = True
+        if time.monotonic() - self._last_save > MetadataCache._save_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write pending changes to disk. This is a no-op for in-memory caches.
+        """
+        with self._lock:
+            if self.path is None or not self._dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with open(tmp_path, mode='w', encoding='utf-8') as file_handler:
+                json.dump(self.entries, file_handler)
+            os.replace(tmp_path, self.path)
+            self._last_save, self._dirty = time.monotonic(), False
+
+class _Measurement:
+    """
+    Mutable state of a request that is being measured, see `AnonFile.__measure`.
+    """
+    __slots__ = ['response', 'bytes_sent']
+
+    def __init__(self) -> _Measurement:
+        self.response = None
+        self.bytes_sent = 0
+
 class AnonFile:
     """
     The unofficial Python API for https://anonfiles.com.
@@ -185,36 +597,103 @@ class AnonFile:
     # topsecret.mkv
     print(preview)
     ```
+
+    Progress
+    --------
+
+    Uploads and downloads report their progress as `ProgressEvent` records to
+    each of the `listeners`, at most `progress_rate` times per second and transfer.
+    `ProgressGroup` combines concurrent transfers into one view, and `TqdmRenderer`
+    draws the progressbars that are shown with `progressbar=True`.
+
+    ```
+    from anonfile import AnonFile
+
+    def show(event):
+        print(f"{event.name}: {event.completed} of {event.total} bytes at {event.rate:.0f} B/s")
+
+    anon = AnonFile(listeners=[show])
+    anon.download('https://anonfiles.com/b7NaVd0cu3/topsecret_mkv')
+    ```
     """
+    _endpoint = "https://anonfiles.se/api"
     _timeout = (5, 5)
+    _upload_timeout = 600
     _total = 5
     _status_forcelist = [413, 429, 500, 502, 503, 504]
     _backoff_factor = 1
     _user_agent = None
     _proxies = None
+    _pool_connections = 10
+    _pool_maxsize = 10
+    _cache = None
+    _download_limiter = None
+    _upload_limiter = None
+    _observers = None
+    _upload_cache = None
+    _retry_policy = None
+    _listeners = None
+    _progress_rate = Progress._rate
 
-    __slots__ = ['endpoint', 'token', 'timeout', 'total', 'status_forcelist', 'backoff_factor', 'user_agent', 'proxies']
+    __slots__ = ['endpoint', 'token', 'timeout', 'upload_timeout', 'total', 'status_forcelist', 'backoff_factor', 'user_agent', 'proxies',
+                 'pool_connections', 'pool_maxsize', 'cache', 'download_limiter', 'upload_limiter', 'observers', 'upload_cache',
+                 'endpoints', 'retry_policy', 'listeners', 'progress_rate', '_session', '_lock']
 
     def __init__(self,
-                 url: Union[Url, str] = "https://anonfiles.se/api",
+                 url: Union[Url, str, List[str], EndpointPool] = _endpoint,
                  token: str="undefined",
                  timeout: Tuple[float,float]=_timeout,
+                 upload_timeout: float=_upload_timeout,
                  total: int=_total,
                  status_forcelist: List[int]=_status_forcelist,
                  backoff_factor: int=_backoff_factor,
                  user_agent: str=_user_agent,
-                 proxies: dict=_proxies) -> AnonFile:
-        self.endpoint = url
+                 proxies: dict=_proxies,
+                 pool_connections: int=_pool_connections,
+                 pool_maxsize: int=_pool_maxsize,
+                 cache: MetadataCache=_cache,
+                 download_limiter: RateLimiter=_download_limiter,
+                 upload_limiter: RateLimiter=_upload_limiter,
+                 observers: List[Callable[[RequestMetrics], None]]=_observers,
+                 upload_cache: UploadCache=_upload_cache,
+                 retry_policy: RetryPolicy=_retry_policy,
+                 listeners: List[Callable[[ProgressEvent], None]]=_listeners,
+                 progress_rate: float=_progress_rate) -> AnonFile:
+        if url is None or isinstance(url, str):
+            self.endpoints = None
+        else:
+            from .endpoints import EndpointPool
+            self.endpoints = url if isinstance(url, EndpointPool) else EndpointPool(url) if isinstance(url, (list, tuple)) else None
+        self.endpoint = self.endpoints.urls[0] if self.endpoints is not None else url or AnonFile._endpoint
         self.token = token
         self.timeout = timeout
-        self.total = total,
-        self.status_forcelist = status_forcelist,
+        self.upload_timeout = upload_timeout
+        self.total = total
+        self.status_forcelist = status_forcelist
         self.backoff_factor = backoff_factor
         self.user_agent = user_agent
         self.proxies = proxies
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.cache = cache
+        self.download_limiter = download_limiter
+        self.upload_limiter = upload_limiter
+        self.observers = list(observers or [])
+        self.upload_cache = upload_cache
+        self.retry_policy = retry_policy
+        self.listeners = list(listeners or [])
+        self.progress_rate = progress_rate
+        self._session = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> AnonFile:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
 
     @staticmethod
-    def __progressbar_options(iterable, desc, unit, color: str="\033[32m", char='\u25CB', total=None, disable=False) -> dict:
+    def _progressbar_options(iterable, desc, unit, color: str="\033[32m", char='\u25CB', total=None, disable=False) -> dict:
         """
         Return custom optional arguments for `tqdm` progressbars.
         """
@@ -226,7 +705,7 @@ def __progressbar_options(iterable, desc, unit, color: str="\033[32m", char='\u2
             'unit': unit.rjust(1, ' '),
             'unit_scale': True,
             'unit_divisor': 1024,
-            'total': len(iterable) if total is None else total,
+            'total': len(iterable) if total is None and iterable is not None else total,
             'disable': not disable
         }
 
@@ -236,46 +715,260 @@ def retry_strategy(self) -> Retry:
         The retry strategy returns the retry configuration made up of the
         number of total retries, the status forcelist as well as the backoff
         factor. It is used in the session property where these values are
-        passed to the HTTPAdapter.
+        passed to the HTTPAdapter. Retries follow the `retry_policy` of this
+        instance, which is created on first use unless one was passed in.
         """
-        return Retry(total=self.total, status_forcelist=self.status_forcelist, backoff_factor=self.backoff_factor)
+        if self.retry_policy is None:
+            from .retry import RetryPolicy
+            self.retry_policy = RetryPolicy()
+        return self.retry_policy.retry(self.total, self.status_forcelist, self.backoff_factor)
 
     @property
     def session(self) -> Session:
         """
-        Create a custom session object. A request session provides cookie
-        persistence, connection-pooling, and further configuration options.
+        Return the session object owned by this instance. A request session provides
+        cookie persistence, connection-pooling, and further configuration options.
+        The session is created lazily on first access and reused afterwards, so that
+        consecutive requests (also from worker threads) share one connection pool of
+        up to `pool_maxsize` connections per host.
         """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self.__create_session()
+                    if self.endpoints is not None and len(self.endpoints.urls) > 1:
+                        self.endpoints.start(self.__check_endpoint)
+        return self._session
+
+    def __create_session(self) -> Session:
+        """
+        Create a custom session object.
+        """
+        import requests
+        from requests_toolbelt import user_agent
+
         session = requests.Session()
-        session.mount("https://", HTTPAdapter(max_retries=self.retry_strategy))
+        retry_strategy = self.retry_strategy
+        adapter = self.retry_policy.adapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry_strategy)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if self.endpoints is not None and len(self.endpoints.urls) > 1:
+            # fail over to the next endpoint instead of waiting through the entire retry schedule
+            retry_once = retry_strategy.new(total=1, backoff_factor=0, respect_retry_after_header=False)
+            failover = self.retry_policy.adapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry_once)
+            for url in self.endpoints.urls:
+                session.mount(url, failover)
         session.hooks['response'] = [lambda response, *args, **kwargs: response.raise_for_status()]
         session.headers.update({
             'User-Agent' : self.user_agent or user_agent(package_name, __version__)
         })
         return session
 
+    def close(self) -> None:
+        """
+        Close the underlying session and release all pooled connections. The next
+        request creates a new session, which also picks up changes made to the
+        retry and pool settings in the meantime. Pending changes to the meta data
+        cache and the endpoint health are written to disk.
+        """
+        if self.cache is not None:
+            self.cache.flush()
+        if self.upload_cache is not None:
+            self.upload_cache.close()
+        if self.endpoints is not None:
+            self.endpoints.stop()
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __proxies(self) -> dict:
+        """
+        Return the proxies of this instance, or the system's proxy settings if unset.
+        """
+        from urllib.request import getproxies
+        return self.proxies or getproxies()
+
     def __get(self, url: str, **kwargs) -> Response:
         """
         Returns the GET request encoded in `utf-8`. Adds proxies to this session
         on the fly if urllib is able to pick up the system's proxy settings.
         """
-        response = self.session.get(url, timeout=self.timeout, proxies=self.proxies or getproxies(), **kwargs)
+        response = self.session.get(url, timeout=self.timeout, proxies=self.__proxies(), **kwargs)
         response.encoding = 'utf-8'
         return response
 
+    @contextmanager
+    def __measure(self, operation: str, method: str, url: str) -> Iterator[_Measurement]:
+        """
+        Measure the request made in this context and report a `RequestMetrics`
+        record to all `observers` on exit. Assign the response to `response` once
+        it's available; the record is created after the response body has been
+        consumed, so that `duration` and `bytes_received` cover the transfer.
+        """
+        from .retry import connection_phases
+
+        measurement, error, start = _Measurement(), None, time.perf_counter()
+        # connections are only timed while somebody is listening
+        with connection_phases() if self.observers else nullcontext({}) as phases:
+            try:
+                yield measurement
+            except Exception as exception:
+                error = exception
+                raise
+            finally:
+                if self.observers:
+                    self.__report(operation, method, url, measurement, error, time.perf_counter() - start, phases)
+
+    def __report(self,
+                 operation: str,
+                 method: str,
+                 url: str,
+                 measurement: _Measurement,
+                 error: Optional[Exception],
+                 duration: float,
+                 phases: dict) -> None:
+        """
+        Report a `RequestMetrics` record of a measured request to all `observers`.
+        """
+        response = measurement.response if measurement.response is not None else getattr(error, 'response', None)
+        # `elapsed` includes setting up new connections, which is reported separately
+        setup = sum(phases.values())
+        metrics = RequestMetrics(
+            operation=operation,
+            method=method,
+            url=url,
+            status=response.status_code if response is not None else None,
+            retries=AnonFile.__read_attr(lambda: len(response.raw.retries.history)),
+            bytes_sent=measurement.bytes_sent,
+            bytes_received=AnonFile.__read_attr(lambda: response.raw.tell()),
+            ttfb=max(response.elapsed.total_seconds() - setup, 0) if response is not None else None,
+            duration=duration,
+            error=type(error).__name__ if error is not None else None,
+            dns=phases.get('dns'),
+            connect=phases.get('connect'),
+            tls=phases.get('tls')
+        )
+        for observer in self.observers:
+            observer(metrics)
+
+    @staticmethod
+    def __read_attr(getter: Callable[[], int]) -> int:
+        """
+        Return the integer produced by `getter`, or zero if the underlying response
+        doesn't provide it (e.g. because the request never got that far).
+        """
+        try:
+            return int(getter())
+        except (AttributeError, TypeError, ValueError):
+            return 0
+
     @staticmethod
-    def __callback(monitor: MultipartEncoderMonitor, tqdm_handler: tqdm):
+    def __count_chunks(chunks: Iterable[bytes], measurement: _Measurement) -> Iterator[bytes]:
+        for chunk in chunks:
+            measurement.bytes_sent += len(chunk)
+            yield chunk
+
+    def __progress(self, operation: str, name: str, total: Optional[int], progressbar: bool, completed: int=0) -> Optional[Progress]:
+        """
+        Return a progress tracker that reports to the `listeners` of this instance
+        (and to a progressbar if `progressbar` is set), or `None` if nobody listens.
+        """
+        listeners = self.listeners + [TqdmRenderer()] if progressbar else self.listeners
+        return Progress(operation, name, total, listeners, self.progress_rate, completed) if listeners else None
+
+    @staticmethod
+    def __callback(monitor: MultipartEncoderMonitor, progress: Progress):
         """
         Define a multi part encoder monitor callback function for the upload method.
         """
-        tqdm_handler.total = monitor.len
-        tqdm_handler.update(monitor.bytes_read - tqdm_handler.n)
+        progress.total = monitor.len
+        progress.update(monitor.bytes_read - progress.completed)
+
+    @staticmethod
+    def _multipart_preamble(name: str, boundary: str) -> bytes:
+        """
+        Return the multipart header that precedes the file contents in a request body.
+        """
+        filename = name.replace('"', '%22')
+        return (
+            f"--{boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+
+    @staticmethod
+    def _multipart_epilogue(boundary: str) -> bytes:
+        """
+        Return the closing delimiter of a multipart request body.
+        """
+        return f"\r\n--{boundary}--\r\n".encode()
+
+    @staticmethod
+    def __multipart_stream(name: str,
+                           chunks: Iterable[bytes],
+                           boundary: str,
+                           progress: Optional[Progress],
+                           checksum: Optional[_Checksum],
+                           limiter: Optional[RateLimiter]) -> Iterator[bytes]:
+        """
+        Generate a multipart encoded request body from `chunks` of unknown total size.
+        """
+        yield AnonFile._multipart_preamble(name, boundary)
+        for chunk in chunks:
+            if limiter is not None:
+                limiter.consume(len(chunk))
+            if progress is not None:
+                progress.update(len(chunk))
+            if checksum is not None:
+                checksum.update(chunk)
+            yield chunk
+        yield AnonFile._multipart_epilogue(boundary)
 
-    def upload(self, path: Union[str, Path], progressbar: bool=False, enable_logging: bool=False) -> ParseResponse:
+    def upload(self,
+               path: Union[str, Path, BinaryIO, Iterable[bytes]],
+               progressbar: bool=False,
+               enable_logging: bool=False,
+               name: str=None,
+               digest: str=None,
+               dedup: bool=True,
+               include: List[str]=None,
+               exclude: List[str]=None,
+               compress: str=None) -> ParseResponse:
         """
         Upload a file located in `path` to http://anonfiles.com. Set
         `enable_logging` to `True` to store the URL in a global config file.
 
+        Instead of a file path, `path` may also be a binary file object (such as
+        `sys.stdin.buffer`) or an iterable of bytes, in which case `name` is required.
+        The request body is streamed in constant memory. Sources of unknown size
+        (pipes and iterators) are sent with chunked transfer encoding.
+
+        Set `digest` to a `hashlib` algorithm such as `'md5'`, `'sha256'` or `'blake2b'`
+        to compute a checksum of the file while it's being uploaded; it is stored
+        in the `digest` field of the result.
+
+        If this instance has an `upload_cache`, a file whose contents were uploaded
+        before is not sent again as long as the remote copy is still available;
+        the result then describes the existing upload. Set `dedup` to `False` to
+        upload anyway (the cache is updated with the new URL either way).
+
+        If `path` is a directory, its contents are streamed as a tar archive named
+        after the directory while the tree is walked, so that no temporary archive
+        is written to disk. Restrict the archive to files that match one of the glob
+        patterns in `include` and none in `exclude` (matched against paths relative
+        to `path`). The progressbar tracks the summed size of all files in the archive.
+
+        Set `compress` to `'gzip'` or `'zstd'` (which requires the optional `zstandard`
+        package) to compress files, streams and directory archives on the fly; the
+        matching suffix is appended to `name`. Compressed uploads are always sent
+        with chunked transfer encoding, the progressbar shows the rate of uncompressed
+        data along with the compression ratio, and `digest` covers the compressed data.
+
+        The server only responds once it has processed the entire file, so uploads
+        wait up to `upload_timeout` seconds (10 minutes by default) for the response
+        instead of the read timeout in `timeout`. Raise it for very large files.
+
         Example
         -------
 
@@ -292,27 +985,179 @@ def upload(self, path: Union[str, Path], progressbar: bool=False, enable_logging
         Note
         ----
         Although `anonfile` offers unlimited bandwidth, uploads cannot exceed a
-        file size of 20GB in theory. Due to technical difficulties in the implementation,
-        the upper cap occurs much earlier at around 500MB.
-        """
-        path = Path(path)
-        size = os.stat(path).st_size
-        options = AnonFile.__progressbar_options(None, f"Upload: {path.name}", unit='B', total=size, disable=progressbar)
-        with open(path, mode='rb') as file_handler:
-            fields = {'file': (path.name, file_handler, 'application/octet-stream')}
-            with tqdm(**options) as tqdm_handler:
-                encoder_monitor = MultipartEncoderMonitor.from_fields(fields, callback=lambda monitor: AnonFile.__callback(monitor, tqdm_handler))
-                response = self.session.post(
-                    urljoin(self.endpoint, 'upload'),
-                    data=encoder_monitor,
-                    params={'token': self.token},
-                    headers={'Content-Type': encoder_monitor.content_type},
-                    timeout=self.timeout,
-                    proxies=getproxies(),
-                    verify=True
-                )
-                logger.log(logging.INFO if enable_logging else logging.NOTSET, "upload::%s", response.json()['data']['file']['url']['full'])
-                return ParseResponse(response, path, None)
+        file size of 20GB. Because the server may take a while to process large
+        files, the read timeout doesn't apply while waiting for the upload response.
+        """
+        import uuid
+
+        from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
+
+        from .streams import _Compressor, _TarStream
+
+        start = time.perf_counter()
+        is_path = isinstance(path, (str, os.PathLike))
+        archive = _TarStream(Path(path), include, exclude) if is_path and os.path.isdir(path) else None
+        compressor = _Compressor(compress) if compress else None
+        key = self.upload_cache.fingerprint(path) if self.upload_cache is not None and is_path and archive is None else None
+        if key is not None and compressor is not None:
+            key = f"{key}:{compressor.algorithm}"
+        if key is not None and dedup:
+            upload = self.__find_upload(key, path, (name or Path(path).name) + (compressor.suffix if compressor else ''), digest)
+            if upload is not None:
+                _log_transfer('upload', upload.url.geturl(), upload, time.perf_counter() - start, enable_logging)
+                return upload
+
+        with ExitStack() as stack:
+            if archive is not None:
+                (source, name) = (archive, name or archive.name)
+            elif is_path:
+                source = stack.enter_context(open(path, mode='rb'))
+                name = name or Path(path).name
+            elif name is None:
+                raise ValueError("a file name is required when uploading from a stream")
+            else:
+                source = path
+            if compressor is not None:
+                name += compressor.suffix
+
+            seekable = compressor is None and hasattr(source, 'seekable') and source.seekable()
+            if seekable:
+                offset = source.tell()
+                size = source.seek(0, os.SEEK_END) - offset
+                source.seek(offset)
+            else:
+                size = None
+
+            checksum = _Checksum(digest) if digest else None
+            total = archive.size if archive else size if seekable or not is_path else os.stat(path).st_size
+            progress = self.__progress('upload', name, total, progressbar)
+            if progress is not None:
+                stack.enter_context(progress)
+            # the request body can't be replayed, so uploads don't fail over but pick the best endpoint
+            endpoint = self.endpoints.ranked()[0] if self.endpoints is not None else self.endpoint
+            upload_url = urljoin(endpoint, 'upload')
+            measurement = stack.enter_context(self.__measure('upload', 'POST', upload_url))
+            if seekable:
+                reader = _MonitoredReader(source, checksum, self.upload_limiter) if checksum or self.upload_limiter else source
+                fields = {'file': (name, reader, 'application/octet-stream')}
+                if progress is not None:
+                    data = MultipartEncoderMonitor.from_fields(fields, callback=lambda monitor: AnonFile.__callback(monitor, progress))
+                else:
+                    data = MultipartEncoder(fields)
+                content_type = data.content_type
+                measurement.bytes_sent = data.len
+            else:
+                boundary = uuid.uuid4().hex
+                if archive is not None:
+                    chunks = archive.chunks(progress)
+                else:
+                    chunks = iter(lambda: source.read(1*MB), b'') if hasattr(source, 'read') else source
+                if compressor is not None:
+                    chunks = compressor.stream(chunks, progress, update=archive is None)
+                tracked = archive is None and compressor is None
+                data = AnonFile.__multipart_stream(name, chunks, boundary, progress if tracked else None, checksum, self.upload_limiter)
+                data = AnonFile.__count_chunks(data, measurement) if self.observers else data
+                content_type = f"multipart/form-data; boundary={boundary}"
+
+            if self.endpoints is not None:
+                stack.enter_context(self.endpoints.observe(endpoint, timed=False))
+            response = measurement.response = self.session.post(
+                upload_url,
+                data=data,
+                params={'token': self.token},
+                headers={'Content-Type': content_type},
+                timeout=(self.timeout[0], self.upload_timeout),
+                proxies=self.__proxies(),
+                verify=True
+            )
+            upload = ParseResponse(response, Path(name), None, digest=f"{digest}:{checksum.hexdigest()}" if checksum else None)
+            if key is not None and upload.data.get('status'):
+                self.upload_cache.set(key, upload)
+            _log_transfer('upload', upload.url.geturl(), upload, time.perf_counter() - start, enable_logging)
+            return upload
+
+    def __find_upload(self, key: str, path: Union[str, Path], name: str, digest: Optional[str]) -> Optional[ParseResponse]:
+        """
+        Return the upload recorded for the content address `key` if the remote file
+        is still available, else forget about it and return `None`.
+        """
+        import requests
+
+        entry = self.upload_cache.get(key)
+        if entry is None:
+            return None
+        try:
+            (response, data) = self.__info(entry['id'])
+        except requests.HTTPError as error:
+            if error.response is not None and error.response.status_code == 404:
+                self.upload_cache.invalidate(key)
+            return None
+        if not data.get('status'):
+            self.upload_cache.invalidate(key)
+            return None
+
+        compressed = len(key.split(':')) > 3
+        if digest and (entry.get('digest') or '').startswith(f"{digest}:"):
+            digest = entry['digest']
+        elif digest == 'sha256' and not compressed:
+            digest = f"sha256:{key.split(':')[1]}"
+        elif digest and not compressed:
+            checksum = _Checksum(digest)
+            checksum.catch_up(Path(path), int(key.split(':')[2]))
+            digest = f"{digest}:{checksum.hexdigest()}"
+        else:
+            # the checksum of compressed data can't be derived from the file
+            digest = None
+        return ParseResponse(response, Path(name), None, data, digest)
+
+    def __check_endpoint(self, endpoint: str) -> None:
+        """
+        Send a cheap request to `endpoint` to probe its health. Any response short
+        of a server error means that the endpoint is up.
+        """
+        self.session.get(urljoin(endpoint, "v2/file/probe/info"), timeout=self.timeout, proxies=self.__proxies()).close()
+
+    def __route(self, request: Callable[[str], _T]) -> _T:
+        """
+        Call `request` with the best endpoint of the endpoint pool, and fail over to
+        the next endpoint if it fails with a connection error, a timeout or a server
+        error. Without a pool, `request` is called with `endpoint` once.
+        """
+        if self.endpoints is None:
+            return request(self.endpoint)
+        candidates = self.endpoints.ranked()
+        for (index, endpoint) in enumerate(candidates):
+            try:
+                with self.endpoints.observe(endpoint):
+                    return request(endpoint)
+            except Exception as error:
+                if index == len(candidates) - 1 or not self.endpoints.is_failure(error):
+                    raise
+
+    def __info(self, file_id: str) -> Tuple[Response, dict]:
+        """
+        Return the response and the decoded JSON of the info endpoint for `file_id`.
+        """
+        def request(endpoint: str) -> Tuple[Response, dict]:
+            info_url = urljoin(endpoint, f"v2/file/{file_id}/info")
+            with self.__measure('info', 'GET', info_url) as measurement, self.__get(info_url) as response:
+                measurement.response = response
+                return response, response.json()
+        return self.__route(request)
+
+    def is_available(self, url: str) -> bool:
+        """
+        Return whether the file behind `url` (or a file ID) still exists on the server.
+        """
+        import requests
+
+        file_id = urlparse(url).path.split('/')[1] if '/' in url else url
+        try:
+            return bool(self.__info(file_id)[1].get('status'))
+        except requests.HTTPError as error:
+            if error.response is not None and error.response.status_code == 404:
+                return False
+            raise
 
     def preview(self, url: str, path: Union[str, Path]=Path.cwd()) -> ParseResponse:
         """
@@ -331,19 +1176,389 @@ def preview(self, url: str, path: Union[str, Path]=Path.cwd()) -> ParseResponse:
         # File Size: 116271961B
         print(f"File Size: {preview.size}B")
         ```
+
+        Note
+        ----
+        If this instance has a `cache`, the meta data and the direct download link
+        are served from there as long as the entry is fresh, which saves both round
+        trips.
+        """
+        file_id = urlparse(url).path.split('/')[1]
+        entry = self.cache.get(file_id) if self.cache is not None else None
+        if entry is not None:
+            ddl = urlparse(entry['ddl'])
+            return ParseResponse(None, Path(path).joinpath(Path(ddl.path).name), ddl, entry['json'])
+
+        (response, data) = self.__info(file_id)
+        # stop reading the landing page (and drop the connection) as soon as the link shows up
+        with self.__measure('page', 'GET', url) as measurement, self.__get(url, stream=True) as page:
+            measurement.response = page
+            ddl = extract_ddl(page.iter_content(chunk_size=16*1024, decode_unicode=True))
+        file_path = Path(path).joinpath(Path(ddl.path).name)
+        preview = ParseResponse(response, file_path, ddl, data)
+        if self.cache is not None and preview.data.get('status'):
+            self.cache.set(file_id, preview.data, ddl.geturl())
+        return preview
+
+    def __lookup(self, url: str, path: Union[str, Path], resolve_ddl: bool) -> Union[ParseResponse, PreviewError]:
+        """
+        Return the preview of `url`, or the error that prevented it. The landing
+        page is only fetched if `resolve_ddl` is set and the link isn't cached.
         """
-        with self.__get(urljoin(self.endpoint, f"v2/file/{urlparse(url).path.split('/')[1]}/info")) as response:
-            links = re.findall(r'''.*?(?:href|value)=['"](.*?)['"].*?''', html.unescape(self.__get(url).text), re.I)
-            ddl = urlparse(next(filter(lambda link: 'cdn-' in link, links)))
-            file_path = Path(path).joinpath(Path(ddl.path).name)
-            return ParseResponse(response, file_path, ddl)
+        try:
+            file_id = urlparse(url).path.split('/')[1]
+            if resolve_ddl or (self.cache is not None and self.cache.get(file_id) is not None):
+                return self.preview(url, path)
+            (response, data) = self.__info(file_id)
+            name = data['data']['file']['metadata']['name'] if data.get('status') else urlparse(url).path.split('/')[-1]
+            return ParseResponse(response, Path(path).joinpath(name), None, data)
+        except Exception as error:
+            return PreviewError(url, error)
+
+    def preview_many(self,
+                     urls: Iterable[str],
+                     path: Union[str, Path]=Path.cwd(),
+                     concurrency: Optional[int]=None,
+                     resolve_ddl: bool=False,
+                     ordered: bool=False,
+                     return_exceptions: bool=False) -> Iterator[Union[ParseResponse, PreviewError]]:
+        """
+        Obtain the meta data of many `urls` at once, and yield the results as they
+        complete (or in the order of `urls` if `ordered` is set). Up to `concurrency`
+        lookups run at a time on worker threads, but never more than `pool_maxsize`,
+        so that every connection of the shared pool is kept alive between lookups.
+        `urls` is consumed as the lookups progress, so it may be a lazy iterable.
+
+        Unlike `preview`, this only queries the info endpoint unless `resolve_ddl`
+        is set: the landing page isn't fetched, `ddl` is `None` and `file_path` is
+        based on the file name in the meta data. Cached entries are returned with
+        their direct download link either way.
+
+        If a lookup fails (this includes files that no longer exist), a `PreviewError`
+        holding the URL is raised; set `return_exceptions` to `True` to yield it in
+        place of the result instead.
 
-    def download(self, url: str, path: Union[str, Path]=Path.cwd(), progressbar: bool=False, enable_logging: bool=False) -> ParseResponse:
+        Example
+        -------
+
+        ```
+        from anonfile import AnonFile, PreviewError
+
+        anon = AnonFile()
+        for preview in anon.preview_many(urls, concurrency=32, return_exceptions=True):
+            if isinstance(preview, PreviewError):
+                print(f"{preview.url} is gone")
+        ```
+        """
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        concurrency = max(min(concurrency or self.pool_maxsize, self.pool_maxsize), 1)
+        urls = iter(urls)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # a few lookups are queued ahead so that the workers never wait for the consumer
+            (window, buffered, indices, position) = ({}, {}, itertools.count(), 0)
+            try:
+                while True:
+                    for url in itertools.islice(urls, 2 * concurrency - len(window) - len(buffered)):
+                        window[executor.submit(self.__lookup, url, path, resolve_ddl)] = next(indices)
+                    if not window:
+                        break
+                    (done, _) = wait(window, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        buffered[window.pop(future)] = future.result()
+                    while buffered and (not ordered or position in buffered):
+                        result = buffered.pop(position if ordered else next(iter(buffered)))
+                        position += 1
+                        if isinstance(result, PreviewError) and not return_exceptions:
+                            raise result
+                        yield result
+            finally:
+                for future in window:
+                    future.cancel()
+
+    def __probe_ranges(self, url: str) -> Optional[int]:
+        """
+        Return the content length of `url` if the server accepts byte range
+        requests, else `None`.
+        """
+        import requests
+
+        try:
+            with self.__measure('probe', 'HEAD', url) as measurement, \
+                 self.session.head(url, timeout=self.timeout, proxies=self.__proxies(), allow_redirects=True) as response:
+                measurement.response = response
+                accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                content_length = response.headers.get('Content-Length')
+                return int(content_length) if accepts_ranges and content_length else None
+        except (requests.RequestException, ValueError):
+            return None
+
+    @staticmethod
+    def __split_ranges(ranges: List[Tuple[int, int]], segments: int) -> List[Tuple[int, int]]:
+        """
+        Split the half-open byte `ranges` into roughly `segments` contiguous
+        ranges of similar length.
+        """
+        step = max(-(-sum(end - start for (start, end) in ranges) // segments), 1)
+        return [(offset, min(offset + step, end)) for (start, end) in ranges for offset in range(start, end, step)]
+
+    @staticmethod
+    def __iter_adaptive(response: Response, sizer: _ChunkSizer) -> Iterator[bytes]:
+        """
+        Yield the body of `response` in chunks whose size is adapted by `sizer` to
+        the throughput of the connection. Errors are translated into the same
+        `requests` exceptions that `iter_content` raises.
+        """
+        raw = getattr(response, 'raw', None)
+        if not hasattr(raw, 'stream'):
+            # not backed by urllib3, the chunk size can't change between reads
+            yield from response.iter_content(chunk_size=sizer.size)
+            return
+
+        import requests
+        from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError, SSLError
+
+        try:
+            while True:
+                start = time.perf_counter()
+                chunk = raw.read(sizer.size, decode_content=True)
+                if chunk:
+                    sizer.update(len(chunk), time.perf_counter() - start)
+                    yield chunk
+                elif raw.closed:
+                    break
+        except ProtocolError as error:
+            raise requests.exceptions.ChunkedEncodingError(error)
+        except DecodeError as error:
+            raise requests.exceptions.ContentDecodingError(error)
+        except ReadTimeoutError as error:
+            raise requests.exceptions.ConnectionError(error)
+        except SSLError as error:
+            raise requests.exceptions.SSLError(error)
+
+    def __chunk_sizer(self) -> _ChunkSizer:
+        """
+        Return a chunk sizer whose chunks never exceed the burst of the download limiter.
+        """
+        limiter = self.download_limiter
+        return _ChunkSizer(maximum=min(_ChunkSizer._maximum, int(limiter.burst))) if limiter is not None else _ChunkSizer()
+
+    def __download_range(self,
+                         url: str,
+                         writer: _WriteBehind,
+                         start: int,
+                         end: Optional[int],
+                         state: TransferState,
+                         state_path: Path,
+                         progress: Optional[Progress],
+                         lock: threading.Lock,
+                         checksum: Optional[_Checksum]) -> None:
+        """
+        Fetch the byte range `[start, end)` of `url` and hand it to `writer`, which
+        writes it to the same offset of the download file on its own thread.
+        Request the entire resource if `end` is `None`. Progress is recorded in
+        `state` once the data has been written, and flushed to `state_path`
+        periodically.
+        """
+        import requests
+
+        headers = {'Range': f"bytes={start}-{'' if end is None or end >= state.size else end - 1}"} if end is not None else None
+        last_save = time.monotonic()
+
+        def written(offset: int, length: int) -> None:
+            nonlocal last_save
+            state.add(offset, offset + length)
+            with lock:
+                if progress is not None:
+                    progress.update(length)
+                if time.monotonic() - last_save > 1:
+                    state.save(state_path)
+                    last_save = time.monotonic()
+
+        with self.__measure('download', 'GET', url) as measurement, self.__get(url, stream=True, headers=headers) as response:
+            measurement.response = response
+            if headers and response.status_code != 206:
+                raise requests.HTTPError(f"Expected a partial response for {headers['Range']!r}, got {response.status_code}", response=response)
+            offset = start
+            limiter = self.download_limiter
+            for chunk in AnonFile.__iter_adaptive(response, self.__chunk_sizer()):
+                if limiter is not None:
+                    limiter.consume(len(chunk))
+                if checksum is not None:
+                    checksum.update(chunk, offset)
+                writer.write(offset, chunk, written)
+                offset += len(chunk)
+
+    @staticmethod
+    def __safe_members(archive: 'tarfile.TarFile', path: Path) -> Iterator['tarfile.TarInfo']:
+        """
+        Yield the members of `archive` and raise a `ValueError` for members (or link
+        targets) that would be extracted outside of `path`. Device files are skipped.
+        """
+        root = path.resolve()
+        inside = lambda target: target == root or root in target.parents
+        for member in archive:
+            target = root.joinpath(member.name).resolve()
+            if not inside(target):
+                raise ValueError(f"refusing to extract {member.name!r} outside of {str(path)!r}")
+            if member.issym() and not inside(target.parent.joinpath(member.linkname).resolve()):
+                raise ValueError(f"refusing to extract link {member.name!r} to {member.linkname!r}")
+            if member.islnk() and not inside(root.joinpath(member.linkname).resolve()):
+                raise ValueError(f"refusing to extract link {member.name!r} to {member.linkname!r}")
+            if member.isdev():
+                continue
+            yield member
+
+    def __iter_response(self, response: Response, progress: Optional[Progress], checksum: Optional[_Checksum]) -> Iterator[bytes]:
+        """
+        Yield the body of `response` in chunks, which are rate limited, hashed and
+        reported to `progress` as they arrive.
+        """
+        limiter = self.download_limiter
+        for chunk in AnonFile.__iter_adaptive(response, self.__chunk_sizer()):
+            if limiter is not None:
+                limiter.consume(len(chunk))
+            if checksum is not None:
+                checksum.update(chunk)
+            if progress is not None:
+                progress.update(len(chunk))
+            yield chunk
+
+    @staticmethod
+    def __peek(chunks: Iterator[bytes]) -> Tuple[bytes, Iterator[bytes]]:
+        """
+        Return the first chunk of `chunks` along with an iterator over all of them.
+        """
+        head = next(chunks, b'')
+        return (head, itertools.chain([head], chunks))
+
+    def __extract(self, url: str, path: Path, progress: Optional[Progress], checksum: Optional[_Checksum]) -> None:
+        """
+        Stream the tar archive behind `url` and unpack its members into `path`.
+        """
+        import tarfile
+
+        from .streams import _ChunkReader, _Decompressor
+
+        with self.__measure('download', 'GET', url) as measurement, self.__get(url, stream=True) as response:
+            measurement.response = response
+            (head, chunks) = AnonFile.__peek(self.__iter_response(response, progress, checksum))
+            if _Decompressor.detect(Path(urlparse(url).path).name, head) == 'zstd':
+                # tarfile handles gzip, bzip2 and xz by itself
+                chunks = _Decompressor('zstd').stream(chunks, progress)
+
+            path.mkdir(parents=True, exist_ok=True)
+            with tarfile.open(fileobj=_ChunkReader(chunks), mode='r|*') as archive:
+                options = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+                archive.extractall(path, members=AnonFile.__safe_members(archive, path), **options)
+
+    def __stream(self,
+                 url: str,
+                 write: Callable[[bytes], object],
+                 name: str,
+                 progress: Optional[Progress],
+                 checksum: Optional[_Checksum],
+                 decompress: bool) -> Optional[str]:
+        """
+        Stream the file behind `url` into `write`. If `decompress` is set, data is
+        decompressed on the fly if its compression is detected by the suffix of
+        `name` or by its magic number; other data is passed on as is. Return the
+        detected compression algorithm, if any.
+        """
+        with self.__measure('download', 'GET', url) as measurement, self.__get(url, stream=True) as response:
+            measurement.response = response
+            chunks = self.__iter_response(response, progress, checksum)
+            algorithm = None
+            if decompress:
+                from .streams import _Decompressor
+
+                (head, chunks) = AnonFile.__peek(chunks)
+                algorithm = _Decompressor.detect(name, head)
+                if algorithm is not None:
+                    chunks = _Decompressor(algorithm).stream(chunks, progress)
+            for chunk in chunks:
+                write(chunk)
+        return algorithm
+
+    def __decompress(self, url: str, file_path: Path, progress: Optional[Progress], checksum: Optional[_Checksum]) -> Tuple[Path, Path]:
+        """
+        Stream the file behind `url` into a `.part` file next to `file_path` and
+        decompress it on the fly. Return the paths of the `.part` file and of the
+        final file, which loses its compression suffix.
+        """
+        part_path = file_path.with_name(f"{file_path.name}.part")
+        with open(part_path, mode='wb') as file_handler:
+            algorithm = self.__stream(url, file_handler.write, file_path.name, progress, checksum, decompress=True)
+        suffix = compression_suffixes.get(algorithm, '')
+        if suffix and file_path.name.endswith(suffix):
+            file_path = file_path.with_name(file_path.name[:-len(suffix)])
+        return (part_path, file_path)
+
+    def download(self,
+                 url: str,
+                 path: Union[str, Path]=Path.cwd(),
+                 progressbar: bool=False,
+                 enable_logging: bool=False,
+                 segments: int=1,
+                 filename: str=None,
+                 digest: str=None,
+                 expected_digest: str=None,
+                 extract: bool=False,
+                 decompress: bool=False,
+                 preallocate: bool=False,
+                 output: Optional[Union[BinaryIO, Callable[[bytes], object]]]=None) -> ParseResponse:
         """
         Download a file from https://anonfiles.com given a `url`. Set the download
         directory in `path` (uses the current working directory by default). Set
         `enable_logging` to `True` to store the URL in a global config file.
 
+        Set `segments` to a value greater than one to fetch the file over several
+        connections at once. The direct download link is split into byte ranges
+        which are written concurrently into a preallocated file; if the server
+        doesn't accept range requests, the download falls back to a single stream.
+
+        Set `filename` to save the file under a different name in `path` than the
+        one suggested by the direct download link.
+
+        Set `digest` to a `hashlib` algorithm such as `'md5'`, `'sha256'` or `'blake2b'`
+        to compute a checksum while the file is being written; it is stored in the
+        `digest` field of the result. Data that can't be hashed in order (because
+        it was resumed or fetched by another segment) is read back from disk once.
+        If `expected_digest` is set (optionally prefixed with `<algorithm>:`, SHA-256
+        by default), a mismatch removes the partial file and raises a `ChecksumError`.
+
+        Data is written to a `.part` file first. Its progress is tracked in a
+        `.part.json` sidecar file, so that calling this method again after an
+        interruption continues where the last attempt left off. The `.part` file
+        is renamed to its final name once the download is complete.
+
+        Network reads and disk writes overlap: chunks are handed to a writer thread
+        through a bounded queue, and the size of each read adapts to
+        the throughput of the connection. Set `preallocate` to `True` to reserve
+        the entire file on disk with `posix_fallocate` up front, which fails early
+        if there isn't enough space and reduces fragmentation.
+
+        Set `extract` to `True` to unpack a tar archive (optionally compressed with
+        gzip, bzip2 or xz) into `path` while it's being downloaded, without writing
+        the archive itself to disk. Members that would end up outside of `path`
+        are rejected. Extraction always uses a single stream and can't be resumed;
+        the `file_path` of the result points to `path`.
+
+        Set `decompress` to `True` to decompress gzip or zstd files while they're
+        being downloaded. The compression is detected by the file name suffix (which
+        is removed from the saved file) or by the magic number of the data, and
+        files that aren't compressed are saved as is. Like extraction, this uses a
+        single stream and can't be resumed, and `digest` covers the compressed data.
+
+        Set `output` to a binary file-like object (anything with a `write` method,
+        such as `sys.stdout.buffer`, a pipe or a socket file) or to a callback that
+        accepts bytes to stream the file there instead of writing it to disk. This
+        also uses a single stream that can't be resumed, and may be combined with
+        `decompress`; the `file_path` of the result is the path the file would have
+        been saved to. A checksum mismatch is raised after all data has been passed
+        on, so consumers should discard their output if this method raises.
+
         Example
         -------
 
@@ -364,16 +1579,113 @@ def download(self, url: str, path: Union[str, Path]=Path.cwd(), progressbar: boo
         for reading the response stream. In contrast, the URL defined in `anon.url.geturl()`
         is a better choice for sharing links.
         """
-        MB = 1_048_576
+        from concurrent.futures import ThreadPoolExecutor
+
+        import requests
+
+        if extract and output is not None:
+            raise ValueError("extract and output can't be combined")
+
+        start = time.perf_counter()
+        if expected_digest is not None:
+            (algorithm, _, expected_digest) = expected_digest.rpartition(':')
+            digest = algorithm or digest or 'sha256'
+        checksum = _Checksum(digest) if digest else None
+
         download = self.preview(url, path)
+        if filename is not None:
+            download = replace(download, file_path=Path(path).joinpath(filename))
+        ddl = download.ddl.geturl()
+
+        if extract or decompress or output is not None:
+            operation = 'extract' if extract else 'download'
+            try:
+                with self.__progress(operation, download.id, download.size, progressbar) or nullcontext() as progress:
+                    if extract:
+                        self.__extract(ddl, Path(path), progress, checksum)
+                        (part_path, file_path) = (None, Path(path))
+                    elif output is not None:
+                        self.__stream(ddl, output.write if hasattr(output, 'write') else output, download.file_path.name, progress, checksum, decompress)
+                        if hasattr(output, 'flush'):
+                            output.flush()
+                        (part_path, file_path) = (None, download.file_path)
+                    else:
+                        (part_path, file_path) = self.__decompress(ddl, download.file_path, progress, checksum)
+            except requests.HTTPError:
+                # the direct download link may have expired in the meantime
+                if self.cache is not None:
+                    self.cache.invalidate(download.id)
+                raise
+            download = replace(download, file_path=file_path)
+            if checksum is not None:
+                download = replace(download, digest=f"{checksum.algorithm}:{checksum.hexdigest()}")
+                if expected_digest is not None and checksum.hexdigest() != expected_digest.lower():
+                    if part_path is not None:
+                        part_path.unlink()
+                    raise ChecksumError(f"{checksum.algorithm} digest mismatch: expected {expected_digest}, got {checksum.hexdigest()}")
+            if part_path is not None:
+                os.replace(part_path, file_path)
+            _log_transfer('download', url, download, time.perf_counter() - start, enable_logging)
+            return download
+
+        from .transfer import TransferState, _preallocate, _WriteBehind
+
+        part_path = download.file_path.with_name(f"{download.file_path.name}.part")
+        state_path = part_path.with_name(f"{part_path.name}.json")
+
+        state = TransferState.load(state_path) if part_path.exists() else None
+        if state is None or state.url != url or state.size != download.size:
+            state = TransferState(url, download.size)
+
+        resume = state.completed > 0
+        ranged = (segments > 1 or resume) and self.__probe_ranges(ddl) == state.size
+        if not ranged:
+            state.ranges.clear()
+
+        with self.__progress('download', download.id, download.size, progressbar, state.completed) or nullcontext() as progress:
+            with open(part_path, mode='r+b' if ranged and resume else 'wb', buffering=0) as file_handler:
+                if preallocate and not (ranged and resume):
+                    _preallocate(file_handler, state.size)
+                elif ranged and not resume:
+                    file_handler.truncate(state.size)
+
+                if checksum is not None and ranged:
+                    # hash the contiguous prefix that was downloaded by a previous attempt
+                    checksum.catch_up(part_path, next(iter(state.missing()), (state.size,))[0])
+
+                lock = threading.Lock()
+                ranges = AnonFile.__split_ranges(state.missing(), segments) if ranged else [(0, None)]
+                try:
+                    # the executor shuts down first, then the writer drains its queue
+                    with _WriteBehind(file_handler, max(_WriteBehind._depth, 2 * len(ranges))) as writer, \
+                         ThreadPoolExecutor(max_workers=max(len(ranges), 1)) as executor:
+                        futures = [
+                            executor.submit(self.__download_range, ddl, writer, start, end, state, state_path, progress, lock, checksum)
+                            for (start, end) in ranges
+                        ]
+                        for future in futures:
+                            future.result()
+                except requests.HTTPError:
+                    # the direct download link may have expired in the meantime
+                    if self.cache is not None:
+                        self.cache.invalidate(download.id)
+                    raise
+                finally:
+                    state.save(state_path)
+
+        if state.size and state.completed < state.size:
+            raise requests.ConnectionError(f"Download incomplete: received {state.completed} of {state.size} bytes, run again to resume")
+
+        if checksum is not None:
+            checksum.catch_up(part_path, state.size)
+            download = replace(download, digest=f"{checksum.algorithm}:{checksum.hexdigest()}")
+            if expected_digest is not None and checksum.hexdigest() != expected_digest.lower():
+                part_path.unlink()
+                state_path.unlink()
+                raise ChecksumError(f"{checksum.algorithm} digest mismatch: expected {expected_digest}, got {checksum.hexdigest()}")
 
-        options = AnonFile.__progressbar_options(None, f"Download {download.id}", unit='B', total=download.size, disable=progressbar)
-        with open(download.file_path, mode='wb') as file_handler:
-            with tqdm(**options) as tqdm_handler:
-                with self.__get(download.ddl.geturl(), stream=True) as response:
-                    for chunk in response.iter_content(chunk_size=1*MB):
-                        tqdm_handler.update(len(chunk))
-                        file_handler.write(chunk)
+        os.replace(part_path, download.file_path)
+        state_path.unlink()
 
-        logger.log(logging.INFO if enable_logging else logging.NOTSET, "download::%s", url)
+        _log_transfer('download', url, download, time.perf_counter() - start, enable_logging)
         return download
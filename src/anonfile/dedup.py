@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""
+Content-addressed cache of previous uploads, which lets `AnonFile.upload` skip
+files that were uploaded before (`anonfile upload --dedup`).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple, Union
+
+from .anonfile import MB, get_config_dir
+
+if TYPE_CHECKING:
+    from .anonfile import ParseResponse
+
+class UploadCache:
+    """
+    A content-addressed store of previous uploads, which maps the SHA-256 digest
+    and size of a file to the URL and ID returned by the server. It is kept in a
+    SQLite database at `path` (`uploads.sqlite3` in the config directory by
+    default) in write-ahead logging mode, so that several processes can share it.
+
+    Hashing a file reads it in full, so the digest is memoized by path, size and
+    modification time; unchanged files are only hashed once.
+
+    Example
+    -------
+
+    ```
+    from anonfile import AnonFile, UploadCache
+
+    anon = AnonFile(upload_cache=UploadCache())
+    # the second upload returns the URL of the first one without sending any data
+    anon.upload('build.zip')
+    anon.upload('build.zip')
+    ```
+    """
+    _timeout = 30
+    # the files of the dbm database that earlier versions kept in the config directory
+    _legacy_suffixes = ('', '.db', '.dat', '.dir', '.bak')
+
+    __slots__ = ['path', '_connection', '_lock']
+
+    def __init__(self, path: Optional[Union[str, Path]]=None) -> UploadCache:
+        self.path = Path(path) if path is not None else get_config_dir().joinpath('uploads.sqlite3')
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __database(self):
+        """
+        Return the connection to the database, which is opened on first use. Callers
+        hold the lock, because the connection is shared by all threads.
+        """
+        if self._connection is None:
+            import sqlite3
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # writers in other processes are waited for up to `_timeout` seconds
+            connection = sqlite3.connect(self.path, timeout=self._timeout, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS uploads (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self._connection = connection
+        return self._connection
+
+    def __get(self, key: str) -> Optional[str]:
+        row = self.__database().execute('SELECT value FROM uploads WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def __set(self, key: str, value: str) -> None:
+        self.__database().execute('INSERT OR REPLACE INTO uploads (key, value) VALUES (?, ?)', (key, value))
+
+    def fingerprint(self, file_path: Union[str, Path]) -> str:
+        """
+        Return the content address `sha256:<hex>:<size>` of the file in `file_path`.
+        The upload method appends `:<algorithm>` for compressed uploads.
+        """
+        import hashlib
+
+        stat = os.stat(file_path)
+        memo_key = f"stat:{os.path.abspath(file_path)}"
+        memo = f"{stat.st_size}:{stat.st_mtime_ns}:"
+        with self._lock:
+            value = self.__get(memo_key) or ''
+        if value.startswith(memo):
+            return value[len(memo):]
+
+        hash_ = hashlib.sha256()
+        with open(file_path, mode='rb') as file_handler:
+            while chunk := file_handler.read(1*MB):
+                hash_.update(chunk)
+        key = f"sha256:{hash_.hexdigest()}:{stat.st_size}"
+        with self._lock:
+            self.__set(memo_key, memo + key)
+        return key
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Return the upload recorded for the content address `key`, or `None`.
+        """
+        with self._lock:
+            value = self.__get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, upload: ParseResponse) -> None:
+        """
+        Record `upload` as the remote copy of the content address `key`.
+        """
+        entry = {'url': upload.url.geturl(), 'id': upload.id, 'name': str(upload.file_path.name), 'digest': upload.digest, 'time': time.time()}
+        with self._lock:
+            self.__set(key, json.dumps(entry))
+
+    def invalidate(self, key: Optional[str]=None) -> None:
+        """
+        Remove the entry for `key`, or all entries (and memoized digests) if `key` is
+        `None`. The latter also removes the database files of earlier versions.
+        """
+        with self._lock:
+            if key is not None:
+                self.__database().execute('DELETE FROM uploads WHERE key = ?', (key,))
+                return
+            self.__database().execute('DELETE FROM uploads')
+            legacy_path = get_config_dir().joinpath('uploads')
+            for suffix in self._legacy_suffixes:
+                legacy_path.with_name(f"{legacy_path.name}{suffix}").unlink(missing_ok=True)
+
+    def items(self) -> List[Tuple[str, dict]]:
+        """
+        Return all `(key, entry)` pairs.
+        """
+        with self._lock:
+            rows = self.__database().execute("SELECT key, value FROM uploads WHERE key NOT LIKE 'stat:%'").fetchall()
+        return [(key, json.loads(value)) for (key, value) in rows]
+
+    def prune(self, is_alive: Callable[[dict], bool]) -> int:
+        """
+        Remove the entries for which `is_alive` returns `False`, as well as memoized
+        digests of files that no longer exist. Return the number of removed entries.
+        """
+        stale = [key for (key, entry) in self.items() if not is_alive(entry)]
+        with self._lock:
+            database = self.__database()
+            memos = [key for (key,) in database.execute("SELECT key FROM uploads WHERE key LIKE 'stat:%'").fetchall()]
+            orphans = [key for key in memos if not os.path.exists(key[len('stat:'):])]
+            database.executemany('DELETE FROM uploads WHERE key = ?', [(key,) for key in stale + orphans])
+        return len(stale)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
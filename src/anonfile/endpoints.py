@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""
+Health tracking and failover for a pool of compatible API endpoints, see
+`EndpointPool`.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from .anonfile import get_config_dir
+
+class EndpointPool:
+    """
+    Health tracker for a list of compatible API endpoints. Each request made
+    through an endpoint updates moving averages of its latency and error rate,
+    and `ranked` orders the endpoints from best to worst, so that requests go
+    to the best healthy endpoint and fail over to the next one as soon as it
+    stops responding. An endpoint that failed `max_failures` times in a row is
+    skipped for `cooldown` seconds, unless no other endpoint is left.
+
+    Call `start` to probe endpoints whose health is older than `ttl` seconds on
+    a background thread. Health is persisted to `path` (`endpoints.json` in the
+    config directory by default), so that the next run starts with a ranking.
+
+    Example
+    -------
+
+    ```
+    from anonfile import AnonFile, EndpointPool
+
+    pool = EndpointPool(['https://anonfiles.se/api/', 'https://mirror.example.com/api/'])
+    anon = AnonFile(url=pool)
+    ```
+    """
+    _ttl = 300
+    _cooldown = 60
+    _max_failures = 3
+    _smoothing = 0.3
+    _probe_interval = 30
+    _save_interval = 5
+
+    __slots__ = ['urls', 'path', 'ttl', 'cooldown', 'max_failures', '_health', '_lock', '_last_save', '_dirty', '_thread', '_stop']
+
+    def __init__(self,
+                 urls: List[str],
+                 path: Optional[Union[str, Path]]=None,
+                 ttl: float=_ttl,
+                 cooldown: float=_cooldown,
+                 max_failures: int=_max_failures) -> EndpointPool:
+        if not urls:
+            raise ValueError("an endpoint pool requires at least one URL")
+        self.urls = list(urls)
+        self.path = Path(path) if path is not None else get_config_dir().joinpath('endpoints.json')
+        self.ttl = ttl
+        self.cooldown = cooldown
+        self.max_failures = max_failures
+        self._health = None
+        self._lock = threading.RLock()
+        self._last_save = time.monotonic()
+        self._dirty = False
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def health(self) -> dict:
+        """
+        Return the health records by URL, loading them from disk on first access.
+        Each record holds the smoothed `latency` in seconds (`None` until the first
+        success), the smoothed `errors` rate, the number of consecutive `failures`
+        and the `time` of the last observation.
+        """
+        if self._health is None:
+            self._health = {}
+            if self.path.exists():
+                try:
+                    with open(self.path, mode='r', encoding='utf-8') as file_handler:
+                        self._health.update(json.load(file_handler))
+                except (OSError, ValueError):
+                    pass
+        return self._health
+
+    @staticmethod
+    def is_failure(error: Exception) -> bool:
+        """
+        Return whether `error` indicates that an endpoint is unhealthy. Client errors
+        such as a 404 prove that the endpoint is up.
+        """
+        import requests
+
+        if not isinstance(error, requests.RequestException):
+            return False
+        status = getattr(error.response, 'status_code', None)
+        return status is None or status >= 500 or status == 429
+
+    def record(self, url: str, latency: Optional[float], failed: bool) -> None:
+        """
+        Record the outcome of a request to `url`. Pass `None` as `latency` if the
+        duration of the request doesn't reflect the responsiveness of the endpoint.
+        """
+        alpha = EndpointPool._smoothing
+        with self._lock:
+            entry = self.health.setdefault(url, {'latency': None, 'errors': 0.0, 'failures': 0, 'time': 0})
+            entry['errors'] = (1 - alpha) * entry['errors'] + alpha * float(failed)
+            entry['failures'] = entry['failures'] + 1 if failed else 0
+            if latency is not None and not failed:
+                entry['latency'] = latency if entry['latency'] is None else (1 - alpha) * entry['latency'] + alpha * latency
+            entry['time'] = time.time()
+            self._dirty = True
+            if time.monotonic() - self._last_save > EndpointPool._save_interval:
+                self.flush()
+
+    def available(self, url: str) -> bool:
+        """
+        Return whether `url` is eligible for requests, i.e. it isn't cooling down
+        after `max_failures` consecutive failures.
+        """
+        entry = self.health.get(url)
+        return entry is None or entry['failures'] < self.max_failures or time.time() - entry['time'] > self.cooldown
+
+    def ranked(self) -> List[str]:
+        """
+        Return all URLs from best to worst: available endpoints ordered by latency
+        (weighted with their error rate) come first, followed by endpoints that
+        haven't been measured yet in the order they were given, and by endpoints
+        that are cooling down.
+        """
+        with self._lock:
+            def key(indexed: Tuple[int, str]) -> tuple:
+                (index, url) = indexed
+                entry = self.health.get(url) or {}
+                latency = entry.get('latency')
+                score = latency * (1 + 4 * entry.get('errors', 0.0)) if latency is not None else float('inf')
+                return (not self.available(url), score, index)
+            return [url for (_, url) in sorted(enumerate(self.urls), key=key)]
+
+    @contextmanager
+    def observe(self, url: str, timed: bool=True) -> Iterator[None]:
+        """
+        Record the outcome of the request made to `url` in this context. Set `timed`
+        to `False` if its duration depends on the amount of data sent (e.g. uploads).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as error:
+            failed = EndpointPool.is_failure(error)
+            if failed or getattr(error, 'response', None) is not None:
+                self.record(url, time.perf_counter() - start if timed else None, failed)
+            raise
+        self.record(url, time.perf_counter() - start if timed else None, False)
+
+    def probe(self, check: Callable[[str], object]) -> None:
+        """
+        Call `check` with each URL whose health is older than `ttl` seconds and
+        record the outcome.
+        """
+        for url in self.urls:
+            if self._stop.is_set():
+                return
+            if time.time() - (self.health.get(url) or {}).get('time', 0) <= self.ttl:
+                continue
+            try:
+                with self.observe(url):
+                    check(url)
+            except Exception:
+                pass
+
+    def start(self, check: Callable[[str], object]) -> None:
+        """
+        Probe stale endpoints with `check` every few seconds on a daemon thread.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+
+            def run() -> None:
+                while not self._stop.is_set():
+                    self.probe(check)
+                    self._stop.wait(EndpointPool._probe_interval)
+
+            self._thread = threading.Thread(target=run, name='anonfile-probe', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop probing and write the health records to disk.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Write pending changes to disk.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with open(tmp_path, mode='w', encoding='utf-8') as file_handler:
+                json.dump(self.health, file_handler)
+            os.replace(tmp_path, self.path)
+            self._last_save, self._dirty = time.monotonic(), False
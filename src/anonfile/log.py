@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+"""
+Structured transfer log. Each upload or download is appended to `anonfile.log`
+as a JSON object on a line of its own, which is rotated once it exceeds a size
+limit. An append-only index next to each log file maps URLs and file IDs to the
+offsets of their records, and `TransferLog` answers queries by streaming through
+the log files rather than loading them into memory.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Iterator, List, Optional, TextIO, Union
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where the log isn't shared between processes
+    fcntl = None
+
+
+def index_path(path: Union[str, Path]) -> Path:
+    """
+    Return the path of the index of the log file `path`.
+    """
+    return Path(f"{path}.idx")
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format a log record as a JSON object made up of the timestamp, the message
+    (which names the method) and the fields passed in `extra={'transfer': {...}}`.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = datetime.fromtimestamp(record.created).isoformat(timespec='seconds')
+        return json.dumps({'timestamp': timestamp, 'method': record.getMessage(), **getattr(record, 'transfer', {})})
+
+
+class TransferLogHandler(RotatingFileHandler):
+    """
+    Rotating file handler that opens the log file (and creates its directory) when
+    the first record is emitted, and appends the offset of each record to an index
+    keyed by the URL and the file ID of the transfer.
+
+    Each log file has an index of its own, which is rotated along with it, so that
+    a rollover only renames files. Several processes may log to the same file: a
+    record and its index entry are written under an exclusive lock on the file
+    `anonfile.log.lock` where the platform supports it.
+    """
+    _max_bytes = 10_485_760
+    _backup_count = 5
+
+    def __init__(self, path: Union[str, Path], max_bytes: int=_max_bytes, backup_count: int=_backup_count) -> TransferLogHandler:
+        super().__init__(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.setFormatter(JSONFormatter())
+        self.index: Optional[TextIO] = None
+        self.lock_file: Optional[TextIO] = None
+
+    @property
+    def index_path(self) -> Path:
+        return index_path(self.baseFilename)
+
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+    @contextmanager
+    def __locked(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        if self.lock_file is None:
+            Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+            self.lock_file = open(f"{self.baseFilename}.lock", mode='a', encoding='utf-8')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            with self.__locked():
+                if self.shouldRollover(record):
+                    self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+                # another process may have appended to the log in the meantime
+                offset = self.stream.seek(0, os.SEEK_END)
+                logging.FileHandler.emit(self, record)
+                transfer = getattr(record, 'transfer', {})
+                keys = [key for key in (transfer.get('url'), transfer.get('id')) if key]
+                if keys:
+                    if self.index is None:
+                        self.index = open(self.index_path, mode='a', encoding='utf-8')
+                    self.index.write(''.join(f"{offset}\t{key}\n" for key in keys))
+                    self.index.flush()
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        # the index of the oldest backup is replaced along with its log file
+        sources = [index_path(self.rotation_filename(f"{self.baseFilename}.{suffix}")) for suffix in range(self.backupCount - 1, 0, -1)]
+        for (suffix, source) in zip(range(self.backupCount, 1, -1), sources):
+            if source.exists():
+                os.replace(source, index_path(self.rotation_filename(f"{self.baseFilename}.{suffix}")))
+        if self.backupCount > 0 and self.index_path.exists():
+            os.replace(self.index_path, index_path(self.rotation_filename(f"{self.baseFilename}.1")))
+        else:
+            self.index_path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        self.acquire()
+        try:
+            for file_handler in (self.index, self.lock_file):
+                if file_handler is not None:
+                    file_handler.close()
+            self.index = self.lock_file = None
+        finally:
+            self.release()
+        super().close()
+
+
+class TransferLog:
+    """
+    Query interface for the records written by `TransferLogHandler`. Lines in the
+    old `<timestamp>::<method>::<url>` format are understood as well.
+
+    Example
+    -------
+
+    ```
+    from anonfile import TransferLog, get_logfile_path
+
+    log = TransferLog(get_logfile_path())
+    for record in log.records(since=datetime(2023, 7, 1), grep='topsecret'):
+        print(record['url'])
+    ```
+    """
+    _block_size = 65_536
+
+    __slots__ = ['path', 'backup_count']
+
+    def __init__(self, path: Union[str, Path], backup_count: int=TransferLogHandler._backup_count) -> TransferLog:
+        self.path = Path(path)
+        self.backup_count = backup_count
+
+    @property
+    def files(self) -> List[Path]:
+        """
+        Return all existing log files, starting with the oldest backup.
+        """
+        candidates = [self.path.with_name(f"{self.path.name}.{suffix}") for suffix in range(self.backup_count, 0, -1)] + [self.path]
+        return [path for path in candidates if path.exists()]
+
+    @staticmethod
+    def parse(line: Union[str, bytes]) -> Optional[dict]:
+        """
+        Return the record stored in `line`, or `None` if it's blank or malformed.
+        """
+        line = (line.decode('utf-8', errors='replace') if isinstance(line, bytes) else line).strip()
+        if line.startswith('{'):
+            try:
+                return json.loads(line)
+            except ValueError:
+                return None
+        fields = line.split('::', 2)
+        return {'timestamp': fields[0], 'method': fields[1], 'url': fields[2]} if len(fields) == 3 else None
+
+    @staticmethod
+    def timestamp(record: dict) -> Optional[datetime]:
+        """
+        Return the time a record was logged at, in the local timezone.
+        """
+        try:
+            return TransferLog.localize(datetime.fromisoformat(record['timestamp']))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def localize(value: datetime) -> datetime:
+        """
+        Convert `value` to the local timezone. Naive values (such as the timestamps
+        in the log) are taken to be local time already.
+        """
+        return value.astimezone()
+
+    def __reversed_lines(self, path: Path) -> Iterator[bytes]:
+        """
+        Yield the lines of `path` from last to first, reading one block at a time.
+        """
+        with open(path, mode='rb') as file_handler:
+            position = file_handler.seek(0, os.SEEK_END)
+            remainder = b''
+            while position > 0:
+                size = min(self._block_size, position)
+                position -= size
+                file_handler.seek(position)
+                lines = (file_handler.read(size) + remainder).split(b'\n')
+                remainder = lines.pop(0)
+                yield from reversed(lines)
+            yield remainder
+
+    def records(self, since: Optional[datetime]=None, grep: Optional[str]=None) -> Iterator[dict]:
+        """
+        Yield the records logged at or after `since` whose line matches the regular
+        expression `grep`, in chronological order. Backup files whose last record
+        predates `since` are skipped without reading them.
+        """
+        pattern = re.compile(grep) if grep is not None else None
+        since = TransferLog.localize(since) if since is not None else None
+        for path in self.files:
+            if since is not None:
+                last = next((record for record in map(TransferLog.parse, self.__reversed_lines(path)) if record), None)
+                if last is None or (TransferLog.timestamp(last) or since) < since:
+                    continue
+            with open(path, mode='r', encoding='utf-8', errors='replace') as file_handler:
+                for line in file_handler:
+                    if pattern is not None and not pattern.search(line):
+                        continue
+                    record = TransferLog.parse(line)
+                    if record is None or (since is not None and (TransferLog.timestamp(record) or since) < since):
+                        continue
+                    yield record
+
+    def tail(self, count: int, grep: Optional[str]=None) -> List[dict]:
+        """
+        Return the last `count` records whose line matches `grep`, in chronological
+        order. Only the end of the log is read.
+        """
+        pattern = re.compile(grep.encode()) if grep is not None else None
+        records = []
+        for path in reversed(self.files):
+            for line in self.__reversed_lines(path):
+                if len(records) >= count:
+                    return records[::-1]
+                if pattern is not None and not pattern.search(line):
+                    continue
+                record = TransferLog.parse(line)
+                if record is not None:
+                    records.append(record)
+        return records[::-1]
+
+    def find(self, key: str) -> Optional[dict]:
+        """
+        Return the latest record of a URL or file ID. The offset is looked up in the
+        indexes from the newest to the oldest log file, and the log is only scanned
+        if no index has a valid entry.
+        """
+        needle = key.encode('utf-8')
+        for path in reversed(self.files):
+            if not index_path(path).exists():
+                continue
+            for line in self.__reversed_lines(index_path(path)):
+                (offset, _, indexed) = line.partition(b'\t')
+                if indexed != needle or not offset.isdigit():
+                    continue
+                with open(path, mode='rb') as file_handler:
+                    file_handler.seek(int(offset))
+                    record = TransferLog.parse(file_handler.readline())
+                if record is not None and key in (record.get('url'), record.get('id')):
+                    return record
+                break
+        return next((record for record in reversed(list(self.records(grep=re.escape(key)))) if key in (record.get('url'), record.get('id'))), None)
+
+    def reset(self) -> None:
+        """
+        Remove all records, backup files and the index.
+        """
+        for path in self.files:
+            if path != self.path:
+                path.unlink()
+        if self.path.exists():
+            open(self.path, mode='w', encoding='utf-8').close()
+        for path in [self.path] + [self.path.with_name(f"{self.path.name}.{suffix}") for suffix in range(1, self.backup_count + 1)]:
+            index_path(path).unlink(missing_ok=True)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+Per-request instrumentation for the anonfiles client. `AnonFile` reports one
+`RequestMetrics` record per HTTP request to each of its `observers`, which are
+plain callables. This module ships two of them: `JSONLinesSink` appends every
+record to a JSON lines file, and `PrometheusSink` aggregates the records into
+counters and histograms in the Prometheus text exposition format.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, TextIO, Tuple, Union
+
+
+@dataclass(frozen=True)
+class RequestMetrics:
+    """
+    Timings and counters of a single HTTP request. `operation` is one of `upload`,
+    `info`, `page`, `probe` or `download`. `dns`, `connect` and `tls` are the number
+    of seconds spent on DNS resolution, the TCP connection and the TLS handshake,
+    or `None` if a pooled connection was reused (or the request went over plain
+    HTTP, in the case of `tls`). `ttfb` is the number of seconds from sending the
+    request until the response headers were parsed, which includes the request body
+    of an upload, but not the connection setup. `duration` covers the entire request
+    including the response body. `retries` counts the attempts urllib3 made before
+    the final response, and `error` holds the exception name if the request failed.
+    """
+    operation: str
+    method: str
+    url: str
+    status: Optional[int]
+    retries: int
+    bytes_sent: int
+    bytes_received: int
+    ttfb: Optional[float]
+    duration: float
+    error: Optional[str] = None
+    dns: Optional[float] = None
+    connect: Optional[float] = None
+    tls: Optional[float] = None
+
+    @property
+    def setup(self) -> float:
+        """
+        Return the number of seconds spent on setting up new connections.
+        """
+        return (self.dns or 0) + (self.connect or 0) + (self.tls or 0)
+
+    @property
+    def transfer(self) -> float:
+        """
+        Return the number of seconds spent reading the response body.
+        """
+        return max(self.duration - self.setup - (self.ttfb or 0), 0)
+
+    @property
+    def throughput(self) -> float:
+        """
+        Return the number of bytes moved per second over the entire request.
+        """
+        return (self.bytes_sent + self.bytes_received) / self.duration if self.duration > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), 'setup': self.setup, 'transfer': self.transfer, 'throughput': self.throughput}
+
+
+class JSONLinesSink:
+    """
+    Observer that appends each record as one JSON object per line to `file`,
+    which is either a path or a text stream.
+
+    Example
+    -------
+
+    ```
+    from anonfile import AnonFile, JSONLinesSink
+
+    with JSONLinesSink('metrics.jsonl') as sink, AnonFile(observers=[sink]) as anon:
+        anon.download('https://anonfiles.com/9ee1jcu6u9/test_txt')
+    ```
+    """
+    __slots__ = ['file_handler', '_owned', '_lock']
+
+    def __init__(self, file: Union[str, Path, TextIO]) -> JSONLinesSink:
+        self._owned = isinstance(file, (str, os.PathLike))
+        self.file_handler = open(file, mode='a', encoding='utf-8') if self._owned else file
+        self._lock = threading.Lock()
+
+    def __call__(self, metrics: RequestMetrics) -> None:
+        line = json.dumps(metrics.to_dict())
+        with self._lock:
+            self.file_handler.write(line + '\n')
+            self.file_handler.flush()
+
+    def __enter__(self) -> JSONLinesSink:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._owned:
+            self.file_handler.close()
+
+
+class PrometheusSink:
+    """
+    Observer that aggregates records into Prometheus metrics, labelled by
+    operation (and status code where it applies):
+
+    - `anonfile_requests_total` counts requests
+    - `anonfile_request_retries_total` counts retried attempts
+    - `anonfile_transferred_bytes_total` counts bytes by `direction` (`sent` or `received`)
+    - `anonfile_retry_events_total` counts retries, exhausted retry budgets and
+      circuit breaker trips and rejections by `event` and `host`, if it's
+      registered as an observer of the `RetryPolicy` with `retry_observer`
+    - `anonfile_request_duration_seconds` and `anonfile_time_to_first_byte_seconds`
+      are histograms, so that `histogram_quantile` yields p50 or p99 latencies
+    - `anonfile_dns_seconds`, `anonfile_connect_seconds` and `anonfile_tls_seconds`
+      are histograms of the connection setup phases, observed only for requests
+      that opened a new connection
+
+    Call `expose` to render the current state, or `write` to save it atomically
+    for the textfile collector of the node exporter.
+    """
+    _buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+    _namespace = 'anonfile'
+
+    __slots__ = ['buckets', 'namespace', '_counters', '_histograms', '_lock']
+
+    def __init__(self, buckets: Tuple[float, ...]=_buckets, namespace: str=_namespace) -> PrometheusSink:
+        self.buckets = tuple(sorted(buckets))
+        self.namespace = namespace
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, metrics: RequestMetrics) -> None:
+        operation = (('operation', metrics.operation),)
+        status = str(metrics.status) if metrics.status is not None else metrics.error or 'unknown'
+        with self._lock:
+            self._counters[('requests_total', operation + (('method', metrics.method), ('status', status)))] += 1
+            self._counters[('request_retries_total', operation)] += metrics.retries
+            self._counters[('transferred_bytes_total', operation + (('direction', 'sent'),))] += metrics.bytes_sent
+            self._counters[('transferred_bytes_total', operation + (('direction', 'received'),))] += metrics.bytes_received
+            self.__observe('request_duration_seconds', operation, metrics.duration)
+            if metrics.ttfb is not None:
+                self.__observe('time_to_first_byte_seconds', operation, metrics.ttfb)
+            for (phase, value) in (('dns', metrics.dns), ('connect', metrics.connect), ('tls', metrics.tls)):
+                if value is not None:
+                    self.__observe(f"{phase}_seconds", operation, value)
+
+    def count(self, name: str, labels: Tuple[Tuple[str, str], ...]=(), amount: float=1) -> None:
+        """
+        Add `amount` to the counter `name` (without the namespace prefix), for events
+        that aren't tied to a single record, such as circuit breaker trips.
+        """
+        with self._lock:
+            self._counters[(name, labels)] += amount
+
+    def __observe(self, name: str, labels: Tuple[Tuple[str, str], ...], value: float) -> None:
+        # one cumulative count per bucket, followed by the +Inf count and the sum
+        histogram = self._histograms.setdefault((name, labels), [0] * (len(self.buckets) + 2))
+        for (index, bound) in enumerate(self.buckets):
+            if value <= bound:
+                histogram[index] += 1
+        histogram[-2] += 1
+        histogram[-1] += value
+
+    @staticmethod
+    def __format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+        escape = lambda value: str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for (key, value) in labels) + '}' if labels else ''
+
+    @staticmethod
+    def __format_value(value: float) -> str:
+        # byte totals exceed the six significant digits of `:g`
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    def retry_observer(self, event: str, host: str) -> None:
+        self.count('retry_events_total', (('event', event), ('host', host)))
+
+    def expose(self) -> str:
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        lines, seen = [], set()
+        with self._lock:
+            for ((name, labels), value) in sorted(self._counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {self.namespace}_{name} counter")
+                    seen.add(name)
+                lines.append(f"{self.namespace}_{name}{PrometheusSink.__format_labels(labels)} {PrometheusSink.__format_value(value)}")
+            for ((name, labels), histogram) in sorted(self._histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {self.namespace}_{name} histogram")
+                    seen.add(name)
+                for (bound, count) in zip([f"{bound:g}" for bound in self.buckets] + ['+Inf'], histogram):
+                    lines.append(f"{self.namespace}_{name}_bucket{PrometheusSink.__format_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{self.namespace}_{name}_count{PrometheusSink.__format_labels(labels)} {histogram[-2]}")
+                lines.append(f"{self.namespace}_{name}_sum{PrometheusSink.__format_labels(labels)} {PrometheusSink.__format_value(histogram[-1])}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: Union[str, Path]) -> None:
+        """
+        Write the output of `expose` to `path` atomically.
+        """
+        path = Path(path)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(self.expose(), encoding='utf-8')
+        os.replace(tmp_path, path)
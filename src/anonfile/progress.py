@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+"""
+Progress reporting for the anonfiles client. `AnonFile` tracks each upload and
+download in a `Progress` object that emits `ProgressEvent` records to its
+`listeners`, which are plain callables, at a limited rate. `ProgressGroup`
+combines the events of concurrent transfers into one, and `TqdmRenderer`
+draws a tqdm progressbar per transfer. No `Progress` object is created when
+nobody is listening, so that chunks aren't counted in vain.
+"""
+
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+# tqdm is only imported once a progressbar is drawn
+if TYPE_CHECKING:
+    from tqdm import tqdm
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    """
+    Snapshot of a transfer. `transfer` identifies the transfer among concurrent
+    ones, `operation` is one of `upload`, `download` or `extract` (or `total` for
+    the combined events of a `ProgressGroup`), and `name` describes the file.
+    `total` is `None` if the size isn't known in advance (e.g. for streams).
+    `rate` is the average number of bytes per second since the transfer started,
+    `note` holds additional information such as the compression ratio, and the
+    last event of a transfer has `finished` set, along with `error` if it failed.
+    """
+    transfer: int
+    operation: str
+    name: str
+    completed: int
+    total: Optional[int]
+    elapsed: float
+    rate: float
+    note: Optional[str] = None
+    finished: bool = False
+    error: Optional[str] = None
+
+    @property
+    def fraction(self) -> Optional[float]:
+        """
+        Return the completed fraction of the transfer, or `None` if its size is unknown.
+        """
+        return min(self.completed / self.total, 1.0) if self.total else None
+
+    @property
+    def eta(self) -> Optional[float]:
+        """
+        Return the estimated number of seconds until the transfer completes.
+        """
+        return max(self.total - self.completed, 0) / self.rate if self.total and self.rate > 0 else None
+
+
+class Progress:
+    """
+    Progress of a single transfer. `update` only adds to the byte count, and
+    emits an event to the `listeners` if at least `1 / rate` seconds have passed
+    since the last one. Closing the transfer (or leaving its context) always
+    emits a final event. `note` may be set to a callable that is evaluated only
+    when an event is emitted.
+    """
+    _rate = 10
+    _ids = itertools.count(1)
+
+    __slots__ = ['transfer', 'operation', 'name', 'total', 'completed', 'listeners', 'interval', 'note',
+                 '_initial', '_start', '_deadline', '_finished', '_lock']
+
+    def __init__(self,
+                 operation: str,
+                 name: str,
+                 total: Optional[int],
+                 listeners: List[Callable[[ProgressEvent], None]],
+                 rate: float=_rate,
+                 completed: int=0) -> Progress:
+        self.transfer = next(Progress._ids)
+        self.operation = operation
+        self.name = name
+        self.total = total
+        self.completed = completed
+        self.listeners = list(listeners)
+        self.interval = 1 / rate if rate > 0 else 0
+        self.note: Optional[Callable[[], str]] = None
+        self._initial = completed
+        self._start = time.monotonic()
+        self._deadline = self._start
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> Progress:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(exc_value)
+
+    def update(self, amount: int) -> None:
+        self.completed += amount
+        if time.monotonic() >= self._deadline:
+            self.__emit()
+
+    def snapshot(self, error: Optional[BaseException]=None) -> ProgressEvent:
+        elapsed = time.monotonic() - self._start
+        return ProgressEvent(
+            transfer=self.transfer,
+            operation=self.operation,
+            name=self.name,
+            completed=self.completed,
+            total=self.total,
+            elapsed=elapsed,
+            rate=(self.completed - self._initial) / elapsed if elapsed > 0 else 0.0,
+            note=self.note() if self.note is not None else None,
+            finished=self._finished,
+            error=type(error).__name__ if error is not None else None
+        )
+
+    def __emit(self, final: bool=False, error: Optional[BaseException]=None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._finished or (not final and now < self._deadline):
+                return
+            self._deadline = now + self.interval
+            self._finished = final
+            event = self.snapshot(error)
+        for listener in self.listeners:
+            listener(event)
+
+    def close(self, error: Optional[BaseException]=None) -> None:
+        """
+        Emit the final event of this transfer, unless it was already emitted.
+        """
+        self.__emit(final=True, error=error)
+
+
+class ProgressGroup:
+    """
+    Listener that combines the events of concurrent transfers into a single event
+    for all of them, which is emitted to its own `listeners` at most `rate` times
+    per second. The combined event counts the bytes of finished transfers as well,
+    its `rate` is the sum of the rates of the active transfers, and its `total`
+    is `None` as long as the size of any transfer is unknown. Call `close` to emit
+    the final event once all transfers are done.
+
+    Example
+    -------
+
+    ```
+    from anonfile import AnonFile, ProgressGroup
+
+    group = ProgressGroup([lambda event: print(f"{event.completed} bytes, {event.note}")])
+    with AnonFile(listeners=[group]) as anon:
+        for url in urls:
+            anon.download(url)
+    group.close()
+    ```
+    """
+    _name = 'Total'
+    _rate = 10
+
+    __slots__ = ['name', 'listeners', 'interval', '_active', '_completed', '_total', '_finished', '_start', '_deadline', '_lock']
+
+    def __init__(self,
+                 listeners: Optional[List[Callable[[ProgressEvent], None]]]=None,
+                 name: str=_name,
+                 rate: float=_rate) -> ProgressGroup:
+        self.name = name
+        self.listeners = list(listeners or [])
+        self.interval = 1 / rate if rate > 0 else 0
+        self._active: Dict[int, ProgressEvent] = {}
+        self._completed = 0
+        self._total: Optional[int] = 0
+        self._finished = 0
+        self._start = time.monotonic()
+        self._deadline = self._start
+        self._lock = threading.Lock()
+
+    def __call__(self, event: ProgressEvent) -> None:
+        with self._lock:
+            if event.finished:
+                self._active.pop(event.transfer, None)
+                self._completed += event.completed
+                self._total = self._total + event.total if self._total is not None and event.total is not None else None
+                self._finished += 1
+            else:
+                self._active[event.transfer] = event
+            now = time.monotonic()
+            if now < self._deadline or not self.listeners:
+                return
+            self._deadline = now + self.interval
+            event = self.__combine(now)
+        for listener in self.listeners:
+            listener(event)
+
+    def snapshot(self) -> ProgressEvent:
+        with self._lock:
+            return self.__combine(time.monotonic())
+
+    def __combine(self, now: float, finished: bool=False) -> ProgressEvent:
+        active = self._active.values()
+        total = self._total
+        if total is not None and all(event.total is not None for event in active):
+            total += sum(event.total for event in active)
+        else:
+            total = None
+        return ProgressEvent(
+            transfer=0,
+            operation='total',
+            name=self.name,
+            completed=self._completed + sum(event.completed for event in active),
+            total=total,
+            elapsed=now - self._start,
+            rate=sum(event.rate for event in active),
+            note=f"{len(self._active)} active, {self._finished} done",
+            finished=finished
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            event = self.__combine(time.monotonic(), finished=True)
+        for listener in self.listeners:
+            listener(event)
+
+
+class TqdmRenderer:
+    """
+    Listener that draws one tqdm progressbar per transfer (which requires tqdm),
+    and closes it once the transfer is finished.
+    """
+    __slots__ = ['bars', '_lock']
+
+    def __init__(self) -> TqdmRenderer:
+        self.bars: Dict[int, 'tqdm'] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: ProgressEvent) -> None:
+        from tqdm import tqdm
+
+        from .anonfile import AnonFile
+
+        with self._lock:
+            bar = self.bars.get(event.transfer)
+            if bar is None:
+                desc = {'upload': f"Upload: {event.name}", 'total': event.name}.get(event.operation, f"{event.operation.capitalize()} {event.name}")
+                options = AnonFile._progressbar_options(None, desc, unit='B', total=event.total, disable=True)
+                bar = self.bars[event.transfer] = tqdm(initial=event.completed, **options)
+            if bar.total != event.total:
+                bar.total = event.total
+            if event.note is not None:
+                bar.set_postfix_str(event.note, refresh=False)
+            bar.update(event.completed - bar.n)
+            if event.finished:
+                del self.bars[event.transfer]
+                bar.close()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+"""
+Retry policy for the anonfiles client. `RetryPolicy` extends the urllib3 retry
+configuration of `AnonFile` (`total`, `status_forcelist` and `backoff_factor`)
+with decorrelated jitter, capped `Retry-After` delays, a circuit breaker per
+host and a retry budget that is shared by all requests of one client, so that
+concurrent workers don't retry in lockstep and make an overloaded server worse.
+The transport adapter of the policy also times how long new connections take to
+resolve, connect and complete the TLS handshake, see `connection_phases`.
+"""
+
+from __future__ import annotations
+
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NameResolutionError, ResponseError
+from urllib3.util.connection import allowed_gai_family
+
+_phases = threading.local()
+
+
+@contextmanager
+def connection_phases() -> Iterator[Dict[str, float]]:
+    """
+    Collect the number of seconds that connections opened on this thread spend
+    on DNS resolution (`dns`), connecting (`connect`) and the TLS handshake (`tls`)
+    in this context, summed up over all attempts. A phase is missing if no new
+    connection went through it, e.g. because a pooled connection was reused.
+    Only connections made through the adapter of a `RetryPolicy` are timed.
+    """
+    previous, _phases.timings = getattr(_phases, 'timings', None), {}
+    try:
+        yield _phases.timings
+    finally:
+        _phases.timings = previous
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of sending a request while the circuit breaker of its host is open.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker per host. After `threshold` consecutive failed requests to
+    a host its circuit opens, and requests to that host fail immediately for
+    `reset_timeout` seconds. After that, a single trial request is let through:
+    if it succeeds the circuit closes, otherwise it opens again.
+    """
+    _threshold = 5
+    _reset_timeout = 30
+
+    __slots__ = ['threshold', 'reset_timeout', '_hosts', '_lock']
+
+    def __init__(self, threshold: int=_threshold, reset_timeout: float=_reset_timeout) -> CircuitBreaker:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._hosts: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def state(self, host: str) -> str:
+        """
+        Return the state of the circuit of `host`: `closed`, `open` or `half-open`.
+        """
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None or entry['opened'] is None:
+                return 'closed'
+            return 'half-open' if time.monotonic() - entry['opened'] >= self.reset_timeout else 'open'
+
+    def allow(self, host: str) -> bool:
+        """
+        Return whether a request to `host` may be sent. Only one trial request
+        is allowed at a time while the circuit is half-open.
+        """
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None or entry['opened'] is None:
+                return True
+            if time.monotonic() - entry['opened'] < self.reset_timeout or entry['trial']:
+                return False
+            entry['trial'] = True
+            return True
+
+    def record(self, host: str, failed: bool) -> bool:
+        """
+        Record the outcome of a request to `host`, and return whether this opened
+        its circuit.
+        """
+        with self._lock:
+            entry = self._hosts.setdefault(host, {'failures': 0, 'opened': None, 'trial': False})
+            trial, entry['trial'] = entry['trial'], False
+            if not failed:
+                entry['failures'], entry['opened'] = 0, None
+                return False
+            entry['failures'] += 1
+            if trial or (entry['opened'] is None and entry['failures'] >= self.threshold):
+                entry['opened'] = time.monotonic()
+                return True
+            return False
+
+
+class RetryBudget:
+    """
+    Token bucket that limits the retries of all requests of a client. Every retry
+    takes one token, and every successful request returns `ratio` tokens up to
+    `capacity`, so that retries can't exceed a fraction of the successful traffic
+    once the initial allowance is used up.
+    """
+    _capacity = 20
+    _ratio = 0.1
+
+    __slots__ = ['capacity', 'ratio', 'tokens', '_lock']
+
+    def __init__(self, capacity: float=_capacity, ratio: float=_ratio) -> RetryBudget:
+        self.capacity = capacity
+        self.ratio = ratio
+        self.tokens = float(capacity)
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, self.capacity)
+
+    def withdraw(self) -> bool:
+        """
+        Take a token for a retry, and return `False` if the budget is exhausted.
+        """
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Shared retry state of an `AnonFile` instance. Backoff delays follow the
+    decorrelated jitter scheme (each delay is drawn uniformly between the backoff
+    factor and three times the previous delay, up to `backoff_max`), and delays
+    requested by a `Retry-After` header are honored up to `retry_after_max`
+    seconds with up to 10% of jitter on top.
+
+    Events are counted in `counters` (`retry`, `budget_exhausted`, `breaker_trip`
+    and `breaker_rejection`) and passed to each of the `observers` along with the
+    host they concern.
+
+    Example
+    -------
+
+    ```
+    from anonfile import AnonFile, CircuitBreaker, RetryBudget, RetryPolicy
+
+    policy = RetryPolicy(breaker=CircuitBreaker(threshold=3), budget=RetryBudget(capacity=50))
+    anon = AnonFile(retry_policy=policy)
+    ```
+    """
+    _backoff_max = 60
+    _retry_after_max = 300
+
+    __slots__ = ['backoff_max', 'retry_after_max', 'breaker', 'budget', 'observers', 'counters', '_lock']
+
+    def __init__(self,
+                 backoff_max: float=_backoff_max,
+                 retry_after_max: float=_retry_after_max,
+                 breaker: Optional[CircuitBreaker]=None,
+                 budget: Optional[RetryBudget]=None,
+                 observers: Optional[List[Callable[[str, str], None]]]=None) -> RetryPolicy:
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        self.observers = list(observers or [])
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, event: str, host: str) -> None:
+        with self._lock:
+            self.counters[event] += 1
+        for observer in self.observers:
+            observer(event, host)
+
+    def retry(self, total: int, status_forcelist: List[int], backoff_factor: float, **kwargs) -> Retry:
+        """
+        Return a urllib3 retry configuration that applies this policy.
+        """
+        return _PolicyRetry(total=total, status_forcelist=status_forcelist, backoff_factor=backoff_factor,
+                            backoff_max=self.backoff_max, policy=self, **kwargs)
+
+    def adapter(self, **kwargs) -> HTTPAdapter:
+        """
+        Return a transport adapter that enforces the circuit breaker of this policy.
+        Keyword arguments are passed on to `HTTPAdapter`.
+        """
+        return _PolicyAdapter(self, **kwargs)
+
+
+class _PolicyRetry(Retry):
+    def __init__(self, *args, policy: Optional[RetryPolicy]=None, previous_backoff: float=0, **kwargs) -> _PolicyRetry:
+        super().__init__(*args, **kwargs)
+        self.policy = policy
+        self.previous_backoff = previous_backoff
+
+    def new(self, **kwargs) -> _PolicyRetry:
+        kwargs.setdefault('policy', self.policy)
+        kwargs.setdefault('previous_backoff', self.previous_backoff)
+        return super().new(**kwargs)
+
+    def get_backoff_time(self) -> float:
+        if self.backoff_factor <= 0 or not self.history:
+            return 0
+        # decorrelated jitter, remembered so that the next retry continues from here
+        backoff = min(self.backoff_max, random.uniform(self.backoff_factor, max(self.previous_backoff, self.backoff_factor) * 3))
+        self.previous_backoff = backoff
+        return backoff
+
+    def get_retry_after(self, response) -> Optional[float]:
+        retry_after = super().get_retry_after(response)
+        if retry_after is None or self.policy is None:
+            return retry_after
+        retry_after = min(retry_after, self.policy.retry_after_max)
+        return retry_after + random.uniform(0, retry_after / 10)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None) -> _PolicyRetry:
+        try:
+            retry = self.__increment(method, url, response, error, _pool, _stacktrace)
+        except MaxRetryError as exhausted:
+            # tells the adapter which status the retries ran out on, see `_PolicyAdapter.send`
+            exhausted.status = getattr(response, 'status', None)
+            raise
+        return retry
+
+    def __increment(self, method, url, response, error, _pool, _stacktrace) -> _PolicyRetry:
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        policy = self.policy
+        if policy is None or (response is not None and response.get_redirect_location()):
+            return retry
+        host = getattr(_pool, 'host', None) or ''
+        reason = error or ResponseError(f"too many {getattr(response, 'status', 'error')} error responses")
+        if policy.breaker.state(host) == 'open':
+            # another request has given up on this host in the meantime
+            raise MaxRetryError(_pool, url, reason)
+        if not policy.budget.withdraw():
+            policy.count('budget_exhausted', host)
+            raise MaxRetryError(_pool, url, reason)
+        policy.count('retry', host)
+        return retry
+
+
+class _TimedConnection:
+    """
+    Mixin for urllib3 connections that adds the time spent on DNS resolution and
+    connecting to the phases collected by `connection_phases`.
+    """
+    def _new_conn(self) -> socket.socket:
+        phases = getattr(_phases, 'timings', None)
+        if phases is None:
+            return super()._new_conn()
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host.strip('[]'), self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror as error:
+            raise NameResolutionError(self.host, self, error) from error
+        resolved = time.perf_counter()
+        phases['dns'] = phases.get('dns', 0) + resolved - start
+        host = self._dns_host
+        try:
+            # connect to the resolved addresses in turn, so that the host isn't resolved twice
+            for (index, address) in enumerate(addresses, 1):
+                self._dns_host = address[4][0]
+                try:
+                    sock = super()._new_conn()
+                    break
+                except ConnectTimeoutError:
+                    if index == len(addresses):
+                        raise
+        finally:
+            self._dns_host = host
+        phases['connect'] = phases.get('connect', 0) + time.perf_counter() - resolved
+        return sock
+
+
+class _TimedHTTPConnection(_TimedConnection, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnection, HTTPSConnection):
+    def connect(self) -> None:
+        phases = getattr(_phases, 'timings', None)
+        if phases is None:
+            return super().connect()
+        start, before = time.perf_counter(), phases.get('dns', 0) + phases.get('connect', 0)
+        super().connect()
+        # whatever follows the TCP connection counts as handshake, including a proxy tunnel
+        tcp = phases.get('dns', 0) + phases.get('connect', 0) - before
+        phases['tls'] = phases.get('tls', 0) + time.perf_counter() - start - tcp
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _PolicyAdapter(HTTPAdapter):
+    _pool_classes = {'http': _TimedHTTPConnectionPool, 'https': _TimedHTTPSConnectionPool}
+
+    def __init__(self, policy: RetryPolicy, **kwargs) -> _PolicyAdapter:
+        self.policy = policy
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(_PolicyAdapter._pool_classes)
+
+    def proxy_manager_for(self, proxy: str, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        # SOCKS proxies bring their own connection classes
+        if not proxy.lower().startswith('socks'):
+            manager.pool_classes_by_scheme = dict(_PolicyAdapter._pool_classes)
+        return manager
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        host = urlparse(request.url).hostname or ''
+        if not self.policy.breaker.allow(host):
+            self.policy.count('breaker_rejection', host)
+            raise CircuitOpenError(f"circuit breaker for {host} is open", request=request)
+        try:
+            response = super().send(request, **kwargs)
+        except Exception as error:
+            self.__record(host, failed=_PolicyAdapter.__is_failure(error))
+            raise
+        self.__record(host, failed=_PolicyAdapter.__is_overload(response.status_code))
+        return response
+
+    @staticmethod
+    def __is_overload(status: Optional[int]) -> bool:
+        # client errors such as 413 may be retried, but don't count against the host
+        return status is None or status >= 500 or status == 429
+
+    @staticmethod
+    def __is_failure(error: Exception) -> bool:
+        """
+        Return whether `error` counts as a failure of the host: connection errors
+        and timeouts do, as well as retries that ran out on server errors.
+        """
+        if isinstance(error, requests.exceptions.RetryError):
+            return _PolicyAdapter.__is_overload(getattr(error.args[0] if error.args else None, 'status', None))
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+    def __record(self, host: str, failed: bool) -> None:
+        if self.policy.breaker.record(host, failed):
+            self.policy.count('breaker_trip', host)
+        if not failed:
+            self.policy.budget.deposit()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""
+Spool daemon for the anonfiles client. `SpoolDaemon` watches a spool directory
+(and optionally a Unix socket) for upload and download jobs and runs them on a
+bounded pool of worker threads that share one `AnonFile` instance, so that its
+connection pools stay warm between jobs. Every job is recorded in a `Journal`
+before it's accepted and again once it's finished, so that jobs that were
+queued or running when the daemon stopped are picked up on the next start.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+from .anonfile import AnonFile
+from .progress import ProgressGroup
+
+
+@dataclass(frozen=True)
+class Job:
+    """
+    A single upload or download. `kind` is `upload` or `download`, and `target`
+    is the path of the file to upload or the URL to download. `id` is unique
+    among all jobs of a journal.
+    """
+    id: str
+    kind: str
+    target: str
+
+
+class Journal:
+    """
+    Append-only journal of job records in the JSON lines format. Each record is
+    flushed and synced to disk before `append` returns, and a line that was cut
+    short by a crash is ignored on replay.
+    """
+    __slots__ = ['path', '_file_handler', '_lock']
+
+    def __init__(self, path: Union[str, Path]) -> Journal:
+        self.path = Path(path)
+        self._file_handler = None
+        self._lock = threading.Lock()
+
+    def replay(self) -> Dict[str, dict]:
+        """
+        Return the latest record of each job, keyed by its ID.
+        """
+        records = {}
+        if self.path.exists():
+            with open(self.path, mode='r', encoding='utf-8', errors='replace') as file_handler:
+                for line in file_handler:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    records[record['id']] = {**records.get(record['id'], {}), **record}
+        return records
+
+    def append(self, records: Iterable[dict]) -> None:
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        with self._lock:
+            if self._file_handler is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file_handler = open(self.path, mode='a', encoding='utf-8')
+            self._file_handler.write(lines)
+            self._file_handler.flush()
+            os.fsync(self._file_handler.fileno())
+
+    def compact(self, records: Iterable[dict]) -> None:
+        """
+        Replace the journal with `records`. The file is replaced atomically, so a
+        crash leaves either the old or the new journal behind.
+        """
+        with self._lock:
+            self.close()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with open(tmp_path, mode='w', encoding='utf-8') as file_handler:
+                file_handler.writelines(json.dumps(record) + '\n' for record in records)
+                file_handler.flush()
+                os.fsync(file_handler.fileno())
+            os.replace(tmp_path, self.path)
+
+    def close(self) -> None:
+        if self._file_handler is not None:
+            self._file_handler.close()
+            self._file_handler = None
+
+
+class SpoolDaemon:
+    """
+    Process the job files that show up in the directory `spool` on `jobs` worker
+    threads. Job files use the batch file format of the CLI, one URL (or path)
+    per line and `#` for comments: files with the `.upload` suffix list files to
+    upload, all other files list URLs to download. Write job files under a name
+    that starts with a dot (or ends with `.tmp`) and rename them when they're
+    complete, because the spool directory is polled every `interval` seconds and
+    each job file is removed as soon as its jobs are in the journal. Files that
+    can't be read are renamed with the `.rejected` suffix.
+
+    If `socket_path` is set, the daemon also accepts commands on a Unix socket,
+    one per line: `download <url> ...` and `upload <path> ...` queue jobs and
+    reply with their IDs, `stats` replies with the current statistics. Replies are
+    JSON objects on a line of their own.
+
+    Downloads are saved in the directory `path`, and the keyword arguments in
+    `download_options` and `upload_options` are passed on to `AnonFile.download`
+    and `AnonFile.upload`. The journal (`journal.jsonl`) and the statistics
+    (`stats.json`, rewritten every `interval` seconds) are kept in the spool
+    directory. Transfers that are still running when the daemon stops are
+    resumed on the next start.
+
+    Example
+    -------
+
+    ```
+    from anonfile import AnonFile
+    from anonfile.serve import SpoolDaemon
+
+    with AnonFile() as anon:
+        SpoolDaemon(anon, '/var/spool/anonfile', jobs=8, download_options={'segments': 4}).serve()
+    ```
+    """
+    _jobs = 4
+    _interval = 1.0
+    _reserved = ('journal.jsonl', 'stats.json')
+
+    __slots__ = ['anon', 'spool', 'path', 'jobs', 'interval', 'socket_path', 'download_options', 'upload_options',
+                 'journal', 'progress', '_queue', '_seen', '_counters', '_active', '_start', '_stop', '_lock']
+
+    def __init__(self,
+                 anon: AnonFile,
+                 spool: Union[str, Path],
+                 path: Union[str, Path]=Path.cwd(),
+                 jobs: int=_jobs,
+                 interval: float=_interval,
+                 socket_path: Optional[Union[str, Path]]=None,
+                 download_options: Optional[dict]=None,
+                 upload_options: Optional[dict]=None) -> SpoolDaemon:
+        self.anon = anon
+        self.spool = Path(spool)
+        self.path = Path(path)
+        self.jobs = max(jobs, 1)
+        self.interval = interval
+        self.socket_path = Path(socket_path) if socket_path is not None else None
+        self.download_options = dict(download_options or {})
+        self.upload_options = dict(upload_options or {})
+        self.journal = Journal(self.spool.joinpath('journal.jsonl'))
+        # counts the bytes of all transfers for the throughput statistics
+        self.progress = ProgressGroup(rate=0)
+        self.anon.listeners.append(self.progress)
+        self._queue: queue.Queue = queue.Queue()
+        self._seen = set()
+        self._counters = {'done': 0, 'failed': 0}
+        self._active = 0
+        self._start = time.monotonic()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def read_job_file(path: Path) -> List[str]:
+        with open(path, mode='r', encoding='utf-8') as file_handler:
+            return [line.strip() for line in file_handler if line.strip() and not line.startswith('#')]
+
+    def submit(self, kind: str, targets: Iterable[str], prefix: Optional[str]=None) -> List[Job]:
+        """
+        Record jobs of `kind` for `targets` in the journal and queue them. Jobs
+        are identified by `prefix` (random by default) and their position in
+        `targets`, and jobs that are already known under that ID are skipped.
+        """
+        if kind not in ('upload', 'download'):
+            raise ValueError(f"unsupported job kind {kind!r}, expected 'upload' or 'download'")
+        prefix = prefix or uuid.uuid4().hex
+        with self._lock:
+            jobs = [job for job in (Job(f"{prefix}:{index}", kind, target) for (index, target) in enumerate(targets, 1)) if job.id not in self._seen]
+            self._seen.update(job.id for job in jobs)
+        self.journal.append({**asdict(job), 'state': 'queued'} for job in jobs)
+        for job in jobs:
+            self._queue.put(job)
+        return jobs
+
+    def stats(self) -> dict:
+        """
+        Return the queue depth, the number of running, finished and failed jobs,
+        the number of bytes transferred since the start along with the average
+        throughput and the current rate in bytes per second, and the uptime.
+        """
+        uptime = time.monotonic() - self._start
+        progress = self.progress.snapshot()
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'active': self._active,
+                **self._counters,
+                'bytes': progress.completed,
+                'throughput': round(progress.completed / uptime, 1) if uptime > 0 else 0.0,
+                'rate': round(progress.rate, 1),
+                'uptime': round(uptime, 1),
+            }
+
+    def __job_files(self) -> Dict[str, Path]:
+        """
+        Return the complete job files in the spool directory, keyed by their name
+        and modification time, which prefix the IDs of their jobs.
+        """
+        job_files = {}
+        for entry in sorted(os.scandir(self.spool), key=lambda entry: entry.name):
+            if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith(('.tmp', '.rejected')) and entry.name not in self._reserved:
+                job_files[f"{entry.name}@{entry.stat().st_mtime_ns}"] = Path(entry.path)
+        return job_files
+
+    def __recover(self) -> None:
+        """
+        Queue the jobs that weren't finished when the daemon stopped, and compact
+        the journal down to those. The jobs of job files that are still in the spool
+        directory are kept as well, so that they're skipped when the file is read again.
+        """
+        records = self.journal.replay()
+        job_files = self.__job_files()
+        pending = {key: record for (key, record) in records.items() if record.get('state') == 'queued' or key.rpartition(':')[0] in job_files}
+        self.journal.compact(pending.values())
+        self._seen.update(records)
+        for record in pending.values():
+            if record.get('state') == 'queued':
+                self._queue.put(Job(record['id'], record['kind'], record['target']))
+
+    def __scan(self) -> None:
+        for (prefix, path) in self.__job_files().items():
+            try:
+                targets = self.read_job_file(path)
+            except (OSError, UnicodeDecodeError):
+                # keep the file for inspection, but don't try again
+                path.replace(path.with_name(f"{path.name}.rejected"))
+                continue
+            self.submit('upload' if path.suffix == '.upload' else 'download', targets, prefix)
+            path.unlink()
+
+    def __write_stats(self) -> None:
+        stats_path = self.spool.joinpath('stats.json')
+        tmp_path = stats_path.with_name(f"{stats_path.name}.tmp")
+        with open(tmp_path, mode='w', encoding='utf-8') as file_handler:
+            json.dump(self.stats(), file_handler)
+        os.replace(tmp_path, stats_path)
+
+    def __run(self, job: Job) -> dict:
+        if job.kind == 'upload':
+            result = self.anon.upload(job.target, **self.upload_options)
+        else:
+            result = self.anon.download(job.target, self.path, **self.download_options)
+        return {'url': result.url.geturl(), 'file': str(result.file_path), 'digest': result.digest}
+
+    def __work(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self._queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._active += 1
+            try:
+                record = {'id': job.id, 'state': 'done', **self.__run(job)}
+            except Exception as error:
+                record = {'id': job.id, 'state': 'failed', 'error': f"{type(error).__name__}: {error}"}
+            self.journal.append([record])
+            with self._lock:
+                self._active -= 1
+                self._counters[record['state']] += 1
+
+    def __listen(self) -> socketserver.BaseServer:
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    (command, *arguments) = line.decode('utf-8').split() or ['']
+                    try:
+                        if command == 'stats':
+                            reply = daemon.stats()
+                        elif command in ('upload', 'download'):
+                            reply = {'jobs': [job.id for job in daemon.submit(command, arguments)]}
+                        else:
+                            reply = {'error': f"unknown command {command!r}, expected 'upload', 'download' or 'stats'"}
+                    except Exception as error:
+                        reply = {'error': str(error)}
+                    self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+        if self.socket_path.exists():
+            # left behind by a daemon that didn't shut down cleanly
+            self.socket_path.unlink()
+        server = socketserver.ThreadingUnixStreamServer(str(self.socket_path), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='anonfile-socket', daemon=True).start()
+        return server
+
+    def serve(self) -> None:
+        """
+        Process jobs until `stop` is called.
+        """
+        if self.socket_path is not None and not hasattr(socket, 'AF_UNIX'):
+            raise OSError("Unix sockets aren't supported on this platform")
+        self.spool.mkdir(parents=True, exist_ok=True)
+        self.__recover()
+        workers = [threading.Thread(target=self.__work, name=f"anonfile-worker-{index}", daemon=True) for index in range(self.jobs)]
+        for worker in workers:
+            worker.start()
+        server = self.__listen() if self.socket_path is not None else None
+        try:
+            while not self._stop.is_set():
+                self.__scan()
+                self.__write_stats()
+                self._stop.wait(self.interval)
+        finally:
+            self._stop.set()
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+                self.socket_path.unlink(missing_ok=True)
+            for worker in workers:
+                # running transfers are resumed on the next start if they don't finish in time
+                worker.join(timeout=self.interval)
+            self.__write_stats()
+            self.journal.close()
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+"""
+On-the-fly tar archives and gzip/zstd (de)compression of chunked streams, as
+used by `AnonFile.upload` and `AnonFile.download`. Only transfers of directories
+or compressed data import this module.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple
+
+from .anonfile import MB, compression_suffixes
+
+if TYPE_CHECKING:
+    import tarfile
+
+    from .progress import Progress
+
+class _ChunkReader:
+    """
+    Expose an iterable of bytes as a readable binary file object.
+    """
+    __slots__ = ['_chunks', '_chunk', '_offset']
+
+    def __init__(self, chunks: Iterable[bytes]) -> _ChunkReader:
+        self._chunks = iter(chunks)
+        self._chunk = b''
+        self._offset = 0
+
+    def read(self, size: int=-1) -> bytes:
+        # only slice off what is requested, large chunks are never copied as a whole
+        parts = []
+        while size != 0:
+            if self._offset >= len(self._chunk):
+                (self._chunk, self._offset) = (next(self._chunks, None), 0)
+                if self._chunk is None:
+                    self._chunk = b''
+                    break
+            end = len(self._chunk) if size < 0 else min(len(self._chunk), self._offset + size)
+            parts.append(self._chunk[self._offset:end])
+            size -= end - self._offset if size > 0 else 0
+            self._offset = end
+        return b''.join(parts)
+
+def _import_zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the optional zstandard package (pip install anonfile[zstd])") from None
+    return zstandard
+
+class _Compressor:
+    """
+    Compress a stream of chunks with `gzip` or `zstd` in bounded memory, and keep
+    track of the number of bytes that go in and out.
+    """
+    __slots__ = ['algorithm', 'bytes_in', 'bytes_out', '_compressor']
+
+    def __init__(self, algorithm: str) -> _Compressor:
+        import zlib
+
+        if algorithm == 'gzip':
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif algorithm == 'zstd':
+            self._compressor = _import_zstd().ZstdCompressor(level=3).compressobj()
+        else:
+            raise ValueError(f"unsupported compression {algorithm!r}, expected one of {list(compression_suffixes)}")
+        self.algorithm = algorithm
+        self.bytes_in = self.bytes_out = 0
+
+    @property
+    def suffix(self) -> str:
+        return compression_suffixes[self.algorithm]
+
+    @property
+    def ratio(self) -> float:
+        return self.bytes_in / self.bytes_out if self.bytes_out else 1.0
+
+    def stream(self, chunks: Iterable[bytes], progress: Optional[Progress]=None, update: bool=True) -> Iterator[bytes]:
+        """
+        Yield the compressed `chunks`. Report the uncompressed size to `progress`
+        if `update` is set, and the compression ratio in its note.
+        """
+        if progress is not None:
+            progress.note = lambda: f"ratio {self.ratio:.2f}x"
+        for chunk in chunks:
+            self.bytes_in += len(chunk)
+            if progress is not None and update:
+                progress.update(len(chunk))
+            if data := self._compressor.compress(chunk):
+                self.bytes_out += len(data)
+                yield data
+        data = self._compressor.flush()
+        self.bytes_out += len(data)
+        yield data
+
+class _Decompressor:
+    """
+    Decompress a stream of chunks with `gzip` (including multi-member files) or
+    `zstd` in bounded memory.
+    """
+    _magic_numbers = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd'}
+    _max_length = 16*MB
+
+    __slots__ = ['algorithm', 'bytes_in', 'bytes_out', '_decompressor']
+
+    def __init__(self, algorithm: str) -> _Decompressor:
+        if algorithm not in compression_suffixes:
+            raise ValueError(f"unsupported compression {algorithm!r}, expected one of {list(compression_suffixes)}")
+        self.algorithm = algorithm
+        self.bytes_in = self.bytes_out = 0
+        self._decompressor = self.__create()
+
+    def __create(self):
+        import zlib
+        return zlib.decompressobj(31) if self.algorithm == 'gzip' else _import_zstd().ZstdDecompressor().decompressobj()
+
+    @staticmethod
+    def detect(name: str, head: bytes=b'') -> Optional[str]:
+        """
+        Return the compression algorithm indicated by the suffix of `name`, or else
+        by the magic number at the start of `head`.
+        """
+        for (algorithm, suffix) in compression_suffixes.items():
+            if name.endswith(suffix):
+                return algorithm
+        return next((algorithm for (magic, algorithm) in _Decompressor._magic_numbers.items() if head.startswith(magic)), None)
+
+    def __feed(self, data: bytes) -> Iterator[bytes]:
+        while data:
+            if self.algorithm == 'gzip':
+                # cap the output per call so that highly compressed data can't exhaust memory
+                output = self._decompressor.decompress(data, self._max_length)
+                data = self._decompressor.unconsumed_tail
+            else:
+                (output, data) = (self._decompressor.decompress(data), b'')
+            self.bytes_out += len(output)
+            yield output
+            if self._decompressor.eof:
+                # continue with the next gzip member or zstd frame
+                (data, self._decompressor) = (self._decompressor.unused_data + data, self.__create())
+
+    def stream(self, chunks: Iterable[bytes], progress: Optional[Progress]=None) -> Iterator[bytes]:
+        """
+        Yield the decompressed `chunks`, and report the ratio in the note of `progress`.
+        """
+        if progress is not None:
+            progress.note = lambda: f"ratio {self.bytes_out / max(self.bytes_in, 1):.2f}x"
+        for chunk in chunks:
+            self.bytes_in += len(chunk)
+            yield from self.__feed(chunk)
+
+class _TarStream:
+    """
+    Generate a tar archive of the directory `root` on the fly, in chunks of about
+    `chunk_size` bytes. Files are matched against
+    the glob patterns in `include` and `exclude` by their path relative to `root`;
+    excluded directories are skipped entirely. `size` sums up the sizes of all
+    files in the archive.
+    """
+    _chunk_size = 1*MB
+
+    __slots__ = ['root', 'members', 'size']
+
+    def __init__(self, root: Path, include: Optional[List[str]]=None, exclude: Optional[List[str]]=None) -> _TarStream:
+        self.root = Path(root)
+        self.members = list(self.__walk(include or [], exclude or []))
+        self.size = sum(info.size for (_, info) in self.members)
+
+    @property
+    def name(self) -> str:
+        return f"{self.root.resolve().name}.tar"
+
+    def __walk(self, include: List[str], exclude: List[str]) -> Iterator[Tuple[Path, 'tarfile.TarInfo']]:
+        import fnmatch
+        import stat
+        import tarfile
+
+        matches = lambda relative, patterns: any(fnmatch.fnmatch(relative, pattern) for pattern in patterns)
+        prefix = self.root.resolve().name
+        for (directory, dirnames, filenames) in os.walk(self.root):
+            relative_dir = Path(directory).relative_to(self.root)
+            dirnames[:] = sorted(name for name in dirnames if not matches((relative_dir / name).as_posix(), exclude))
+            entries = [(name, True) for name in dirnames] + [(name, False) for name in sorted(filenames)]
+            for (name, is_dir) in entries:
+                path, relative = Path(directory).joinpath(name), (relative_dir / name).as_posix()
+                if not is_dir and (matches(relative, exclude) or (include and not matches(relative, include))):
+                    continue
+                status = os.lstat(path)
+                info = tarfile.TarInfo(f"{prefix}/{relative}")
+                info.mtime, info.mode = int(status.st_mtime), stat.S_IMODE(status.st_mode)
+                if stat.S_ISLNK(status.st_mode):
+                    info.type, info.linkname = tarfile.SYMTYPE, os.readlink(path)
+                elif is_dir:
+                    info.type = tarfile.DIRTYPE
+                elif stat.S_ISREG(status.st_mode):
+                    info.size = status.st_size
+                else:
+                    continue
+                yield path, info
+
+    def __blocks(self, progress: Optional[Progress]) -> Iterator[bytes]:
+        import tarfile
+
+        written = 0
+        for (path, info) in self.members:
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            written += len(header)
+            yield header
+            if not info.isreg():
+                continue
+            remaining = info.size
+            # stick to the size in the header even if the file changes in the meantime
+            with open(path, mode='rb') as file_handler:
+                while remaining > 0 and (chunk := file_handler.read(min(self._chunk_size, remaining))):
+                    remaining -= len(chunk)
+                    if progress is not None:
+                        progress.update(len(chunk))
+                    yield chunk
+            padding = remaining + (-info.size % tarfile.BLOCKSIZE)
+            written += info.size + padding - remaining
+            yield tarfile.NUL * padding
+        end = 2 * tarfile.BLOCKSIZE
+        yield tarfile.NUL * (end + (-(written + end) % tarfile.RECORDSIZE))
+
+    def chunks(self, progress: Optional[Progress]=None) -> Iterator[bytes]:
+        """
+        Yield the archive in chunks and report the progress of file contents to `progress`.
+        """
+        buffer = bytearray()
+        for block in self.__blocks(progress):
+            buffer += block
+            if len(buffer) >= self._chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
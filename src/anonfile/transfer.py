@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+Resumable and segmented downloads: `TransferState` records the completed byte
+ranges of a `.part` file, and the write-behind thread writes segments to their
+offsets while the network keeps reading.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+class _WriteBehind:
+    """
+    Write chunks to absolute offsets of a file on a dedicated thread, so that
+    reading from the network doesn't stall while the disk is busy. At most
+    `depth` chunks are in flight, which bounds the memory held by the queue;
+    once all slots are taken, `write` blocks until the writer catches up. An
+    error raised by the writer is re-raised by the next call to `write` or `close`.
+
+    Note
+    ----
+    Chunks are queued as they are rather than copied into reusable buffers: urllib3
+    allocates a new bytes object for every read anyway, and the extra copy costs
+    more than the allocation it would save.
+    """
+    _depth = 8
+
+    __slots__ = ['file_handler', '_slots', '_queue', '_thread', '_error']
+
+    def __init__(self, file_handler: BinaryIO, depth: int=_depth) -> _WriteBehind:
+        import queue
+
+        self.file_handler = file_handler
+        self._slots = threading.Semaphore(max(depth, 1))
+        self._queue = queue.SimpleQueue()
+        self._error = None
+        self._thread = threading.Thread(target=self.__run, name='anonfile-writer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> _WriteBehind:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __pwrite(self, view: memoryview, offset: int) -> None:
+        fd = self.file_handler.fileno()
+        while view:
+            if hasattr(os, 'pwrite'):
+                written = os.pwrite(fd, view, offset)
+            else:
+                self.file_handler.seek(offset)
+                written = self.file_handler.write(view)
+            (view, offset) = (view[written:], offset + written)
+
+    def __run(self) -> None:
+        while (item := self._queue.get()) is not None:
+            (offset, chunk, callback) = item
+            try:
+                if self._error is None:
+                    with memoryview(chunk) as view:
+                        self.__pwrite(view, offset)
+                    if callback is not None:
+                        callback(offset, len(chunk))
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._slots.release()
+
+    def write(self, offset: int, chunk: bytes, callback: Optional[Callable[[int, int], None]]=None) -> None:
+        """
+        Queue `chunk` to be written at `offset`, and call `callback(offset, length)`
+        on the writer thread once it has been written.
+        """
+        if self._error is not None:
+            raise self._error
+        self._slots.acquire()
+        self._queue.put((offset, chunk, callback))
+
+    def close(self) -> None:
+        """
+        Wait until all queued chunks have been written and stop the writer thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+def _preallocate(file_handler: BinaryIO, size: int) -> None:
+    """
+    Reserve `size` bytes on disk for `file_handler` with `posix_fallocate`, so that
+    a lack of space surfaces before the transfer begins and the file is laid out
+    contiguously. Fall back to a sparse file where that isn't supported.
+    """
+    import errno
+
+    if size > 0 and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(file_handler.fileno(), 0, size)
+            return
+        except OSError as error:
+            if error.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                raise
+    file_handler.truncate(size)
+
+@dataclass
+class TransferState:
+    """
+    Data class that records the progress of a download in a sidecar file next
+    to the `.part` file, so that an interrupted transfer can be resumed later on.
+    Byte ranges are stored as sorted, non-overlapping half-open intervals.
+    """
+    url: str
+    size: int
+    ranges: List[List[int]] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional[TransferState]:
+        """
+        Read a transfer state from `path`. Return `None` if the file doesn't exist
+        or can't be parsed.
+        """
+        try:
+            with open(path, mode='r', encoding='utf-8') as file_handler:
+                state = json.load(file_handler)
+                return cls(state['url'], int(state['size']), [[int(start), int(end)] for (start, end) in state['ranges']])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, path: Path) -> None:
+        """
+        Write the transfer state to `path`. The file is replaced atomically, so a
+        crash never leaves a truncated state behind.
+        """
+        with self._lock:
+            state = {'url': self.url, 'size': self.size, 'ranges': [list(interval) for interval in self.ranges]}
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, mode='w', encoding='utf-8') as file_handler:
+            json.dump(state, file_handler)
+        os.replace(tmp_path, path)
+
+    @property
+    def completed(self) -> int:
+        """
+        Return the number of bytes that have been written so far.
+        """
+        with self._lock:
+            return sum(end - start for (start, end) in self.ranges)
+
+    def add(self, start: int, end: int) -> None:
+        """
+        Mark the byte range `[start, end)` as completed.
+        """
+        with self._lock:
+            merged = []
+            for interval in sorted(self.ranges + [[start, end]]):
+                if merged and interval[0] <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], interval[1])
+                else:
+                    merged.append(list(interval))
+            self.ranges = merged
+
+    def missing(self) -> List[Tuple[int, int]]:
+        """
+        Return all byte ranges that have yet to be downloaded.
+        """
+        with self._lock:
+            gaps, offset = [], 0
+            for (start, end) in self.ranges:
+                if start > offset:
+                    gaps.append((offset, start))
+                offset = max(offset, end)
+            if offset < self.size:
+                gaps.append((offset, self.size))
+            return gaps
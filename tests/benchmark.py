@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Throughput and latency benchmarks against the local stand-in server. Run
+
+```
+python -m tests.benchmark --sizes 1M 16M 64M --concurrency 1 4 16 --output bench.json
+```
+
+from the repository root, and pass `--baseline` with the results of a previous
+release to print the relative change of each metric.
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from src.anonfile import AnonFile, __version__, parse_rate
+from tests.server import AnonFileServer
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    quantiles = statistics.quantiles(samples, n=100, method='inclusive')
+    return {'p50': quantiles[49], 'p90': quantiles[89], 'p99': quantiles[98], 'mean': statistics.fmean(samples)}
+
+def timed(function: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def bench_transfers(anon: AnonFile, server: AnonFileServer, size: int, segments: List[int], workdir: Path, repeat: int) -> dict:
+    source = workdir.joinpath(f"upload_{size}.bin")
+    source.write_bytes(os.urandom(size))
+
+    upload_seconds = [timed(lambda: anon.upload(source)) for _ in range(repeat)]
+    url = server.add(source.name, source.read_bytes())
+    results = {'size': size, 'upload_mbps': size / min(upload_seconds) / 1_048_576, 'download_mbps': {}}
+
+    for count in segments:
+        target = workdir.joinpath(f"segments_{count}")
+        target.mkdir(exist_ok=True)
+        download_seconds = [timed(lambda: anon.download(url, target, segments=count)) for _ in range(repeat)]
+        results['download_mbps'][str(count)] = size / min(download_seconds) / 1_048_576
+
+    return results
+
+def bench_preview(anon: AnonFile, server: AnonFileServer, samples: int) -> dict:
+    url = server.add('preview.txt', b'preview')
+    return percentiles([timed(lambda: anon.preview(url)) * 1000 for _ in range(samples)])
+
+def bench_batch(anon: AnonFile, server: AnonFileServer, concurrency: int, items: int, workdir: Path) -> dict:
+    urls = [server.add(f"batch_{index}.bin", os.urandom(64 * 1024)) for index in range(items)]
+    target = workdir.joinpath(f"batch_{concurrency}")
+    target.mkdir(exist_ok=True)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        preview_seconds = timed(lambda: list(executor.map(anon.preview, urls)))
+        download_seconds = timed(lambda: list(executor.map(lambda url: anon.download(url, target), urls)))
+    return {'previews_per_second': items / preview_seconds, 'downloads_per_second': items / download_seconds}
+
+def bench_startup(samples: int) -> dict:
+    """
+    Measure the wall time of a bare interpreter, of `import anonfile` and of
+    `anonfile --version` in fresh processes, in milliseconds. Bytecode is cached
+    in a temporary directory and warmed up first, as it would be after `pip install`;
+    otherwise `PYTHONDONTWRITEBYTECODE` makes every launch compile the package again.
+    """
+    commands = {
+        'interpreter': "pass",
+        'import': "import anonfile",
+        'version': "import sys; sys.argv[1:] = ['--version']; from anonfile import main; main()",
+    }
+    with tempfile.TemporaryDirectory() as pycache:
+        env = {**os.environ, 'PYTHONPATH': str(Path(__file__).parent.parent.joinpath('src')), 'PYTHONPYCACHEPREFIX': pycache}
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        run = lambda code: subprocess.run([sys.executable, '-c', code], env=env, check=False, stdout=subprocess.DEVNULL)
+        for code in commands.values():
+            run(code)
+        return {name: percentiles([timed(lambda: run(code)) * 1000 for _ in range(samples)]) for (name, code) in commands.items()}
+
+def compare(results: dict, baseline: dict, prefix: str='') -> None:
+    for (key, value) in results.items():
+        if isinstance(value, dict) and isinstance(baseline.get(key), dict):
+            compare(value, baseline[key], f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and isinstance(baseline.get(key), (int, float)) and baseline[key]:
+            print(f"{prefix + key:<48} {baseline[key]:>12.2f} -> {value:>12.2f} ({(value - baseline[key]) / baseline[key]:+.1%})")
+
+def main() -> None:
+    parser = ArgumentParser(prog='benchmark', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=parse_rate, default=[parse_rate('1M'), parse_rate('16M')], help="file sizes to transfer")
+    parser.add_argument('--segments', nargs='+', type=int, default=[1, 4], help="segment counts to download with")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8], help="worker counts for batch operations")
+    parser.add_argument('--items', type=int, default=32, help="number of files per batch")
+    parser.add_argument('--samples', type=int, default=200, help="number of preview latency samples")
+    parser.add_argument('--startup-samples', type=int, default=20, help="number of interpreter launches per startup command")
+    parser.add_argument('--startup-budget', type=float, default=100.0, help="maximum import time in ms on top of the bare interpreter")
+    parser.add_argument('--repeat', type=int, default=3, help="number of runs per transfer, the fastest one counts")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated server latency in seconds")
+    parser.add_argument('--bandwidth', type=parse_rate, default=None, help="simulated bandwidth per connection, e.g. 10M")
+    parser.add_argument('--output', type=Path, default=None, help="write the results to this JSON file")
+    parser.add_argument('--baseline', type=Path, default=None, help="compare against a previous results file")
+    args = parser.parse_args()
+
+    with AnonFileServer(latency=args.latency, bandwidth=args.bandwidth) as server, tempfile.TemporaryDirectory() as workdir:
+        with AnonFile(url=server.endpoint, pool_maxsize=max(args.concurrency + args.segments)) as anon:
+            results = {
+                'meta': {
+                    'version': __version__,
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'latency': args.latency,
+                    'bandwidth': args.bandwidth,
+                },
+                'startup_ms': bench_startup(args.startup_samples),
+                'transfers': [bench_transfers(anon, server, size, args.segments, Path(workdir), args.repeat) for size in args.sizes],
+                'preview_latency_ms': bench_preview(anon, server, args.samples),
+                'batch': {str(concurrency): bench_batch(anon, server, concurrency, args.items, Path(workdir)) for concurrency in args.concurrency},
+            }
+
+    json.dump(results, sys.stdout, indent=4)
+    print()
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=4), encoding='utf-8')
+    if args.baseline is not None:
+        compare(results, json.loads(args.baseline.read_text(encoding='utf-8')))
+
+    startup = results['startup_ms']
+    overhead = startup['import']['p50'] - startup['interpreter']['p50']
+    if overhead > args.startup_budget:
+        sys.exit(f"import anonfile takes {overhead:.1f}ms, which exceeds the budget of {args.startup_budget:.1f}ms")
+
+if __name__ == '__main__':
+    main()
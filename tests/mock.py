@@ -1,4 +1,5 @@
 import json
+import os
 
 from unittest.mock import patch, Mock, MagicMock
 
@@ -23,6 +24,8 @@ def get_html_response(filename):
             html_response.__exit__ = MagicMock()
             html_response.status_code = 200
             html_response.text = html_file.read()
+            html_response.iter_content.side_effect = lambda chunk_size=1, **kwargs: \
+                (html_response.text[i:i + chunk_size] for i in range(0, len(html_response.text), chunk_size))
             return html_response
 
     @staticmethod
@@ -30,7 +33,30 @@ def get_file_response(filename):
         with open(filename, "rb") as file:
             file_response = Mock(spec=Response)
             file_response.__enter__ = MagicMock(return_value=file_response)
-            file_response.__exit__ = MagicMock()
+            file_response.__exit__ = MagicMock(return_value=False)
             file_response.status_code = 200
-            file_response.iter_content.return_value = (chunk for chunk in file.read())
+            content = file.read()
+            file_response.iter_content.side_effect = lambda chunk_size=1, **kwargs: (content[i:i + chunk_size] for i in range(0, len(content), chunk_size))
             return file_response
+
+    @staticmethod
+    def get_head_response(filename):
+        head_response = Mock(spec=Response)
+        head_response.__enter__ = MagicMock(return_value=head_response)
+        head_response.__exit__ = MagicMock(return_value=False)
+        head_response.status_code = 200
+        head_response.headers = {'Accept-Ranges': 'bytes', 'Content-Length': str(os.stat(filename).st_size)}
+        return head_response
+
+    @staticmethod
+    def get_range_response(filename, byte_range):
+        start, end = (int(offset) if offset else None for offset in byte_range.split('=')[1].split('-'))
+        with open(filename, "rb") as file:
+            file.seek(start)
+            content = file.read() if end is None else file.read(end - start + 1)
+            range_response = Mock(spec=Response)
+            range_response.__enter__ = MagicMock(return_value=range_response)
+            range_response.__exit__ = MagicMock(return_value=False)
+            range_response.status_code = 206
+            range_response.iter_content.side_effect = lambda chunk_size=1, **kwargs: (content[i:i + chunk_size] for i in range(0, len(content), chunk_size))
+            return range_response
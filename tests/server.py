@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+"""
+A local stand-in for the anonfiles API, used by the end-to-end tests and the
+benchmark suite. It emulates every endpoint the `AnonFile` client talks to:
+
+- `POST /api/upload` accepts a multipart encoded file (with or without chunked
+  transfer encoding) and stores it in memory
+- `GET /api/v2/file/{id}/info` returns the meta data of a stored file
+- `GET /{id}/{slug}` serves a landing page with a `cdn-` direct download link
+- `GET|HEAD /cdn-1/{id}/{name}` serves the file contents with range support
+
+Each request can be delayed by a fixed `latency`, and file contents are paced
+at `bandwidth` bytes per second and connection. Error responses can be queued
+with `fail` to exercise the retry logic of the client.
+"""
+
+import json
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+
+class AnonFileServer:
+    """
+    Run the stand-in server on a background thread.
+
+    Usage
+    -----
+
+    ```
+    with AnonFileServer(latency=0.01) as server:
+        anon = AnonFile(url=server.endpoint)
+    ```
+    """
+    def __init__(self, host: str='127.0.0.1', port: int=0, latency: float=0, bandwidth: Optional[float]=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.files: Dict[str, Tuple[str, bytes]] = {}
+        self.requests = 0
+        self.connections = 0
+        self.failures: List[Tuple[int, dict]] = []
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), type('Handler', (_Handler,), {'server_state': self}))
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.url}/api/"
+
+    def start(self) -> 'AnonFileServer':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> 'AnonFileServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def add(self, name: str, content: bytes) -> str:
+        """
+        Store `content` under `name` and return the URL of its landing page.
+        """
+        file_id = secrets.token_hex(5)
+        with self._lock:
+            self.files[file_id] = (name, content)
+        return self.info(file_id)['data']['file']['url']['full']
+
+    def fail(self, status: int, count: int=1, headers: Optional[dict]=None) -> None:
+        """
+        Answer the next `count` requests with an empty `status` response.
+        """
+        with self._lock:
+            self.failures.extend([(status, headers or {})] * count)
+
+    def info(self, file_id: str) -> dict:
+        name, content = self.files[file_id]
+        return {
+            'status': True,
+            'data': {
+                'file': {
+                    'url': {
+                        'short': f"{self.url}/{file_id}",
+                        'full': f"{self.url}/{file_id}/{name.replace('.', '_')}"
+                    },
+                    'metadata': {
+                        'size': {
+                            'bytes': len(content),
+                            'readable': f"{len(content) / 1_000_000:.2f} MB"
+                        },
+                        'name': name.replace('.', '_'),
+                        'id': file_id
+                    }
+                }
+            }
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server_state: AnonFileServer = None
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server_state._lock:
+            self.server_state.connections += 1
+
+    def __delay(self) -> bool:
+        """
+        Count and delay the request, and answer it with a queued error response if
+        there is one. Return whether the request was answered.
+        """
+        with self.server_state._lock:
+            self.server_state.requests += 1
+            failure = self.server_state.failures.pop(0) if self.server_state.failures else None
+        if self.server_state.latency:
+            time.sleep(self.server_state.latency)
+        if failure is not None:
+            self.__send(failure[0], b'', 'text/plain', failure[1])
+        return failure is not None
+
+    def __send(self, status: int, body: bytes, content_type: str, headers: Optional[dict]=None, head: bool=False) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for (key, value) in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not head:
+            self.__write(body, paced=content_type == 'application/octet-stream')
+
+    def __write(self, body: bytes, paced: bool) -> None:
+        bandwidth, chunk_size = self.server_state.bandwidth, 64 * 1024
+        start = time.monotonic()
+        for offset in range(0, len(body), chunk_size):
+            self.wfile.write(body[offset:offset + chunk_size])
+            if paced and bandwidth:
+                ahead = (offset + chunk_size) / bandwidth - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    def __read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while (size := int(self.rfile.readline().split(b';')[0].strip(), 16)) > 0:
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            self.rfile.readline()
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def __not_found(self) -> None:
+        body = json.dumps({'status': False, 'error': {'message': 'The file you are looking for does not exist.', 'type': 'ERROR_FILE_NOT_FOUND', 'code': 404}})
+        self.__send(404, body.encode(), 'application/json')
+
+    def do_POST(self) -> None:
+        body = self.__read_body()
+        if self.__delay():
+            return
+        if self.path.split('?')[0] != '/api/upload':
+            return self.__not_found()
+        boundary = re.search(r'boundary=(\S+)', self.headers['Content-Type']).group(1).encode()
+        part = body.split(b'--' + boundary)[1]
+        headers, content = part.split(b'\r\n\r\n', 1)
+        name = re.search(rb'filename="(.*?)"', headers).group(1).decode()
+        url = self.server_state.add(name, content[:-2])
+        info = self.server_state.info(url.split('/')[3])
+        self.__send(200, json.dumps(info).encode(), 'application/json')
+
+    def do_HEAD(self) -> None:
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool=False) -> None:
+        if self.__delay():
+            return
+        segments = self.path.strip('/').split('/')
+        files = self.server_state.files
+
+        if self.path.startswith('/api/v2/file/') and segments[3] in files:
+            return self.__send(200, json.dumps(self.server_state.info(segments[3])).encode(), 'application/json', head=head)
+
+        if segments[0] == 'cdn-1' and len(segments) == 3 and segments[1] in files:
+            content = files[segments[1]][1]
+            match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if match is None:
+                return self.__send(200, content, 'application/octet-stream', {'Accept-Ranges': 'bytes'}, head=head)
+            start, end = int(match.group(1)), int(match.group(2) or len(content) - 1)
+            headers = {'Accept-Ranges': 'bytes', 'Content-Range': f"bytes {start}-{end}/{len(content)}"}
+            return self.__send(206, content[start:end + 1], 'application/octet-stream', headers, head=head)
+
+        if len(segments) == 2 and segments[0] in files:
+            name = files[segments[0]][0]
+            page = (
+                "<!DOCTYPE html><html><head><title>anonfiles</title></head><body>"
+                + "<p>padding</p>" * 256
+                + f"<a id=\"download-url\" class=\"btn\" href=\"{self.server_state.url}/cdn-1/{segments[0]}/{name}\">Download</a>"
+                + "</body></html>"
+            )
+            return self.__send(200, page.encode(), 'text/html; charset=utf-8', head=head)
+
+        self.__not_found()
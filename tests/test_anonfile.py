@@ -1,14 +1,38 @@
 #!/usr/bin/env python3
 
+import asyncio
+import errno
+import gzip
 import hashlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+import httpx
+import requests
 from faker import Faker
 
-from src.anonfile import AnonFile
+from src.anonfile import AnonFile, ChecksumError, DDLNotFoundError, EndpointPool, JSONLinesSink, MetadataCache, ParseResponse, PreviewError, PrometheusSink, ProgressGroup, RateLimiter, RequestMetrics, TransferState, UploadCache, compression_suffixes, extract_ddl
+from src.anonfile.aio import AsyncAnonFile
+from src.anonfile.log import TransferLog, TransferLogHandler
+from src.anonfile.retry import CircuitBreaker, CircuitOpenError, RetryBudget, RetryPolicy
+from src.anonfile.serve import Journal, SpoolDaemon
 from tests.mock import MockData
+from tests.server import AnonFileServer
 
 TOKEN = None
 
@@ -49,7 +73,7 @@ def setUpClass(cls):
         cls.test_med_file = "https://anonfiles.com/P0mev3tfz7/topsecret_mp4"
         cls.garbage = []
 
-    @patch('anonfile.requests.Session.post')
+    @patch('requests.Session.post')
     def test_upload(self, mocked_session_post):
         """ Tests a mocked upload """
 
@@ -83,7 +107,45 @@ def test_upload(self, mocked_session_post):
         self.assertTrue(upload.status, msg="Expected 200 HTTP Error Code")
         self.assertTrue(all([upload.url.scheme, upload.url.netloc, upload.url.path]), msg="Invalid URL.")
 
-    @patch('anonfile.requests.Session.get')
+    @patch('requests.Session.post')
+    def test_upload_stream(self, mocked_session_post):
+        """ Tests a mocked upload from an iterator of unknown size """
+
+        # Arrange
+        response_content = {
+            'data': {
+                'file': {
+                    'url': {
+                        'full': 'https://anonfiles.com/A66bG9t0z1/topsecret_mp4',
+                        'short': 'https://anonfiles.com/A66bG9t0z1'
+                    },
+                    'metadata': {
+                        'id': 'A66bG9t0z1',
+                        'size': {
+                            'readable': '3.37 MB',
+                            'bytes': 3537832
+                        },
+                        'name': 'topsecret.mp4'
+                    }
+                }
+            },
+            'status': True
+        }
+        bodies = []
+        json_response = MockData.get_json_response(response_content)
+        mocked_session_post.side_effect = lambda url, data, **kwargs: bodies.append(b''.join(data)) or json_response
+        chunks = (chunk for chunk in [b'top', b'secret'])
+
+        # Act
+        upload = self.anon.upload(chunks, name='topsecret.txt')
+
+        # Assert
+        self.assertTrue(upload.status, msg="Expected 200 HTTP Error Code")
+        boundary = mocked_session_post.call_args.kwargs['headers']['Content-Type'].split('boundary=')[1]
+        self.assertTrue(bodies[0].startswith(f"--{boundary}\r\n".encode()), msg="Invalid request body.")
+        self.assertTrue(bodies[0].endswith(b'\r\n\r\ntopsecret\r\n--' + boundary.encode() + b'--\r\n'), msg="Invalid request body.")
+
+    @patch('requests.Session.get')
     def test_preview(self, mocked_session_get):
         """ Tests mocked preview API request """
 
@@ -121,7 +183,102 @@ def test_preview(self, mocked_session_get):
         self.assertEqual(self.test_file.name.split('_')[-1], preview.file_path.name, msg="Error in name property.")
         self.assertEqual(3537832, preview.size, msg="Error in size property.")
 
-    @patch('anonfile.requests.Session.get')
+    @patch('requests.Session.get')
+    def test_compact_records(self, mocked_session_get):
+        """ Tests that records decode the response once and serialize without it """
+
+        # Arrange
+        response_content = {
+            'status': True,
+            'data': {
+                'file': {
+                    'url': {
+                        'short': 'https://anonfiles.com/P0mev3tfz7',
+                        'full': 'https://anonfiles.com/P0mev3tfz7/topsecret_mp4'
+                    },
+                    'metadata': {
+                        'size': {
+                            'bytes': 3537832,
+                            'readable': '3.37 MB'
+                        },
+                        'name': 'topsecret_mp4',
+                        'id': 'P0mev3tfz7'
+                    }
+                }
+            }
+        }
+        json_response = MockData.get_json_response(response_content)
+        html_response = MockData.get_html_response("tests/preview.html")
+        mocked_session_get.side_effect = [json_response, html_response]
+        buffer = io.StringIO()
+
+        # Act
+        preview = self.anon.preview(self.test_med_file).compact()
+        properties = (preview.status, preview.url, preview.id, preview.size, preview.size_readable)
+        count = ParseResponse.dump([preview], buffer)
+
+        # Assert
+        self.assertEqual(1, json_response.json.call_count, msg="Expected the JSON body to be decoded once.")
+        self.assertIsNone(preview.response, msg="Expected the response to be dropped.")
+        self.assertEqual(3537832, properties[3], msg="Error in size property.")
+        self.assertEqual(1, count, msg="Expected one record to be written.")
+        self.assertEqual(preview.to_dict(), json.loads(buffer.getvalue()), msg="Error in serialized record.")
+
+    def test_extract_ddl(self):
+        """ Tests link extraction from a landing page streamed in small chunks """
+
+        # Arrange
+        page = Path("tests/preview.html").read_text(encoding='utf-8')
+        chunks = (page[i:i + 64] for i in range(0, len(page), 64))
+
+        # Act
+        ddl = extract_ddl(chunks)
+
+        # Assert
+        self.assertEqual("https://cdn-142.anonfiles.com/P0mev3tfz7/3150be5d-1684972716/topsecret.mp4", ddl.geturl(), msg="Error in DDL.")
+        self.assertRaises(DDLNotFoundError, extract_ddl, "<html><a href='https://anonfiles.com'>Home</a></html>")
+
+    @patch('requests.Session.get')
+    def test_preview_cache(self, mocked_session_get):
+        """ Tests that repeated previews are served from the meta data cache """
+
+        # Arrange
+        response_content = {
+            'status': True,
+            'data': {
+                'file': {
+                    'url': {
+                        'short': 'https://anonfiles.com/P0mev3tfz7',
+                        'full': 'https://anonfiles.com/P0mev3tfz7/topsecret_mp4'
+                    },
+                    'metadata': {
+                        'size': {
+                            'bytes': 3537832,
+                            'readable': '3.37 MB'
+                        },
+                        'name': 'topsecret_mp4',
+                        'id': 'P0mev3tfz7'
+                    }
+                }
+            }
+        }
+        json_response = MockData.get_json_response(response_content)
+        html_response = MockData.get_html_response("tests/preview.html")
+        mocked_session_get.side_effect = [json_response, html_response]
+        anon = AnonFile(cache=MetadataCache(ttl=60, maxsize=1))
+
+        # Act
+        preview = anon.preview(self.test_med_file)
+        cached_preview = anon.preview(self.test_med_file)
+
+        # Assert
+        self.assertEqual(2, mocked_session_get.call_count, msg="Expected the second preview to be served from the cache.")
+        self.assertEqual(preview.ddl, cached_preview.ddl, msg="Error in DDL property.")
+        self.assertEqual(preview.size, cached_preview.size, msg="Error in size property.")
+        anon.cache.invalidate(preview.id)
+        self.assertEqual(0, len(anon.cache), msg="Expected an empty cache after invalidation.")
+
+    @patch('requests.Session.get')
     def test_download(self, mocked_session_get):
         """ Tests mocked file download with a simulated stream """
 
@@ -158,7 +315,7 @@ def test_download(self, mocked_session_get):
         self.assertEqual(download.file_path.name, "topsecret.mp4", msg="Different file in download path detected.")
         self.garbage.append(download.file_path)
 
-    @patch('anonfile.requests.Session.get')
+    @patch('requests.Session.get')
     def test_multipart_encoded_files(self, mocked_session_get):
         """ Tests download data integrity utilizing mocked file download """
 
@@ -191,10 +348,884 @@ def test_multipart_encoded_files(self, mocked_session_get):
         download = self.anon.download(self.test_med_file, progressbar=True, enable_logging=True)
 
         # Assert
-        self.assertEqual("d41d8cd98f00b204e9800998ecf8427e", md5_checksum(download.file_path), msg="MD5 hash is corrupted.")
+        self.assertEqual(md5_checksum(self.test_file), md5_checksum(download.file_path), msg="MD5 hash is corrupted.")
+        self.garbage.append(download.file_path)
+
+    @patch('requests.Session.get')
+    def test_download_digest(self, mocked_session_get):
+        """ Tests inline checksums and the removal of corrupted downloads """
+
+        # Arrange
+        raw_response = {
+            'status': True,
+            'data': {
+                'file': {
+                    'url': {
+                        'short': 'https://anonfiles.com/P0mev3tfz7',
+                        'full': 'https://anonfiles.com/P0mev3tfz7/topsecret_mp4'
+                    },
+                    'metadata': {
+                        'size': {
+                            'bytes': 3537832,
+                            'readable': '3.37 MB'
+                        },
+                        'name': 'topsecret_mp4',
+                        'id': 'P0mev3tfz7'
+                    }
+                }
+            }
+        }
+        mocked_session_get.side_effect = lambda *args, **kwargs: next(responses)
+        responses = iter([
+            MockData.get_json_response(raw_response),
+            MockData.get_html_response("tests/preview.html"),
+            MockData.get_file_response("tests/original_topsecret.mp4"),
+            MockData.get_json_response(raw_response),
+            MockData.get_html_response("tests/preview.html"),
+            MockData.get_file_response("tests/original_topsecret.mp4"),
+        ])
+
+        # Act
+        download = self.anon.download(self.test_med_file, digest='md5')
+        self.garbage.append(download.file_path)
+        download.file_path.unlink()
+
+        # Assert
+        self.assertEqual(f"md5:{md5_checksum(self.test_file)}", download.digest, msg="Error in digest.")
+        with self.assertRaises(ChecksumError):
+            self.anon.download(self.test_med_file, expected_digest="sha256:0000")
+        self.assertFalse(download.file_path.exists(), msg="Expected the corrupted download to be removed.")
+        self.assertFalse(Path("topsecret.mp4.part").exists(), msg="Expected the partial file to be removed.")
+
+    @patch('requests.Session.head')
+    @patch('requests.Session.get')
+    def test_segmented_download(self, mocked_session_get, mocked_session_head):
+        """ Tests data integrity of a mocked download split into byte ranges """
+
+        # Arrange
+        raw_response = {
+            'status': True,
+            'data': {
+                'file': {
+                    'url': {
+                        'short': 'https://anonfiles.com/P0mev3tfz7',
+                        'full': 'https://anonfiles.com/P0mev3tfz7/topsecret_mp4'
+                    },
+                    'metadata': {
+                        'size': {
+                            'bytes': 3537832,
+                            'readable': '3.37 MB'
+                        },
+                        'name': 'topsecret_mp4',
+                        'id': 'P0mev3tfz7'
+                    }
+                }
+            }
+        }
+        json_response = MockData.get_json_response(raw_response)
+        html_response = MockData.get_html_response("tests/preview.html")
+        mocked_session_head.return_value = MockData.get_head_response(self.test_file)
+        responses = iter([json_response, html_response])
+        mocked_session_get.side_effect = lambda url, headers=None, **kwargs: \
+            MockData.get_range_response(self.test_file, headers['Range']) if headers else next(responses)
+
+        # Act
+        download = self.anon.download(self.test_med_file, progressbar=True, segments=4, digest='md5')
+
+        # Assert
+        self.assertEqual(4, len([call for call in mocked_session_get.call_args_list if 'headers' in call.kwargs]), msg="Expected one request per segment.")
+        self.assertEqual(f"md5:{md5_checksum(self.test_file)}", download.digest, msg="Error in digest.")
+        self.assertEqual(md5_checksum(self.test_file), md5_checksum(download.file_path), msg="MD5 hash is corrupted.")
+        self.garbage.append(download.file_path)
+
+    @patch('requests.Session.head')
+    @patch('requests.Session.get')
+    def test_resume_download(self, mocked_session_get, mocked_session_head):
+        """ Tests that an interrupted download continues from its .part file """
+
+        # Arrange
+        raw_response = {
+            'status': True,
+            'data': {
+                'file': {
+                    'url': {
+                        'short': 'https://anonfiles.com/P0mev3tfz7',
+                        'full': 'https://anonfiles.com/P0mev3tfz7/topsecret_mp4'
+                    },
+                    'metadata': {
+                        'size': {
+                            'bytes': 3537832,
+                            'readable': '3.37 MB'
+                        },
+                        'name': 'topsecret_mp4',
+                        'id': 'P0mev3tfz7'
+                    }
+                }
+            }
+        }
+        offset = 1_000_000
+        with open(self.test_file, mode='rb') as file_handler:
+            Path("topsecret.mp4.part").write_bytes(file_handler.read(offset))
+        TransferState(self.test_med_file, 3537832, [[0, offset]]).save(Path("topsecret.mp4.part.json"))
+        json_response = MockData.get_json_response(raw_response)
+        html_response = MockData.get_html_response("tests/preview.html")
+        mocked_session_head.return_value = MockData.get_head_response(self.test_file)
+        responses = iter([json_response, html_response])
+        mocked_session_get.side_effect = lambda url, headers=None, **kwargs: \
+            MockData.get_range_response(self.test_file, headers['Range']) if headers else next(responses)
+
+        # Act
+        download = self.anon.download(self.test_med_file, expected_digest=f"md5:{md5_checksum(self.test_file)}")
+
+        # Assert
+        self.assertEqual(f"bytes={offset}-", mocked_session_get.call_args.kwargs['headers']['Range'], msg="Expected an open-ended range request.")
+        self.assertEqual(md5_checksum(self.test_file), md5_checksum(download.file_path), msg="MD5 hash is corrupted.")
+        self.assertFalse(Path("topsecret.mp4.part.json").exists(), msg="Expected the transfer state to be removed.")
         self.garbage.append(download.file_path)
 
+    def test_prometheus_precision(self):
+        # Arrange
+        sink = PrometheusSink()
+        metrics = RequestMetrics(operation='download', method='GET', url='https://anonfiles.com', status=200, retries=0,
+                                 bytes_sent=0, bytes_received=123456789, ttfb=0.1, duration=1234567.125)
+
+        # Act
+        sink(metrics)
+        exposition = sink.expose()
+
+        # Assert
+        self.assertIn('anonfile_transferred_bytes_total{operation="download",direction="received"} 123456789', exposition, msg="Byte total was rounded.")
+        self.assertIn('anonfile_request_duration_seconds_sum{operation="download"} 1234567.125', exposition, msg="Histogram sum was rounded.")
+
+    def test_rate_limiter(self):
+        """ Tests that concurrent consumers share the bandwidth of one token bucket """
+
+        # Arrange
+        limiter = RateLimiter(rate=400_000, burst=20_000)
+        consume = lambda _: [limiter.consume(10_000) for _ in range(20)]
+
+        # Act
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(consume, range(4)))
+        elapsed = time.monotonic() - start
+
+        # Assert
+        expected = (4 * 20 * 10_000 - 20_000) / 400_000
+        self.assertAlmostEqual(expected, elapsed, delta=0.1 * expected, msg="Throughput exceeds the rate limit.")
+
+    def test_session_reuse(self):
+        """ Tests that consecutive requests share one pooled session """
+
+        # Arrange
+        anon = init_anon()
+
+        # Act
+        with anon:
+            session = anon.session
+
+            # Assert
+            self.assertIs(session, anon.session, msg="Expected the session to be cached.")
+
+        self.assertIsNot(session, anon.session, msg="Expected a new session after closing the client.")
+        anon.close()
+
+    def test_async_download(self):
+        """ Tests a mocked download with the asyncio client """
+
+        # Arrange
+        raw_response = {
+            'status': True,
+            'data': {
+                'file': {
+                    'url': {
+                        'short': 'https://anonfiles.com/P0mev3tfz7',
+                        'full': 'https://anonfiles.com/P0mev3tfz7/topsecret_mp4'
+                    },
+                    'metadata': {
+                        'size': {
+                            'bytes': 3537832,
+                            'readable': '3.37 MB'
+                        },
+                        'name': 'topsecret_mp4',
+                        'id': 'P0mev3tfz7'
+                    }
+                }
+            }
+        }
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path.endswith('/info'):
+                return httpx.Response(200, json=raw_response)
+            if 'cdn-' in request.url.host:
+                return httpx.Response(200, content=self.test_file.read_bytes())
+            return httpx.Response(200, text=Path("tests/preview.html").read_text(encoding='utf-8'))
+
+        async def download():
+            async with AsyncAnonFile(concurrency=2) as anon:
+                anon._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+                return [result async for result in anon.as_completed([anon.download(self.test_med_file)])]
+
+        # Act
+        (result,) = asyncio.run(download())
+
+        # Assert
+        self.assertEqual("P0mev3tfz7", result.id, msg="Error in ID property.")
+        self.assertEqual(md5_checksum(self.test_file), md5_checksum(result.file_path), msg="MD5 hash is corrupted.")
+        self.garbage.append(result.file_path)
+
     @classmethod
     def tearDownClass(cls):
         for file in cls.garbage:
             remove_file(file)
+
+
+class TestLocalServer(unittest.TestCase):
+    """End-to-end test cases against the local stand-in server."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = AnonFileServer().start()
+        cls.anon = AnonFile(url=cls.server.endpoint)
+        cls.test_file = Path("tests/original_topsecret.mp4")
+        cls.garbage = []
+
+    def test_round_trip(self):
+        # Arrange
+        upload = self.anon.upload(self.test_file, digest='md5')
+
+        # Act
+        preview = self.anon.preview(upload.url.geturl())
+        download = self.anon.download(upload.url.geturl(), Path.cwd(), segments=4, digest='md5')
+        self.garbage.append(download.file_path)
+
+        # Assert
+        self.assertEqual(upload.id, preview.id, msg="Error in ID property.")
+        self.assertEqual(self.test_file.stat().st_size, preview.size, msg="Error in size property.")
+        self.assertEqual(upload.digest, download.digest, msg="Checksums don't match.")
+        self.assertEqual(md5_checksum(self.test_file), md5_checksum(download.file_path), msg="MD5 hash is corrupted.")
+
+    def test_upload_timeout(self):
+        with AnonFileServer(latency=1) as server:
+            # Arrange
+            anon = AnonFile(url=server.endpoint, upload_timeout=0.2, total=0)
+            patient = AnonFile(url=server.endpoint, upload_timeout=5, total=0)
+
+            # Act
+            start = time.perf_counter()
+            with self.assertRaises(requests.ReadTimeout, msg="Stalled upload didn't time out."):
+                anon.upload(io.BytesIO(b"stalled"), name="stalled.txt")
+            elapsed = time.perf_counter() - start
+            upload = patient.upload(io.BytesIO(b"patient"), name="patient.txt")
+            anon.close()
+            patient.close()
+
+        # Assert
+        self.assertLess(elapsed, 1, msg="Upload waited for the response.")
+        self.assertTrue(upload.status, msg="Slow server response wasn't awaited.")
+
+    def test_chunked_upload(self):
+        # Arrange
+        chunks = (bytes([index]) * 1000 for index in range(64))
+
+        # Act
+        upload = self.anon.upload(chunks, name="chunks.bin")
+
+        # Assert
+        self.assertEqual(64000, upload.size, msg="Error in size property.")
+        self.assertEqual(bytes(range(64)), self.server.files[upload.id][1][::1000], msg="Upload is corrupted.")
+
+    def test_preview_many(self):
+        # Arrange
+        urls = [self.server.add(f"preview{index}.txt", b"preview") for index in range(20)]
+        missing = f"{self.server.url}/0000000000/missing_txt"
+        anon = AnonFile(url=self.server.endpoint, pool_maxsize=4)
+        (requests_before, connections_before) = (self.server.requests, self.server.connections)
+
+        # Act
+        previews = list(anon.preview_many(urls + [missing], concurrency=8, return_exceptions=True))
+        (requests_used, connections_used) = (self.server.requests - requests_before, self.server.connections - connections_before)
+        ordered = list(anon.preview_many(reversed(urls[:5]), resolve_ddl=True, ordered=True))
+
+        # Assert
+        self.assertEqual(21, requests_used, msg="Landing pages were fetched.")
+        self.assertLessEqual(connections_used, 4, msg="Connections weren't kept alive.")
+        self.assertEqual([missing], [preview.url for preview in previews if isinstance(preview, PreviewError)], msg="Error in failed lookups.")
+        self.assertEqual(sorted(url.split('/')[3] for url in urls), sorted(preview.id for preview in previews if isinstance(preview, ParseResponse)), msg="Error in ID property.")
+        self.assertTrue(all(preview.ddl is None for preview in previews if isinstance(preview, ParseResponse)), msg="Direct download link was resolved.")
+        self.assertEqual([url.split('/')[3] for url in reversed(urls[:5])], [preview.id for preview in ordered], msg="Results are out of order.")
+        self.assertTrue(all(preview.ddl is not None for preview in ordered), msg="Direct download link wasn't resolved.")
+        with self.assertRaises(PreviewError, msg="Failed lookup wasn't raised."):
+            list(anon.preview_many([missing]))
+
+    def test_async_proxy(self):
+        # Arrange
+        requests_before = self.server.requests
+
+        async def fetch():
+            # the stand-in server answers the proxied request itself, with a 404 for the unknown path
+            async with AsyncAnonFile(proxies={'http': self.server.url, 'https': self.server.url}) as anon:
+                return await anon.client.get("http://anonfile.invalid/api/v2/file/0000000000/info")
+
+        # Act
+        response = asyncio.run(fetch())
+
+        # Assert
+        self.assertEqual(404, response.status_code, msg="Request bypassed the proxy.")
+        self.assertEqual(requests_before + 1, self.server.requests, msg="Error in request count.")
+
+    def test_async_progress_listeners(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            size = self.test_file.stat().st_size
+            url = self.server.add("video.mp4", self.test_file.read_bytes())
+            events = []
+
+            async def transfer(listeners):
+                async with AsyncAnonFile(url=self.server.endpoint, listeners=listeners, progress_rate=0) as anon:
+                    return (await anon.download(url, directory), await anon.upload(self.test_file))
+
+            # Act
+            with patch('src.anonfile.aio.Progress') as unobserved:
+                asyncio.run(transfer(None))
+            (download, _) = asyncio.run(transfer([events.append]))
+
+            # Assert
+            (download_events, upload_events) = ([event for event in events if event.operation == operation] for operation in ('download', 'upload'))
+            self.assertEqual(0, unobserved.call_count, msg="Progress was tracked without listeners.")
+            self.assertEqual((size, size, True), (download_events[-1].completed, download_events[-1].total, download_events[-1].finished), msg="Error in download progress.")
+            self.assertEqual((size, size, True), (upload_events[-1].completed, upload_events[-1].total, upload_events[-1].finished), msg="Error in upload progress.")
+            self.assertEqual(md5_checksum(self.test_file), md5_checksum(download.file_path), msg="MD5 hash is corrupted.")
+
+    def test_write_behind(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            url = self.server.add("video.mp4", self.test_file.read_bytes())
+            (pwrite, slow_pwrite) = (os.pwrite, lambda fd, data, offset: time.sleep(0.001) or pwrite(fd, data, offset))
+            failing_pwrite = MagicMock(side_effect=OSError(errno.ENOSPC, "No space left on device"))
+
+            # Act
+            with patch('os.pwrite', side_effect=slow_pwrite):
+                download = self.anon.download(url, directory, segments=4, preallocate=True, digest='md5')
+            with patch('os.pwrite', failing_pwrite), self.assertRaises(OSError, msg="Write error was swallowed."):
+                self.anon.download(url, directory, filename="full.mp4")
+
+            # Assert
+            self.assertEqual(md5_checksum(self.test_file), md5_checksum(download.file_path), msg="MD5 hash is corrupted.")
+            self.assertEqual(md5_checksum(self.test_file), download.digest.split(':')[1], msg="Error in digest property.")
+            self.assertEqual(0, TransferState.load(Path(directory).joinpath("full.mp4.part.json")).completed, msg="Unwritten data was marked as completed.")
+
+    def test_download_to_output(self):
+        # Arrange
+        content = self.test_file.read_bytes()
+        compressed = gzip.compress(content)
+        url = self.server.add("video.mp4.gz", compressed)
+        (buffer, chunks) = (io.BytesIO(), [])
+        env = {**os.environ, 'PYTHONPATH': str(Path.cwd().joinpath('src'))}
+        command = [sys.executable, '-c', "from anonfile import main; main()", '--api', self.server.endpoint, '--no-logging', 'download', '-u', url, '-o', '-', '--decompress']
+
+        # Act
+        self.anon.download(url, output=buffer, decompress=True)
+        self.anon.download(url, output=chunks.append)
+        process = subprocess.run(command, env=env, capture_output=True, check=False)
+
+        # Assert
+        self.assertEqual(content, buffer.getvalue(), msg="Error in file-like output.")
+        self.assertEqual(compressed, b''.join(chunks), msg="Error in callback output.")
+        self.assertEqual(0, process.returncode, msg=process.stderr.decode())
+        self.assertEqual(content, process.stdout, msg="Error in stdout output.")
+
+    def test_expired_link(self):
+        # Arrange
+        content = b"expired" * 1024
+        url = self.server.add("expired.txt", content)
+        (first, second) = (io.BytesIO(), io.BytesIO())
+
+        # Act
+        with AnonFile(url=self.server.endpoint, cache=MetadataCache(ttl=60, maxsize=8)) as anon:
+            anon.preview(url)
+            self.server.fail(404)
+            with self.assertRaises(requests.HTTPError, msg="Expired link wasn't raised."):
+                anon.download(url, output=first)
+            requests_before = self.server.requests
+            anon.download(url, output=second)
+
+        # Assert
+        self.assertEqual(content, second.getvalue(), msg="Error in retried download.")
+        self.assertEqual(3, self.server.requests - requests_before, msg="Expected the link to be resolved again.")
+
+    def test_cli_endpoints(self):
+        with tempfile.TemporaryDirectory() as home:
+            # Arrange
+            with socket.socket() as closed:
+                closed.bind(('127.0.0.1', 0))
+                dead_endpoint = f"http://127.0.0.1:{closed.getsockname()[1]}/api/"
+            url = self.server.add("cli.txt", b"cli")
+            # keep the endpoint health out of the real config directory
+            env = {**os.environ, 'PYTHONPATH': str(Path.cwd().joinpath('src')), 'HOME': home}
+            command = [sys.executable, '-c', "from anonfile import main; main()", '--no-logging', '--no-verbose']
+
+            # Act
+            single = subprocess.run(command + ['--api', self.server.endpoint, 'preview', '-u', url], env=env, capture_output=True, check=False)
+            failover = subprocess.run(command + ['--api', dead_endpoint, '--api', self.server.endpoint, 'preview', '-u', url], env=env, capture_output=True, check=False)
+
+            # Assert
+            self.assertEqual(0, single.returncode, msg=single.stderr.decode())
+            self.assertEqual(0, failover.returncode, msg=failover.stderr.decode())
+            self.assertIn(url, single.stdout.decode(), msg="Error in preview output.")
+            self.assertEqual(single.stdout, failover.stdout, msg="Endpoints didn't fail over.")
+
+    def test_cli_batch_order(self):
+        with tempfile.TemporaryDirectory() as home, tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            urls = [self.server.add(f"batch_{index}.txt", bytes([index]) * 1024) for index in range(6)]
+            missing = f"{self.server.url}/0000000000/missing_txt"
+            env = {**os.environ, 'PYTHONPATH': str(Path.cwd().joinpath('src')), 'HOME': home}
+            command = [sys.executable, '-c', "from anonfile import main; main()", '--api', self.server.endpoint, '--no-logging', '--no-verbose',
+                       'download', '-u', *urls[:3], missing, *urls[3:], '-p', directory, '-j', '4', '--on-conflict', 'overwrite']
+            expected = [f"File: {Path(directory).joinpath(f'batch_{index}.txt')}" for index in range(6)]
+
+            # Act
+            ordered = subprocess.run(command, env=env, capture_output=True, check=False)
+            unordered = subprocess.run(command + ['--unordered'], env=env, capture_output=True, check=False)
+
+            # Assert
+            for process in (ordered, unordered):
+                self.assertEqual(1, process.returncode, msg=process.stderr.decode())
+                self.assertIn(f"error: {missing!r}", process.stderr.decode(), msg="Failing item wasn't reported.")
+            self.assertEqual(expected, ordered.stdout.decode().splitlines(), msg="Error in ordered output.")
+            self.assertCountEqual(expected, unordered.stdout.decode().splitlines(), msg="Error in unordered output.")
+            self.assertEqual(sorted(f"batch_{index}.txt" for index in range(6)), sorted(os.listdir(directory)), msg="Failing item aborted the batch.")
+
+    def test_cli_on_conflict(self):
+        # Arrange
+        url = self.server.add("conflict.txt", b"conflict" * 1024)
+        other = self.server.add("other.txt", b"other")
+        missing = f"{self.server.url}/0000000000/missing_txt"
+        expected = {
+            'rename': ['conflict (1).txt', 'conflict.txt', 'other.txt'],
+            'skip': ['conflict.txt', 'other.txt'],
+            'overwrite': ['conflict.txt', 'other.txt'],
+            'ask': ['conflict.txt', 'other.txt'],
+        }
+
+        for (policy, files) in expected.items():
+            with self.subTest(policy=policy), tempfile.TemporaryDirectory() as home, tempfile.TemporaryDirectory() as directory:
+                env = {**os.environ, 'PYTHONPATH': str(Path.cwd().joinpath('src')), 'HOME': home}
+                command = [sys.executable, '-c', "from anonfile import main; main()", '--api', self.server.endpoint, '--no-logging', '--no-verbose',
+                           'download', '-u', url, missing, url, other, '-p', directory, '-j', '2', '--on-conflict', policy]
+
+                # Act
+                process = subprocess.run(command, env=env, input=b"n\n", capture_output=True, check=False)
+
+                # Assert
+                self.assertEqual(1, process.returncode, msg=process.stderr.decode())
+                self.assertEqual(files, sorted(os.listdir(directory)), msg=f"Error in {policy!r} policy.")
+                self.assertEqual(b"conflict" * 1024, Path(directory).joinpath('conflict.txt').read_bytes(), msg="Duplicates shared a partial file.")
+
+    def test_cli_preview_no_ddl(self):
+        with tempfile.TemporaryDirectory() as home:
+            # Arrange
+            url = self.server.add("slug.txt", b"slug")
+            file_id = url.split('/')[3]
+            env = {**os.environ, 'PYTHONPATH': str(Path.cwd().joinpath('src')), 'HOME': home}
+            command = [sys.executable, '-c', "from anonfile import main; main()", '--api', self.server.endpoint, '--no-logging']
+
+            # Act
+            compact = subprocess.run(command + ['--no-verbose', 'preview', '--no-ddl', '-u', url], env=env, capture_output=True, check=False)
+            verbose = subprocess.run(command + ['preview', '--no-ddl', '-u', url], env=env, capture_output=True, check=False)
+            resolved = subprocess.run(command + ['preview', '-u', url], env=env, capture_output=True, check=False)
+
+            # Assert
+            self.assertEqual(0, compact.returncode, msg=compact.stderr.decode())
+            self.assertEqual(f"online,,{url},,{file_id},0.00 MB", compact.stdout.decode().strip(), msg="Error in compact output.")
+            self.assertEqual('', json.loads(verbose.stdout)['File Path'], msg="Slug was shown as the file name.")
+            self.assertEqual('slug.txt', json.loads(resolved.stdout)['File Path'], msg="Error in resolved file name.")
+
+    def test_progress_listeners(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            size = self.test_file.stat().st_size
+            url = self.server.add("video.mp4", self.test_file.read_bytes())
+            (events, combined) = ([], [])
+            group = ProgressGroup([combined.append], rate=0)
+            anon = AnonFile(url=self.server.endpoint, listeners=[events.append, group], progress_rate=2)
+
+            # Act
+            with patch('src.anonfile.anonfile.Progress') as unobserved:
+                self.anon.download(url, directory, filename="unobserved.mp4")
+            start = time.perf_counter()
+            anon.download(url, directory, segments=4)
+            elapsed = time.perf_counter() - start
+            anon.upload(self.test_file, compress='gzip')
+            group.close()
+
+            # Assert
+            (download_events, upload_events) = ([event for event in events if event.operation == operation] for operation in ('download', 'upload'))
+            self.assertEqual(0, unobserved.call_count, msg="Progress was tracked without listeners.")
+            self.assertLessEqual(len(download_events), 2 + elapsed * 2, msg="Progress events weren't rate limited.")
+            self.assertEqual([False] * (len(download_events) - 1) + [True], [event.finished for event in download_events], msg="Error in finished property.")
+            self.assertEqual((size, size), (download_events[-1].completed, download_events[-1].total), msg="Error in download progress.")
+            self.assertEqual(size, upload_events[-1].completed, msg="Error in upload progress.")
+            self.assertTrue(upload_events[-1].note.startswith("ratio"), msg="Compression ratio wasn't reported.")
+            self.assertEqual((2 * size, 2 * size, True), (combined[-1].completed, combined[-1].total, combined[-1].finished), msg="Error in combined progress.")
+
+    def test_endpoint_failover(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            with socket.socket() as closed:
+                closed.bind(('127.0.0.1', 0))
+                dead_endpoint = f"http://127.0.0.1:{closed.getsockname()[1]}/api/"
+            path = Path(directory).joinpath("endpoints.json")
+            url = self.server.add("video.mp4", self.test_file.read_bytes())
+
+            # Act
+            with AnonFile(url=EndpointPool([dead_endpoint, self.server.endpoint], path=path)) as anon:
+                previews = [anon.preview(url) for _ in range(2)]
+                upload = anon.upload(self.test_file)
+                ranking = anon.endpoints.ranked()
+            persisted = EndpointPool([dead_endpoint, self.server.endpoint], path=path)
+
+            # Assert
+            self.assertTrue(all(preview.status for preview in previews), msg="Failover didn't reach the healthy endpoint.")
+            self.assertTrue(upload.status, msg="Upload wasn't routed to the healthy endpoint.")
+            self.assertEqual([self.server.endpoint, dead_endpoint], ranking, msg="Error in endpoint ranking.")
+            self.assertEqual(ranking, persisted.ranked(), msg="Health wasn't persisted.")
+            self.assertGreater(persisted.health[dead_endpoint]['errors'], 0, msg="Error in error rate.")
+
+    def test_retry_policy(self):
+        # Arrange
+        url = self.server.add("policy.txt", b"policy")
+        policy = RetryPolicy(breaker=CircuitBreaker(threshold=3, reset_timeout=60), budget=RetryBudget(capacity=3, ratio=0))
+        anon = AnonFile(url=self.server.endpoint, backoff_factor=0.01, retry_policy=policy)
+
+        # Act
+        self.server.fail(503, headers={'Retry-After': '1'})
+        self.server.fail(429)
+        start = time.perf_counter()
+        preview = anon.preview(url)
+        elapsed = time.perf_counter() - start
+        self.server.fail(503, count=2)
+        with self.assertRaises(requests.RequestException, msg="Retry budget wasn't enforced."):
+            anon.preview(url)
+        anon.retry_policy.budget.tokens = 0
+        self.server.fail(503, count=2)
+        for _ in range(2):
+            with self.assertRaises(requests.RequestException, msg="Server error wasn't raised."):
+                anon.preview(url)
+        requests_before = self.server.requests
+        with self.assertRaises(CircuitOpenError, msg="Circuit breaker didn't open."):
+            anon.preview(url)
+
+        # Assert
+        self.assertTrue(preview.status, msg="Request wasn't retried.")
+        self.assertGreaterEqual(elapsed, 1, msg="Retry-After header wasn't honored.")
+        self.assertEqual(requests_before, self.server.requests, msg="Request was sent while the circuit was open.")
+        self.assertEqual({'retry': 3, 'budget_exhausted': 3, 'breaker_trip': 1, 'breaker_rejection': 1}, dict(policy.counters), msg="Error in retry counters.")
+
+    def test_breaker_failures(self):
+        # Arrange
+        url = self.server.add("breaker.txt", b"breaker")
+        policy = RetryPolicy(breaker=CircuitBreaker(threshold=1, reset_timeout=60), budget=RetryBudget(capacity=0, ratio=0))
+        anon = AnonFile(url=self.server.endpoint, backoff_factor=0, retry_policy=policy)
+        host = "127.0.0.1"
+
+        # Act
+        self.server.fail(413)
+        with self.assertRaises(requests.RequestException, msg="Client error wasn't raised."):
+            anon.preview(url)
+        after_client_error = policy.breaker.state(host)
+        self.server.fail(429)
+        with self.assertRaises(requests.RequestException, msg="Rate limit wasn't raised."):
+            anon.preview(url)
+
+        # Assert
+        self.assertEqual('closed', after_client_error, msg="Client error tripped the circuit breaker.")
+        self.assertEqual('open', policy.breaker.state(host), msg="Rate limit didn't trip the circuit breaker.")
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "requires Unix sockets")
+    def test_spool_daemon(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            (spool, socket_path) = (Path(directory).joinpath("spool"), Path(directory).joinpath("anonfile.sock"))
+            urls = [self.server.add(f"spool{index}.txt", f"spool {index}".encode()) for index in range(3)]
+            # a job that was queued when the last daemon stopped
+            Journal(spool.joinpath("journal.jsonl")).append([{'id': "crashed:1", 'kind': 'download', 'target': urls[2], 'state': 'queued'}])
+            spool.joinpath("batch.txt").write_text(f"# nightly\n{urls[0]}\n{urls[1]}\n", encoding='utf-8')
+            spool.joinpath("files.upload").write_text(f"{self.test_file.resolve()}\n", encoding='utf-8')
+            daemon = SpoolDaemon(AnonFile(url=self.server.endpoint), spool, directory, jobs=2, interval=0.05, socket_path=socket_path)
+            thread = threading.Thread(target=daemon.serve)
+
+            # Act
+            thread.start()
+            deadline = time.monotonic() + 10
+            while daemon.stats()['done'] + daemon.stats()['failed'] < 4 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(str(socket_path))
+                client.sendall(b"stats\n")
+                stats = json.loads(client.makefile().readline())
+            daemon.stop()
+            thread.join()
+            records = Journal(spool.joinpath("journal.jsonl")).replay()
+
+            # Assert
+            self.assertEqual((4, 0, 0), (stats['done'], stats['failed'], stats['queued']), msg="Error in job statistics.")
+            self.assertGreaterEqual(stats['bytes'], 2 * len("spool 0") + len("spool 2") + self.test_file.stat().st_size, msg="Error in throughput statistics.")
+            self.assertEqual(b"spool 2", Path(directory).joinpath("spool2.txt").read_bytes(), msg="Journaled job wasn't resumed.")
+            self.assertEqual(['done'] * 4, [record['state'] for record in records.values()], msg="Error in journal.")
+            self.assertEqual(set(), set(path.name for path in spool.iterdir()) - {"journal.jsonl", "stats.json"}, msg="Job files weren't removed.")
+            self.assertFalse(socket_path.exists(), msg="Socket wasn't removed.")
+
+    def test_directory_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            source = Path(directory).joinpath("build")
+            source.joinpath("lib").mkdir(parents=True)
+            source.joinpath("cache").mkdir()
+            source.joinpath("lib", "video.mp4").write_bytes(self.test_file.read_bytes())
+            source.joinpath("lib", "notes.txt").write_text("notes", encoding='utf-8')
+            source.joinpath("cache", "stale.bin").write_bytes(b"stale")
+            target = Path(directory).joinpath("target")
+
+            # Act
+            upload = self.anon.upload(source, exclude=["cache", "*.txt"], compress='gzip', digest='md5')
+            download = self.anon.download(upload.url.geturl(), target, extract=True, digest='md5')
+
+            # Assert
+            self.assertEqual("build_tar_gz", str(upload.name), msg="Error in archive name.")
+            self.assertEqual(upload.digest, download.digest, msg="Checksums don't match.")
+            self.assertEqual(md5_checksum(self.test_file), md5_checksum(target.joinpath("build", "lib", "video.mp4")), msg="MD5 hash is corrupted.")
+            self.assertEqual(["build/lib/video.mp4"], [path.relative_to(target).as_posix() for path in target.rglob("*") if path.is_file()], msg="Error in include/exclude.")
+
+    def test_compression_round_trip(self):
+        for algorithm in ('gzip', 'zstd'):
+            with self.subTest(algorithm=algorithm), tempfile.TemporaryDirectory() as directory:
+                # Arrange
+                if algorithm == 'zstd' and importlib.util.find_spec('zstandard') is None:
+                    self.skipTest("zstandard is not installed")
+
+                # Act
+                upload = self.anon.upload(self.test_file, compress=algorithm, digest='sha256')
+                download = self.anon.download(upload.url.geturl(), directory, decompress=True, digest='sha256')
+
+                # Assert
+                self.assertTrue(str(upload.name).endswith(compression_suffixes[algorithm].replace('.', '_')), msg="Error in compressed file name.")
+                self.assertEqual(upload.digest, download.digest, msg="Checksums don't match.")
+                self.assertEqual(self.test_file.name, download.file_path.name, msg="Compression suffix wasn't removed.")
+                self.assertEqual(md5_checksum(self.test_file), md5_checksum(download.file_path), msg="MD5 hash is corrupted.")
+
+    def test_decompress_multi_member(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            url = self.server.add("members", gzip.compress(b"first ") + gzip.compress(b"second"))
+
+            # Act
+            download = self.anon.download(url, directory, decompress=True)
+
+            # Assert
+            self.assertEqual(b"first second", download.file_path.read_bytes(), msg="Error in detection by magic number.")
+
+    def test_extract_traversal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w') as archive:
+                info = tarfile.TarInfo("../escape.txt")
+                info.size = 4
+                archive.addfile(info, io.BytesIO(b"evil"))
+            url = self.server.add("evil.tar", buffer.getvalue())
+
+            # Act & Assert
+            with self.assertRaises(Exception, msg="Unsafe member was extracted."):
+                self.anon.download(url, Path(directory).joinpath("target"), extract=True)
+            self.assertFalse(Path(directory).joinpath("escape.txt").exists(), msg="Unsafe member was extracted.")
+
+    def test_upload_dedup(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            anon = AnonFile(url=self.server.endpoint, upload_cache=UploadCache(Path(directory).joinpath("uploads")))
+            first = anon.upload(self.test_file)
+            requests_before = self.server.requests
+
+            # Act
+            second = anon.upload(self.test_file, digest='sha256')
+            requests_made = self.server.requests - requests_before
+            del self.server.files[first.id]
+            third = anon.upload(self.test_file)
+            anon.close()
+
+            # Assert
+            self.assertEqual(first.id, second.id, msg="Duplicate was uploaded again.")
+            self.assertEqual(1, requests_made, msg="Duplicate check made unexpected requests.")
+            self.assertEqual(f"sha256:{hashlib.sha256(self.test_file.read_bytes()).hexdigest()}", second.digest, msg="Error in digest.")
+            self.assertNotEqual(first.id, third.id, msg="Deleted upload was not replaced.")
+
+    def test_shared_upload_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            path = Path(directory).joinpath("uploads.sqlite3")
+            neighbour = Path(directory).joinpath("uploads.txt")
+            neighbour.write_text("keep", encoding='utf-8')
+            # two instances stand in for two processes that share the cache
+            caches = [UploadCache(path) for _ in range(2)]
+            upload = self.anon.preview(self.server.add("shared.txt", b"shared"))
+
+            def write(cache: UploadCache, offset: int) -> None:
+                for index in range(offset, 100, 2):
+                    cache.set(f"sha256:{index}:1", upload)
+
+            # Act
+            threads = [threading.Thread(target=write, args=(cache, offset)) for (offset, cache) in enumerate(caches)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            written = len(caches[0].items())
+            caches[1].invalidate()
+            remaining = len(caches[0].items())
+            for cache in caches:
+                cache.close()
+
+            # Assert
+            self.assertEqual(100, written, msg="Concurrent writes were lost.")
+            self.assertEqual(0, remaining, msg="Error in invalidating all entries.")
+            self.assertTrue(neighbour.exists(), msg="Unrelated file was removed.")
+
+    def test_request_metrics(self):
+        # Arrange
+        records, sink, lines = [], PrometheusSink(), io.StringIO()
+        url = self.server.add("metrics.bin", bytes(256 * 1024))
+
+        # Act
+        with AnonFile(url=self.server.endpoint, observers=[records.append, sink, JSONLinesSink(lines)]) as anon:
+            download = anon.download(url, Path.cwd(), segments=2)
+        self.garbage.append(download.file_path)
+        first = json.loads(lines.getvalue().splitlines()[0])
+
+        # Assert
+        operations = [record.operation for record in records]
+        received = sum(record.bytes_received for record in records if record.operation == 'download')
+        self.assertEqual(['info', 'page', 'probe', 'download', 'download'], operations, msg="Unexpected requests.")
+        self.assertEqual(256 * 1024, received, msg="Error in bytes received.")
+        self.assertTrue(all(record.setup + record.ttfb <= record.duration for record in records), msg="Error in phase timings.")
+        self.assertIsNotNone(records[0].dns, msg="DNS resolution wasn't timed.")
+        self.assertIsNotNone(records[0].connect, msg="Connection wasn't timed.")
+        self.assertIsNone(records[0].tls, msg="Plain HTTP reported a TLS handshake.")
+        self.assertIsNone(records[1].connect, msg="Reused connection reported a connection setup.")
+        self.assertEqual(records[0].connect, first['connect'], msg="Error in JSON lines export.")
+        self.assertIn('anonfile_transferred_bytes_total{operation="download",direction="received"} 262144', sink.expose(), msg="Error in exposition.")
+        self.assertIn('anonfile_connect_seconds_count{operation="info"} 1', sink.expose(), msg="Connection setup wasn't exposed.")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.anon.close()
+        cls.server.stop()
+        for file in cls.garbage:
+            remove_file(file)
+
+
+class TestTransferLog(unittest.TestCase):
+    """Test cases for the structured transfer log."""
+
+    def test_rotation_and_queries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            path = Path(directory).joinpath("anonfile.log")
+            path.write_text("2023-07-18 10:00:00::download::https://example.com/a::b\n", encoding='utf-8')
+            handler = TransferLogHandler(path, max_bytes=2048, backup_count=3)
+            logger = logging.getLogger("test_transfer_log")
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+
+            # Act
+            legacy = TransferLog.parse(path.read_text(encoding='utf-8'))
+            for index in range(100):
+                logger.info('upload', extra={'transfer': {'url': f"https://anonfiles.com/id{index}/file_txt", 'id': f"id{index}", 'size': index}})
+            handler.close()
+            logger.removeHandler(handler)
+            log = TransferLog(path, backup_count=3)
+
+            # Assert
+            self.assertEqual("https://example.com/a::b", legacy['url'], msg="Error in parsing the old log format.")
+            self.assertEqual(4, len(log.files), msg="Error in log rotation.")
+            self.assertEqual(95, log.find("id95")['size'], msg="Error in index lookup.")
+            self.assertEqual(95, log.find("https://anonfiles.com/id95/file_txt")['size'], msg="Error in index lookup.")
+            self.assertIsNone(log.find("id0"), msg="Rotated records are still found.")
+            self.assertEqual([98, 99], [record['size'] for record in log.tail(2)], msg="Error in tail.")
+            self.assertEqual([90, 91], [record['size'] for record in log.records(grep=r'"id9[01]"')], msg="Error in grep.")
+            self.assertEqual([], list(log.records(since=datetime(2100, 1, 1))), msg="Error in since.")
+
+
+    def test_concurrent_writers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            path = Path(directory).joinpath("anonfile.log")
+            # two handlers stand in for two processes that share the log
+            handlers = [TransferLogHandler(path, max_bytes=16384, backup_count=5) for _ in range(2)]
+            loggers = [logging.getLogger(f"test_transfer_log_{index}") for index in range(2)]
+            for (logger, handler) in zip(loggers, handlers):
+                logger.addHandler(handler)
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+
+            def write(logger: logging.Logger, offset: int) -> None:
+                for index in range(offset, 200, 2):
+                    logger.info('download', extra={'transfer': {'url': f"https://anonfiles.com/id{index}/file_txt", 'id': f"id{index}", 'size': index}})
+
+            # Act
+            threads = [threading.Thread(target=write, args=(logger, offset)) for (offset, logger) in enumerate(loggers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for (logger, handler) in zip(loggers, handlers):
+                handler.close()
+                logger.removeHandler(handler)
+            log = TransferLog(path, backup_count=5)
+
+            # Assert
+            self.assertTrue(all(TransferLog.parse(line) for file in log.files for line in file.read_bytes().splitlines()), msg="Records were interleaved.")
+            self.assertEqual([199, 198], [log.find(f"id{index}")['size'] for index in (199, 198)], msg="Error in index lookup.")
+
+    def test_since_timezones(self):
+        with tempfile.TemporaryDirectory() as home:
+            # Arrange
+            path = Path(home).joinpath('.config', 'anonfile', 'anonfile.log')
+            path.parent.mkdir(parents=True)
+            lines = [{'timestamp': f"2023-07-0{day}T12:00:00", 'method': 'upload', 'url': f"https://anonfiles.com/day{day}/file_txt"} for day in (1, 2)]
+            path.write_text(''.join(json.dumps(line) + '\n' for line in lines), encoding='utf-8')
+            log = TransferLog(path)
+            env = {**os.environ, 'PYTHONPATH': str(Path.cwd().joinpath('src')), 'HOME': home, 'TZ': 'UTC'}
+            command = [sys.executable, '-c', "from anonfile import main; main()", 'log', '--read', '--since', '2023-07-02T00:00+00:00']
+            since = datetime(2023, 7, 2).astimezone(timezone.utc)
+
+            # Act
+            aware = [record['url'] for record in log.records(since=since)]
+            naive = [record['url'] for record in log.records(since=datetime(2023, 7, 2))]
+            process = subprocess.run(command, env=env, capture_output=True, check=False)
+
+            # Assert
+            self.assertEqual([lines[1]['url']], aware, msg="Error in offset-aware since.")
+            self.assertEqual([lines[1]['url']], naive, msg="Error in naive since.")
+            self.assertEqual(0, process.returncode, msg=process.stderr.decode())
+            self.assertIn(lines[1]['url'], process.stdout.decode(), msg="Error in CLI since.")
+            self.assertNotIn(lines[0]['url'], process.stdout.decode(), msg="Error in CLI since.")
+
+class TestImport(unittest.TestCase):
+    """Test cases for the import side effects of the anonfile package."""
+
+    def test_lazy_import(self):
+        # Arrange
+        heavy_modules = ['requests', 'requests_toolbelt', 'tqdm', 'urllib3', 'httpx']
+        code = f"import json, sys, anonfile; print(json.dumps([name for name in {heavy_modules!r} if name in sys.modules]))"
+
+        with tempfile.TemporaryDirectory() as home:
+            env = {**os.environ, 'HOME': home, 'LOCALAPPDATA': home, 'PYTHONPATH': str(Path("src").absolute())}
+
+            # Act
+            process = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+
+            # Assert
+            self.assertEqual([], json.loads(process.stdout), msg="Heavy modules are imported eagerly.")
+            self.assertEqual([], os.listdir(home), msg="Importing has side effects on the file system.")